@@ -2,6 +2,8 @@ from fastapi import FastAPI
 from services.database import DatabaseService
 from contextlib import asynccontextmanager
 from services.jwt_service import generate_and_store_secret_key
+from services.ubicaciones_cache import CatalogoUbicaciones
+from services.ubicaciones_writer import migrar_catalogo
 import os
 from routers.router import add_cors_middleware, router
 
@@ -10,7 +12,15 @@ async def lifespan(_):
     mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017")
     DatabaseService.connect(mongo_uri, "lacs")
     generate_and_store_secret_key()
+    # Catálogos cargados antes de las claves de búsqueda normalizadas
+    try:
+        await migrar_catalogo(DatabaseService.get_db())
+    except Exception as e:
+        print(f"Error migrando el catálogo de ubicaciones: {str(e)}")
+    # Catálogo de códigos postales en memoria para las consultas por CP
+    await CatalogoUbicaciones.iniciar(DatabaseService.get_db())
     yield
+    await CatalogoUbicaciones.detener()
 
 
 app = FastAPI(lifespan=lifespan)
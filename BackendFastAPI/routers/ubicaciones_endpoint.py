@@ -1,55 +1,138 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks, Depends
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel
-from typing import List, Dict, Optional
-import xml.etree.ElementTree as ET
+from typing import Callable, List, Dict, Optional, Tuple, TypeVar
+from datetime import datetime
+import asyncio
+import base64
+import binascii
+import json
 import os
-from services.database import get_database
+from services.database import DatabaseService, get_database
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from bson.errors import InvalidId
 from models.ubicacion_model import Ubicacion, Asentamiento
+from services.ubicaciones_parser import AgrupadorCP, normalizar_busqueda
+from services.ubicaciones_fuentes import NOMBRES_FUENTE, iter_filas, parsear_fuente
+from services.ubicaciones_artefacto import ARTEFACTO_PATH, cargar_artefacto, exportar_artefacto
+from services.ubicaciones_autocompletado import FIN_PREFIJO, LIMITE_MAXIMO
+from services.ubicaciones_cache import CatalogoUbicaciones
+from services.ubicaciones_http_cache import RutaCatalogo
+from services.ubicaciones_trigramas import LIMITE_MAXIMO as LIMITE_MAXIMO_DIFUSA, SIMILITUD_MINIMA
+from services.ubicaciones_jobs import (
+    CargaActiva,
+    CargaCancelada,
+    cancelar_job,
+    carga_exclusiva,
+    encolar_carga,
+    obtener_job,
+)
+from services.ubicaciones_writer import (
+    CLAVES_BUSQUEDA,
+    PROYECCION_PUBLICA,
+    aplicar_diferencias,
+    cargar_catalogo,
+    cargar_fuente,
+    obtener_metadatos,
+)
 
-router = APIRouter(prefix="/ubicaciones", tags=["ubicaciones"])
+# Las lecturas llevan ETag/Last-Modified por versión del catálogo y responden 304
+router = APIRouter(prefix="/ubicaciones", tags=["ubicaciones"], route_class=RutaCatalogo)
+
+# Procesos para el parseo paralelo del XML (0 = todos los núcleos disponibles)
+PARSE_WORKERS = int(os.getenv("UBICACIONES_PARSE_WORKERS", "0")) or None
+# Máximo de códigos postales por consulta en /cp/batch
+MAX_CPS_LOTE = 5000
+
+T = TypeVar("T")
 
 # Modelos de respuesta
+class RechazoCP(BaseModel):
+    codigo_postal: str
+    codigo_error: Optional[int] = None
+    mensaje: str
+
 class LoadStatusResponse(BaseModel):
     status: str
     message: str
     total_codigos_postales: int
     total_asentamientos: int
+    rechazados: List[RechazoCP] = []
+    version: Optional[int] = None
+    checksum_fuente: Optional[str] = None
+    duracion_segundos: Optional[float] = None
+    publicado: Optional[datetime] = None
     
 class LoadResponse(BaseModel):
     status: str
     message: str
     task_started: bool = False
+    job_id: Optional[str] = None
+
+class BatchCPRequest(BaseModel):
+    codigos_postales: List[str]
+
+class ResultadoCP(BaseModel):
+    codigo_postal: Optional[str] = None
+    encontrado: bool
+    ubicacion: Optional[Ubicacion] = None
+    error: Optional[str] = None
+
+class BatchCPResponse(BaseModel):
+    resultados: Dict[str, ResultadoCP]
+    encontrados: int
+    no_encontrados: int
+
+class DiffLoadResponse(BaseModel):
+    status: str
+    message: str
+    insertados: int
+    actualizados: int
+    eliminados: int
+    sin_cambios: int
 
 # Funciones auxiliares
 def find_xml_file() -> str:
-    """Buscar el archivo XML en múltiples ubicaciones posibles"""
-    possible_paths = [
+    """
+    Buscar el archivo fuente del catálogo en múltiples ubicaciones posibles.
+    
+    Se acepta el XML o el TXT de SEPOMEX, sin comprimir, en .gz o en .zip
+    (ver NOMBRES_FUENTE); en cada directorio se prefiere el más chico.
+    UBICACIONES_FUENTE fija una ruta explícita.
+    """
+    fuente = os.getenv("UBICACIONES_FUENTE")
+    if fuente:
+        if os.path.exists(fuente):
+            return fuente
+        raise HTTPException(status_code=404, detail=f"Archivo fuente no encontrado: {fuente} (UBICACIONES_FUENTE)")
+    
+    possible_dirs = [
         # Ruta relativa desde el archivo actual (desarrollo)
-        os.path.join(os.path.dirname(__file__), "../../CPdescarga.xml"),
+        os.path.join(os.path.dirname(__file__), "../.."),
         # Ruta desde la raíz del proyecto (Docker/producción)
-        "/app/CPdescarga.xml",
+        "/app",
         # Ruta desde el directorio actual
-        "./CPdescarga.xml",
+        ".",
         # Ruta desde el directorio padre
-        "../CPdescarga.xml",
+        "..",
         # Ruta absoluta común en Docker
-        "/app/BackendFastAPI/CPdescarga.xml",
+        "/app/BackendFastAPI",
         # Ruta en el directorio de trabajo
-        os.path.join(os.getcwd(), "CPdescarga.xml"),
+        os.getcwd(),
         # Ruta en el directorio padre del directorio de trabajo
-        os.path.join(os.path.dirname(os.getcwd()), "CPdescarga.xml")
+        os.path.dirname(os.getcwd())
     ]
     
-    for path in possible_paths:
-        if os.path.exists(path):
-            return path
+    for directory in possible_dirs:
+        for nombre in NOMBRES_FUENTE:
+            path = os.path.join(directory, nombre)
+            if os.path.exists(path):
+                return path
     
     # Si no se encuentra, crear mensaje de error detallado
-    error_msg = "Archivo XML no encontrado. Rutas verificadas:\n"
-    for path in possible_paths:
-        error_msg += f"  - {path} (existe: {os.path.exists(path)})\n"
+    error_msg = f"Archivo fuente no encontrado ({', '.join(NOMBRES_FUENTE)}). Directorios verificados:\n"
+    for directory in possible_dirs:
+        error_msg += f"  - {directory} (existe: {os.path.exists(directory)})\n"
     error_msg += f"\nDirectorio actual: {os.getcwd()}\n"
     error_msg += f"Directorio del script: {os.path.dirname(__file__)}\n"
     
@@ -68,101 +151,71 @@ def find_xml_file() -> str:
     
     raise HTTPException(status_code=404, detail=error_msg)
 
-def _get_element_text(parent, tag_name: str) -> str:
-    """Obtener texto de un elemento hijo, manejo seguro de None"""
-    # Intentar con namespace primero
-    namespace = {'ns': 'NewDataSet'}
-    element = parent.find(f'ns:{tag_name}', namespace)
-    
-    # Si no encuentra con namespace, intentar sin él
-    if element is None:
-        element = parent.find(tag_name)
-    
-    return element.text.strip() if element is not None and element.text else ""
+def _muestra_xml(xml_file_path: str, limit: int) -> Tuple[List[Dict], int]:
+    """Primeros `limit` registros crudos del archivo fuente y el total de registros (streaming)"""
+    samples = []
+    total_tables = 0
+    for fila in iter_filas(xml_file_path):
+        total_tables += 1
+        if len(samples) >= limit:
+            continue
+        
+        d_codigo_raw = fila.get('d_codigo', "")
+        samples.append({
+            "d_codigo_raw": repr(d_codigo_raw),  # usar repr para ver caracteres especiales
+            "d_codigo_cleaned": ''.join(filter(str.isdigit, d_codigo_raw)) if d_codigo_raw else "",
+            "d_CP_raw": repr(fila.get('d_CP', "")),
+            "municipio": fila.get('D_mnpio', ""),
+            "estado": fila.get('d_estado', ""),
+            "asentamiento": fila.get('d_asenta', "")
+        })
+    return samples, total_tables
 
-def parse_xml_to_ubicaciones(xml_file_path: str) -> List[Dict]:
-    """Parsear archivo XML y convertir a lista de ubicaciones agrupadas por CP"""
-    cp_dict = {}
-    
+def _status_desde_metadatos(status: str, message: str, metadatos: Dict) -> LoadStatusResponse:
+    """Respuesta de estado armada con los metadatos guardados del catálogo"""
+    return LoadStatusResponse(
+        status=status,
+        message=message,
+        total_codigos_postales=metadatos["total_codigos_postales"],
+        total_asentamientos=metadatos.get("total_asentamientos", 0),
+        version=metadatos.get("version"),
+        checksum_fuente=metadatos.get("checksum_fuente"),
+        duracion_segundos=metadatos.get("duracion_segundos"),
+        publicado=metadatos.get("publicado")
+    )
+
+def _carga_en_conflicto(e: Exception) -> HTTPException:
+    """409 para una carga rechazada por otra activa o cancelada mientras corría"""
+    if isinstance(e, CargaActiva):
+        job_id = str(e.job["_id"]) if e.job else None
+        return HTTPException(status_code=409, detail={"message": str(e), "job_id": job_id})
+    return HTTPException(status_code=409, detail="La carga fue cancelada; se conserva el catálogo actual")
+
+def parse_xml_to_ubicaciones(xml_file_path: str, parallel: bool = False) -> List[Dict]:
+    """Parsear el archivo fuente y convertir a lista de ubicaciones agrupadas por CP"""
     try:
-        tree = ET.parse(xml_file_path)
-        root = tree.getroot()
-        
-        # El XML tiene namespace, necesitamos buscarlo correctamente
-        # Buscar elementos table tanto con namespace como sin él
-        namespace = {'ns': 'NewDataSet'}
-        tables = root.findall('.//ns:table', namespace)
-        
-        # Si no encuentra con namespace, intentar sin él
-        if not tables:
-            tables = root.findall('.//table')
+        # En paralelo solo el XML sin comprimir (rangos de bytes en un pool de procesos);
+        # TXT y archivos comprimidos se leen en streaming
+        ubicaciones = parsear_fuente(xml_file_path, parallel, PARSE_WORKERS)
         
-        print(f"Encontradas {len(tables)} tablas en el XML")  # Debug
-        
-        for table in tables:
-            codigo_postal_raw = _get_element_text(table, 'd_codigo')
-            
-            if not codigo_postal_raw:
-                continue
-            
-            # Limpiar y validar código postal
-            codigo_postal = codigo_postal_raw.strip()
-            
-            # Remover espacios y caracteres no numéricos
-            codigo_postal = ''.join(filter(str.isdigit, codigo_postal))
-            
-            if not codigo_postal or len(codigo_postal) == 0:
-                continue
-            
-            # Normalizar código postal a 5 dígitos
-            codigo_postal = codigo_postal.zfill(5)
-            
-            # Crear estructura de asentamiento
-            asentamiento = {
-                'nombre': _get_element_text(table, 'd_asenta'),
-                'tipo': _get_element_text(table, 'd_tipo_asenta'),
-                'zona': _get_element_text(table, 'd_zona'),
-                'codigo_tipo': _get_element_text(table, 'c_tipo_asenta'),
-                'id_asentamiento': _get_element_text(table, 'id_asenta_cpcons')
-            }
-            
-            # Si el CP no existe, crear nuevo registro
-            if codigo_postal not in cp_dict:
-                cp_dict[codigo_postal] = {
-                    'codigo_postal': codigo_postal,
-                    'municipio': _get_element_text(table, 'D_mnpio'),
-                    'estado': _get_element_text(table, 'd_estado'),
-                    'ciudad': _get_element_text(table, 'd_ciudad'),
-                    'cp_oficina': _get_element_text(table, 'd_CP'),
-                    'codigo_estado': _get_element_text(table, 'c_estado'),
-                    'codigo_oficina': _get_element_text(table, 'c_oficina'),
-                    'codigo_cp': _get_element_text(table, 'c_CP'),
-                    'codigo_municipio': _get_element_text(table, 'c_mnpio'),
-                    'codigo_ciudad': _get_element_text(table, 'c_cve_ciudad'),
-                    'asentamientos': []
-                }
-            
-            # Agregar asentamiento si no está duplicado
-            asentamientos_existentes = [a['nombre'] for a in cp_dict[codigo_postal]['asentamientos']]
-            if asentamiento['nombre'] not in asentamientos_existentes:
-                cp_dict[codigo_postal]['asentamientos'].append(asentamiento)
+        print(f"Agrupados {len(ubicaciones)} códigos postales de {os.path.basename(xml_file_path)}")  # Debug
         
-        return list(cp_dict.values())
+        return ubicaciones
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error parseando XML: {str(e)}")
 
-async def load_ubicaciones_to_db(db: AsyncIOMotorDatabase) -> Dict:
+async def load_ubicaciones_to_db(db: AsyncIOMotorDatabase, parallel: bool = False, progreso=None) -> Dict:
     """Cargar ubicaciones desde XML a la base de datos"""
-    collection = db.ubicaciones
-    
     try:
         # Buscar archivo XML
         xml_file_path = find_xml_file()
         print(f"Archivo XML encontrado en: {xml_file_path}")  # Log para debug
         
-        # Parsear XML
-        ubicaciones = parse_xml_to_ubicaciones(xml_file_path)
+        # Parsear XML en el executor para no bloquear el event loop
+        ubicaciones = await asyncio.get_running_loop().run_in_executor(
+            None, parse_xml_to_ubicaciones, xml_file_path, parallel
+        )
         
         if not ubicaciones:
             raise HTTPException(
@@ -172,85 +225,22 @@ async def load_ubicaciones_to_db(db: AsyncIOMotorDatabase) -> Dict:
         
         print(f"Ubicaciones parseadas: {len(ubicaciones)}")  # Debug
         
-        # Limpiar colección existente
-        print("Limpiando colección existente...")
-        await collection.delete_many({})
-        
-        # Insertar en lotes más pequeños con manejo de timeouts
-        batch_size = 100  # Reducido de 1000 a 100
-        total_inserted = 0
-        total_batches = (len(ubicaciones) + batch_size - 1) // batch_size
-        
-        print(f"Insertando {len(ubicaciones)} ubicaciones en {total_batches} lotes de {batch_size}...")
-        
-        for i in range(0, len(ubicaciones), batch_size):
-            batch = ubicaciones[i:i + batch_size]
-            batch_number = (i // batch_size) + 1
-            
-            try:
-                # Configurar timeout más largo para la operación
-                result = await collection.insert_many(
-                    batch, 
-                    ordered=False,  # Continúa aunque falle un documento
-                    bypass_document_validation=False
-                )
-                total_inserted += len(result.inserted_ids)
-                
-                # Log de progreso cada 10 lotes
-                if batch_number % 10 == 0:
-                    print(f"Procesado lote {batch_number}/{total_batches} - Insertados: {total_inserted}")
-                    
-            except Exception as batch_error:
-                print(f"Error en lote {batch_number}: {str(batch_error)}")
-                # Intentar insertar uno por uno si falla el lote
-                for doc in batch:
-                    try:
-                        await collection.insert_one(doc)
-                        total_inserted += 1
-                    except Exception as doc_error:
-                        print(f"Error insertando documento: {str(doc_error)[:100]}...")
-                        continue
-        
-        print(f"Inserción completada. Total insertado: {total_inserted}")
-        
-        # Crear índices de forma asíncrona
-        print("Creando índices...")
-        try:
-            # Crear índices uno por uno para evitar timeouts
-            await collection.create_index("codigo_postal", unique=True, background=True)
-            print("Índice de código postal creado")
-            
-            await collection.create_index([("estado", 1), ("municipio", 1)], background=True)
-            print("Índice de estado-municipio creado")
-            
-            await collection.create_index("asentamientos.nombre", background=True)
-            print("Índice de asentamientos creado")
-            
-        except Exception as index_error:
-            print(f"Error creando índices: {str(index_error)}")
-            # Los índices no son críticos, continuar sin ellos
-        
-        # Contar asentamientos totales con timeout
-        print("Contando asentamientos...")
-        try:
-            pipeline = [
-                {"$unwind": "$asentamientos"},
-                {"$count": "total_asentamientos"}
-            ]
-            # Configurar timeout para la agregación
-            result = await collection.aggregate(pipeline).to_list(1)
-            total_asentamientos = result[0]['total_asentamientos'] if result else 0
-        except Exception as count_error:
-            print(f"Error contando asentamientos: {str(count_error)}")
-            total_asentamientos = 0  # Usar 0 si falla el conteo
+        # Construir el catálogo en la colección sombra con el perfil de carga
+        # masiva; la colección en vivo sigue respondiendo hasta el cambio final
+        resultado = await cargar_catalogo(
+            db, DatabaseService.get_bulk_db(), ubicaciones, progreso=progreso, fuente=xml_file_path
+        )
+        print(f"Inserción completada. Total publicado: {resultado['total_codigos_postales']}")
         
         return {
-            "total_codigos_postales": total_inserted,
-            "total_asentamientos": total_asentamientos,
-            "message": "Ubicaciones cargadas exitosamente"
+            "total_codigos_postales": resultado["total_codigos_postales"],
+            "total_asentamientos": resultado["total_asentamientos"],
+            "version": resultado["version"],
+            "message": "Ubicaciones cargadas exitosamente",
+            "rechazados": resultado["rechazados"]
         }
         
-    except HTTPException:
+    except (HTTPException, CargaCancelada):
         raise
     except Exception as e:
         print(f"Error general cargando ubicaciones: {str(e)}")
@@ -260,15 +250,15 @@ async def load_ubicaciones_to_db(db: AsyncIOMotorDatabase) -> Dict:
 @router.get("/status", response_model=LoadStatusResponse, summary="Verificar estado de carga de ubicaciones")
 async def get_load_status(db: AsyncIOMotorDatabase = Depends(get_database)):
     """
-    Verificar si las ubicaciones ya están cargadas en la base de datos
+    Verificar si las ubicaciones ya están cargadas en la base de datos.
+    
+    Los totales salen del documento de metadatos que escribe cada carga,
+    sin recorrer la colección.
     """
     try:
-        collection = db.ubicaciones
+        metadatos = await obtener_metadatos(db)
         
-        # Contar documentos
-        total_codigos_postales = await collection.count_documents({})
-        
-        if total_codigos_postales == 0:
+        if not metadatos:
             return LoadStatusResponse(
                 status="empty",
                 message="No hay ubicaciones cargadas en la base de datos",
@@ -276,20 +266,7 @@ async def get_load_status(db: AsyncIOMotorDatabase = Depends(get_database)):
                 total_asentamientos=0
             )
         
-        # Contar asentamientos totales
-        pipeline = [
-            {"$unwind": "$asentamientos"},
-            {"$count": "total_asentamientos"}
-        ]
-        result = await collection.aggregate(pipeline).to_list(1)
-        total_asentamientos = result[0]['total_asentamientos'] if result else 0
-        
-        return LoadStatusResponse(
-            status="loaded",
-            message="Ubicaciones ya están cargadas",
-            total_codigos_postales=total_codigos_postales,
-            total_asentamientos=total_asentamientos
-        )
+        return _status_desde_metadatos("loaded", "Ubicaciones ya están cargadas", metadatos)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error verificando estado: {str(e)}")
@@ -297,210 +274,166 @@ async def get_load_status(db: AsyncIOMotorDatabase = Depends(get_database)):
 @router.post("/load", response_model=LoadResponse, summary="Cargar ubicaciones desde XML")
 async def load_ubicaciones(
     force_reload: bool = False,
-    background_tasks: BackgroundTasks = BackgroundTasks(),
+    parallel: bool = False,
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
     """
-    Cargar ubicaciones desde el archivo XML a la base de datos.
+    Encolar la carga de ubicaciones desde el archivo XML.
     
     - **force_reload**: Si es True, recarga los datos aunque ya existan
-    - La carga se ejecuta en segundo plano para archivos grandes
+    - **parallel**: Si es True, parsea el XML en varios procesos
+    - La carga la ejecuta el worker (`python worker.py`), fuera del proceso de la API.
+      Solo puede haber una carga activa; el progreso se consulta en /ubicaciones/jobs/{job_id}
     """
     try:
-        collection = db.ubicaciones
-        
         # Verificar si ya existen datos
-        existing_count = await collection.count_documents({})
+        metadatos = await obtener_metadatos(db)
         
-        if existing_count > 0 and not force_reload:
+        if metadatos and not force_reload:
             return LoadResponse(
                 status="already_loaded",
-                message=f"Ya existen {existing_count} códigos postales. Use force_reload=true para recargar."
+                message=f"Ya existen {metadatos['total_codigos_postales']} códigos postales. Use force_reload=true para recargar."
             )
         
-        # Ejecutar carga en segundo plano
-        background_tasks.add_task(load_ubicaciones_to_db, db)
+        # Resolver el archivo aquí para fallar antes de encolar
+        xml_file_path = find_xml_file()
+        
+        job, creado = await encolar_carga(db, {
+            "xml_file_path": xml_file_path,
+            "parallel": parallel,
+            "workers": PARSE_WORKERS
+        })
+        
+        if not creado:
+            return LoadResponse(
+                status="already_running",
+                message="Ya hay una carga de ubicaciones activa",
+                job_id=str(job["_id"])
+            )
         
         return LoadResponse(
-            status="loading",
-            message="Carga de ubicaciones iniciada en segundo plano",
-            task_started=True
+            status="queued",
+            message="Carga de ubicaciones encolada para el worker",
+            task_started=True,
+            job_id=str(job["_id"])
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error iniciando carga: {str(e)}")
 
+def _serializar_job(job: Dict) -> Dict:
+    """Convertir el documento del job a una respuesta JSON"""
+    job["id"] = str(job.pop("_id"))
+    job.pop("activo", None)
+    if "checkpoint" in job:
+        # Los CPs rezagados solo sirven para reanudar; se muestra la posición
+        job["checkpoint"].pop("rezagados", None)
+    return job
+
+@router.get("/jobs/{job_id}", summary="Consultar el progreso de una carga")
+async def get_load_job(job_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
+    """
+    Estado y progreso (filas parseadas, documentos escritos, filas/s) de una carga encolada.
+    """
+    try:
+        job = await obtener_job(db, job_id)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="ID de job inválido")
+    
+    if not job:
+        raise HTTPException(status_code=404, detail="Job no encontrado")
+    
+    return _serializar_job(job)
+
+@router.post("/jobs/{job_id}/cancel", summary="Cancelar una carga")
+async def cancel_load_job(job_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
+    """
+    Cancelar una carga. Si ya se está ejecutando, el worker la aborta en su
+    siguiente reporte de progreso y el catálogo actual se conserva.
+    """
+    try:
+        job = await cancelar_job(db, job_id)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="ID de job inválido")
+    
+    if not job:
+        raise HTTPException(status_code=404, detail="Job no encontrado")
+    
+    return _serializar_job(job)
+
 @router.post("/load-sync", response_model=LoadStatusResponse, summary="Cargar ubicaciones síncronamente")
 async def load_ubicaciones_sync(
     force_reload: bool = False,
+    parallel: bool = False,
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
     """
     Cargar ubicaciones síncronamente (espera a que termine).
     Recomendado solo para testing o archivos pequeños.
+    
+    - **parallel**: Si es True, parsea el XML en varios procesos
     """
     try:
-        collection = db.ubicaciones
-        
         # Verificar si ya existen datos
-        existing_count = await collection.count_documents({})
-        
-        if existing_count > 0 and not force_reload:
-            # Contar asentamientos
-            pipeline = [
-                {"$unwind": "$asentamientos"},
-                {"$count": "total_asentamientos"}
-            ]
-            result = await collection.aggregate(pipeline).to_list(1)
-            total_asentamientos = result[0]['total_asentamientos'] if result else 0
-            
-            return LoadStatusResponse(
-                status="already_loaded",
-                message=f"Ya existen {existing_count} códigos postales",
-                total_codigos_postales=existing_count,
-                total_asentamientos=total_asentamientos
+        metadatos = await obtener_metadatos(db)
+        
+        if metadatos and not force_reload:
+            return _status_desde_metadatos(
+                "already_loaded",
+                f"Ya existen {metadatos['total_codigos_postales']} códigos postales",
+                metadatos
             )
         
-        # Ejecutar carga síncronamente
-        result = await load_ubicaciones_to_db(db)
+        # Ejecutar carga síncronamente con el mismo candado que las cargas encoladas
+        async with carga_exclusiva(db, "/load-sync") as latido:
+            result = await load_ubicaciones_to_db(db, parallel=parallel, progreso=latido)
+        await CatalogoUbicaciones.refrescar(db)
         
         return LoadStatusResponse(
             status="loaded",
             message=result["message"],
             total_codigos_postales=result["total_codigos_postales"],
-            total_asentamientos=result["total_asentamientos"]
+            total_asentamientos=result["total_asentamientos"],
+            rechazados=result["rechazados"],
+            version=result["version"]
         )
         
     except HTTPException:
         raise
+    except (CargaActiva, CargaCancelada) as e:
+        raise _carga_en_conflicto(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error en carga síncrona: {str(e)}")
 
-async def load_ubicaciones_streaming(db: AsyncIOMotorDatabase) -> Dict:
+async def load_ubicaciones_streaming(db: AsyncIOMotorDatabase, progreso=None) -> Dict:
     """Cargar ubicaciones procesando el XML de forma streaming para evitar timeout"""
-    collection = db.ubicaciones
-    
     try:
         xml_file_path = find_xml_file()
         print(f"Iniciando carga streaming desde: {xml_file_path}")
         
-        # Limpiar colección existente
-        await collection.delete_many({})
-        
-        # Procesar XML de forma streaming
-        cp_dict = {}
-        batch = []
-        batch_size = 50  # Lotes muy pequeños
-        total_processed = 0
-        total_inserted = 0
-        
-        tree = ET.parse(xml_file_path)
-        root = tree.getroot()
-        
-        # Buscar elementos table
-        namespace = {'ns': 'NewDataSet'}
-        tables = root.findall('.//ns:table', namespace)
-        if not tables:
-            tables = root.findall('.//table')
-        
-        print(f"Procesando {len(tables)} registros en modo streaming...")
+        # Procesar la fuente en streaming: solo se mantienen en memoria los lotes en vuelo.
+        # Se escribe en la colección sombra con el perfil de carga masiva; si una
+        # carga anterior del mismo archivo se interrumpió, continúa desde su checkpoint
+        agrupador = AgrupadorCP()
+        resultado = await cargar_fuente(
+            db, DatabaseService.get_bulk_db(), xml_file_path, agrupador=agrupador, progreso=progreso
+        )
         
-        for idx, table in enumerate(tables):
-            total_processed += 1
-            
-            codigo_postal_raw = _get_element_text(table, 'd_codigo')
-            if not codigo_postal_raw:
-                continue
-            
-            # Limpiar código postal
-            codigo_postal = ''.join(filter(str.isdigit, codigo_postal_raw.strip()))
-            if not codigo_postal:
-                continue
-            codigo_postal = codigo_postal.zfill(5)
-            
-            # Crear estructura de asentamiento
-            asentamiento = {
-                'nombre': _get_element_text(table, 'd_asenta'),
-                'tipo': _get_element_text(table, 'd_tipo_asenta'),
-                'zona': _get_element_text(table, 'd_zona'),
-                'codigo_tipo': _get_element_text(table, 'c_tipo_asenta'),
-                'id_asentamiento': _get_element_text(table, 'id_asenta_cpcons')
-            }
-            
-            # Agregar al diccionario temporal
-            if codigo_postal not in cp_dict:
-                cp_dict[codigo_postal] = {
-                    'codigo_postal': codigo_postal,
-                    'municipio': _get_element_text(table, 'D_mnpio'),
-                    'estado': _get_element_text(table, 'd_estado'),
-                    'ciudad': _get_element_text(table, 'd_ciudad'),
-                    'cp_oficina': _get_element_text(table, 'd_CP'),
-                    'codigo_estado': _get_element_text(table, 'c_estado'),
-                    'codigo_oficina': _get_element_text(table, 'c_oficina'),
-                    'codigo_cp': _get_element_text(table, 'c_CP'),
-                    'codigo_municipio': _get_element_text(table, 'c_mnpio'),
-                    'codigo_ciudad': _get_element_text(table, 'c_cve_ciudad'),
-                    'asentamientos': []
-                }
-            
-            # Agregar asentamiento si no está duplicado
-            asentamientos_existentes = [a['nombre'] for a in cp_dict[codigo_postal]['asentamientos']]
-            if asentamiento['nombre'] not in asentamientos_existentes:
-                cp_dict[codigo_postal]['asentamientos'].append(asentamiento)
-            
-            # Insertar en lotes pequeños frecuentemente
-            if len(cp_dict) >= batch_size:
-                batch = list(cp_dict.values())
-                try:
-                    result = await collection.insert_many(batch, ordered=False)
-                    total_inserted += len(result.inserted_ids)
-                    cp_dict.clear()  # Limpiar diccionario
-                    
-                    if total_inserted % 500 == 0:
-                        print(f"Insertados {total_inserted} CPs, procesados {total_processed} registros")
-                        
-                except Exception as batch_error:
-                    print(f"Error en lote streaming: {str(batch_error)}")
-                    # Insertar uno por uno si falla
-                    for doc in batch:
-                        try:
-                            await collection.insert_one(doc)
-                            total_inserted += 1
-                        except:
-                            continue
-                    cp_dict.clear()
-        
-        # Insertar último lote
-        if cp_dict:
-            batch = list(cp_dict.values())
-            try:
-                result = await collection.insert_many(batch, ordered=False)
-                total_inserted += len(result.inserted_ids)
-            except Exception as final_error:
-                print(f"Error en lote final: {str(final_error)}")
-                for doc in batch:
-                    try:
-                        await collection.insert_one(doc)
-                        total_inserted += 1
-                    except:
-                        continue
-        
-        print(f"Carga streaming completada. Total insertado: {total_inserted}")
-        
-        # Crear índices de forma segura
-        try:
-            await collection.create_index("codigo_postal", unique=True, background=True)
-            await collection.create_index([("estado", 1), ("municipio", 1)], background=True)
-            await collection.create_index("asentamientos.nombre", background=True)
-        except Exception as index_error:
-            print(f"Advertencia - Error creando índices: {str(index_error)}")
+        print(f"Carga streaming completada. Total publicado: {resultado['total_codigos_postales']} "
+              f"({agrupador.filas_procesadas} registros leídos)")
         
         return {
-            "total_codigos_postales": total_inserted,
-            "total_asentamientos": 0,  # Se calculará después si es necesario
-            "message": "Ubicaciones cargadas exitosamente con método streaming"
+            "total_codigos_postales": resultado["total_codigos_postales"],
+            "total_asentamientos": resultado["total_asentamientos"],
+            "version": resultado["version"],
+            "message": "Ubicaciones cargadas exitosamente con método streaming",
+            "rechazados": resultado["rechazados"]
         }
         
+    except (HTTPException, CargaCancelada):
+        raise
     except Exception as e:
         print(f"Error en carga streaming: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error en carga streaming: {str(e)}")
@@ -515,85 +448,407 @@ async def load_ubicaciones_streaming_endpoint(
     Recomendado para evitar timeouts con archivos de muchos registros.
     """
     try:
-        collection = db.ubicaciones
-        
         # Verificar si ya existen datos
-        existing_count = await collection.count_documents({})
+        metadatos = await obtener_metadatos(db)
         
-        if existing_count > 0 and not force_reload:
-            # Contar asentamientos
-            try:
-                pipeline = [
-                    {"$unwind": "$asentamientos"},
-                    {"$count": "total_asentamientos"}
-                ]
-                result = await collection.aggregate(pipeline).to_list(1)
-                total_asentamientos = result[0]['total_asentamientos'] if result else 0
-            except:
-                total_asentamientos = 0
-            
-            return LoadStatusResponse(
-                status="already_loaded",
-                message=f"Ya existen {existing_count} códigos postales",
-                total_codigos_postales=existing_count,
-                total_asentamientos=total_asentamientos
+        if metadatos and not force_reload:
+            return _status_desde_metadatos(
+                "already_loaded",
+                f"Ya existen {metadatos['total_codigos_postales']} códigos postales",
+                metadatos
             )
         
-        # Ejecutar carga streaming
-        result = await load_ubicaciones_streaming(db)
+        # Ejecutar carga streaming con el mismo candado que las cargas encoladas
+        async with carga_exclusiva(db, "/load-streaming") as latido:
+            result = await load_ubicaciones_streaming(db, progreso=latido)
+        await CatalogoUbicaciones.refrescar(db)
         
         return LoadStatusResponse(
             status="loaded",
             message=result["message"],
             total_codigos_postales=result["total_codigos_postales"],
-            total_asentamientos=result["total_asentamientos"]
+            total_asentamientos=result["total_asentamientos"],
+            rechazados=result["rechazados"],
+            version=result["version"]
+        )
+        
+    except HTTPException:
+        raise
+    except (CargaActiva, CargaCancelada) as e:
+        raise _carga_en_conflicto(e)
+
+@router.post("/load-diff", response_model=DiffLoadResponse, summary="Recargar solo los códigos postales que cambiaron")
+async def load_ubicaciones_diff(
+    parallel: bool = False,
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """
+    Recarga diferencial: compara el hash de contenido de cada CP del XML con
+    el guardado en la base de datos y aplica solo altas, cambios y bajas en
+    un único bulk_write. Si nada cambió no se escribe ni se toca ningún índice.
+    
+    - **parallel**: Si es True, parsea el XML en varios procesos
+    """
+    try:
+        xml_file_path = find_xml_file()
+        
+        # Escribe sobre la colección en vivo: no puede correr junto con otra carga
+        async with carga_exclusiva(db, "/load-diff"):
+            ubicaciones = await asyncio.get_running_loop().run_in_executor(
+                None, parse_xml_to_ubicaciones, xml_file_path, parallel
+            )
+            
+            if not ubicaciones:
+                raise HTTPException(
+                    status_code=400, 
+                    detail="No se encontraron ubicaciones válidas en el archivo XML"
+                )
+            
+            resumen = await aplicar_diferencias(db.ubicaciones, ubicaciones, fuente=xml_file_path)
+        print(f"Recarga diferencial: {resumen}")
+        await CatalogoUbicaciones.refrescar(db)
+        
+        cambios = resumen["insertados"] + resumen["actualizados"] + resumen["eliminados"]
+        return DiffLoadResponse(
+            status="updated" if cambios else "unchanged",
+            message=f"{cambios} códigos postales modificados" if cambios else "El catálogo ya estaba actualizado",
+            **resumen
+        )
+        
+    except HTTPException:
+        raise
+    except (CargaActiva, CargaCancelada) as e:
+        raise _carga_en_conflicto(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error en recarga diferencial: {str(e)}")
+
+def _artefacto_configurado() -> str:
+    """Ruta del artefacto o HTTPException si está desactivado"""
+    if not ARTEFACTO_PATH:
+        raise HTTPException(status_code=400, detail="El artefacto está desactivado (UBICACIONES_ARTEFACTO_PATH vacío)")
+    return ARTEFACTO_PATH
+
+@router.post("/load-artifact", response_model=LoadStatusResponse, summary="Restaurar ubicaciones desde el artefacto precompilado")
+async def load_ubicaciones_artefacto(
+    force_reload: bool = False,
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """
+    Restaurar el catálogo desde el artefacto (documentos BSON comprimidos)
+    sin parsear el XML. Usa el mismo pipeline de escritura y publicación
+    que las demás cargas.
+    
+    - **force_reload**: Si es True, restaura aunque ya existan datos
+    """
+    try:
+        metadatos = await obtener_metadatos(db)
+        
+        if metadatos and not force_reload:
+            return _status_desde_metadatos(
+                "already_loaded",
+                f"Ya existen {metadatos['total_codigos_postales']} códigos postales",
+                metadatos
+            )
+        
+        path = _artefacto_configurado()
+        if not os.path.exists(path):
+            raise HTTPException(status_code=404, detail=f"Artefacto no encontrado: {path}")
+        
+        async with carga_exclusiva(db, "/load-artifact") as latido:
+            resultado = await cargar_artefacto(db, DatabaseService.get_bulk_db(), path, progreso=latido)
+        await CatalogoUbicaciones.refrescar(db)
+        
+        return LoadStatusResponse(
+            status="loaded",
+            message="Ubicaciones restauradas desde el artefacto",
+            total_codigos_postales=resultado["total_codigos_postales"],
+            total_asentamientos=resultado["total_asentamientos"],
+            rechazados=resultado["rechazados"],
+            version=resultado["version"]
         )
         
     except HTTPException:
         raise
+    except (CargaActiva, CargaCancelada) as e:
+        raise _carga_en_conflicto(e)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Artefacto inválido: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error restaurando el artefacto: {str(e)}")
+
+@router.post("/artifact/export", summary="Exportar el catálogo publicado al artefacto precompilado")
+async def export_ubicaciones_artefacto(db: AsyncIOMotorDatabase = Depends(get_database)):
+    """
+    Escribir el catálogo publicado en el artefacto (UBICACIONES_ARTEFACTO_PATH).
+    El worker lo regenera al terminar cada carga.
+    """
+    try:
+        path = _artefacto_configurado()
+        encabezado = await exportar_artefacto(db, path)
+        
+        if encabezado is None:
+            raise HTTPException(status_code=404, detail="No hay catálogo publicado para exportar")
+        
+        return {
+            "path": path,
+            "file_size_bytes": os.path.getsize(path),
+            "version": encabezado.get("version"),
+            "total_codigos_postales": encabezado["total_codigos_postales"],
+            "total_asentamientos": encabezado["total_asentamientos"]
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error exportando el artefacto: {str(e)}")
+
+def _indice_disponible(obtener: Callable[[], Optional[T]]) -> T:
+    """Índice en memoria del catálogo, o 503 si aún no se ha construido"""
+    indice = obtener()
+    if indice is None:
+        raise HTTPException(
+            status_code=503,
+            detail="El catálogo de ubicaciones no está disponible en memoria"
+        )
+    return indice
+
+@router.get("/autocomplete", summary="Autocompletar códigos postales y asentamientos")
+async def autocomplete_ubicaciones(q: str, limit: int = 10):
+    """
+    Sugerencias para formularios de dirección mientras el usuario escribe.
+    
+    - **q**: Dígitos iniciales de un CP, o el inicio de un nombre de asentamiento
+      (sin importar acentos ni mayúsculas; coincide al inicio de cualquier palabra)
+    - **limit**: Número máximo de sugerencias (default: 10, max: 50)
+    
+    Se responde desde el índice en memoria, sin consultar MongoDB.
+    """
+    consulta = q.strip()
+    if not consulta:
+        raise HTTPException(status_code=400, detail="El parámetro 'q' no puede estar vacío")
+    
+    # Validar límites
+    limit = max(1, min(limit, LIMITE_MAXIMO))
+    
+    indice = _indice_disponible(CatalogoUbicaciones.autocompletado)
+    
+    codigos_postales = []
+    asentamientos = []
+    digitos = consulta.replace(" ", "")
+    if digitos.isdigit():
+        if len(digitos) <= 5:
+            codigos_postales = indice.buscar_codigos(digitos, limit)
+    else:
+        asentamientos = indice.buscar_asentamientos(consulta, limit)
+    
+    return {
+        "query": consulta,
+        "codigos_postales": codigos_postales,
+        "asentamientos": asentamientos
+    }
+
+@router.get("/estados", summary="Listar estados")
+async def list_estados():
+    """
+    Estados del catálogo, ordenados por nombre, para el primer selector de dirección.
+    
+    Respuesta precalculada al cargar el catálogo.
+    """
+    jerarquia = _indice_disponible(CatalogoUbicaciones.jerarquia)
+    return Response(content=jerarquia.estados(), media_type="application/json")
+
+@router.get("/estados/{codigo_estado}/municipios", summary="Listar municipios de un estado")
+async def list_municipios(codigo_estado: str):
+    """
+    Municipios de un estado, ordenados por nombre.
+    
+    - **codigo_estado**: Código del estado (c_estado de SEPOMEX, por ejemplo "09")
+    """
+    contenido = _indice_disponible(CatalogoUbicaciones.jerarquia).municipios(codigo_estado)
+    if contenido is None:
+        raise HTTPException(status_code=404, detail=f"No se encontró el estado {codigo_estado}")
+    return Response(content=contenido, media_type="application/json")
+
+@router.get(
+    "/estados/{codigo_estado}/municipios/{codigo_municipio}/codigos-postales",
+    summary="Listar códigos postales de un municipio"
+)
+async def list_codigos_postales_municipio(codigo_estado: str, codigo_municipio: str):
+    """
+    Códigos postales de un municipio con sus asentamientos (nombre y tipo).
+    
+    - **codigo_estado**: Código del estado (por ejemplo "09")
+    - **codigo_municipio**: Código del municipio dentro del estado (por ejemplo "015")
+    """
+    contenido = _indice_disponible(CatalogoUbicaciones.jerarquia).codigos_postales(codigo_estado, codigo_municipio)
+    if contenido is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"No se encontró el municipio {codigo_municipio} del estado {codigo_estado}"
+        )
+    return Response(content=contenido, media_type="application/json")
+
+@router.get("/buscar/asentamiento", summary="Buscar asentamientos por nombre con tolerancia a errores")
+async def buscar_asentamientos(
+    q: str,
+    estado: Optional[str] = None,
+    municipio: Optional[str] = None,
+    limit: int = 10,
+    min_similitud: float = SIMILITUD_MINIMA
+):
+    """
+    Búsqueda difusa de asentamientos (colonias) por nombre.
+    
+    - **q**: Nombre o parte del nombre; tolera errores de dedo y acentos faltantes
+      ("guadalupe in" encuentra "Guadalupe Inn", "Alamos" encuentra "Álamos")
+    - **estado**: Filtrar por estado (opcional)
+    - **municipio**: Filtrar por municipio (opcional)
+    - **limit**: Número máximo de resultados (default: 10, max: 50)
+    - **min_similitud**: Similitud mínima entre 0 y 1 (default: 0.3)
+    
+    Se responde desde un índice de trigramas en memoria, ordenado por similitud.
+    """
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="El parámetro 'q' no puede estar vacío")
+    
+    # Validar límites
+    limit = max(1, min(limit, LIMITE_MAXIMO_DIFUSA))
+    min_similitud = max(0.0, min(min_similitud, 1.0))
+    
+    indice = _indice_disponible(CatalogoUbicaciones.trigramas)
+    
+    resultados = indice.buscar(
+        q,
+        estado=estado,
+        municipio=municipio,
+        limite=limit,
+        similitud_minima=min_similitud
+    )
+    
+    return {
+        "query": q.strip(),
+        "resultados": resultados,
+        "total": len(resultados)
+    }
+
+def _codificar_cursor(ubicacion: Dict) -> str:
+    """Token opaco con la posición del último CP de la página"""
+    posicion = json.dumps([normalizar_busqueda(ubicacion["estado"]), ubicacion["codigo_postal"]])
+    return base64.urlsafe_b64encode(posicion.encode("utf-8")).decode("ascii").rstrip("=")
+
+def _decodificar_cursor(after: str) -> Tuple[str, str]:
+    try:
+        relleno = "=" * (-len(after) % 4)
+        clave_estado, codigo_postal = json.loads(base64.urlsafe_b64decode(after + relleno))
+        if not isinstance(clave_estado, str) or not isinstance(codigo_postal, str):
+            raise ValueError(after)
+        return clave_estado, codigo_postal
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="El parámetro 'after' no es un cursor válido")
+
+# Totales por estado de cada versión publicada del catálogo: (versión, clave) -> total
+_totales_estado: Dict[Tuple[int, str], int] = {}
+MAX_TOTALES_ESTADO = 256
+
+async def _contar_por_estado(db: AsyncIOMotorDatabase, clave: str, query: Dict) -> int:
+    """
+    Contar los CPs de un estado; el resultado se reutiliza mientras no cambie la versión.
+    
+    La versión es la publicada en config y no la que tiene este proceso en
+    memoria, que puede ir atrás de la colección que se está contando.
+    """
+    version = await CatalogoUbicaciones.version_publicada(db)
+    if version is not None and (version, clave) in _totales_estado:
+        return _totales_estado[(version, clave)]
+    
+    total = await db.ubicaciones.count_documents(query)
+    
+    if version is not None:
+        if len(_totales_estado) >= MAX_TOTALES_ESTADO:
+            _totales_estado.clear()
+        _totales_estado[(version, clave)] = total
+    return total
 
 @router.get("/buscar/estado/{estado}", summary="Buscar códigos postales por estado")
 async def get_ubicaciones_by_estado(
     estado: str,
     limit: int = 50,
     skip: int = 0,
+    after: Optional[str] = None,
+    include_total: bool = True,
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
     """
     Obtener códigos postales filtrados por estado.
     
-    - **estado**: Nombre del estado
+    - **estado**: Nombre del estado o su inicio, sin importar acentos ni
+      mayúsculas ("mexico" y "México" dan el mismo resultado)
     - **limit**: Número máximo de resultados (default: 50, max: 100)
-    - **skip**: Número de resultados a omitir para paginación
+    - **after**: Cursor `next_after` de la página anterior. Cada página cuesta
+      lo mismo sin importar su profundidad (recomendado en lugar de skip)
+    - **skip**: Número de resultados a omitir para paginación (se ignora con `after`)
+    - **include_total**: Si es False no se cuenta el total; el conteo se
+      guarda por versión publicada del catálogo
     """
     try:
         # Validar límites
         if limit > 100:
             limit = 100
+        if limit < 1:
+            limit = 1
         
         collection = db.ubicaciones
         
-        # Búsqueda case-insensitive
-        query = {"estado": {"$regex": estado, "$options": "i"}}
-        
+        clave = normalizar_busqueda(estado)
+        if not clave:
+            raise HTTPException(status_code=400, detail="El estado no puede estar vacío")
+        
+        # Prefijo sobre la clave normalizada guardada en la carga, expresado
+        # como rango: se resuelve con el índice, sin recorrer la colección
+        campo = CLAVES_BUSQUEDA["estado"]
+        query = {campo: {"$gte": clave, "$lt": clave + FIN_PREFIJO}}
+        
+        if after:
+            # Keyset: continuar después del último (estado, CP) de la página anterior
+            clave_estado, codigo_postal = _decodificar_cursor(after)
+            consulta_pagina = {"$and": [query, {"$or": [
+                {campo: clave_estado, "codigo_postal": {"$gt": codigo_postal}},
+                {campo: {"$gt": clave_estado}}
+            ]}]}
+            skip = 0
+        else:
+            consulta_pagina = query
+        
+        # El orden coincide con el índice (estado_busqueda, codigo_postal):
+        # no hay ordenamiento en memoria. Se pide uno extra para saber si hay más
         cursor = collection.find(
-            query, 
-            {"_id": 0}  # Excluir _id
-        ).skip(skip).limit(limit)
-        
-        ubicaciones = await cursor.to_list(length=limit)
+            consulta_pagina, 
+            PROYECCION_PUBLICA  # Excluir _id y campos internos
+        ).sort([(campo, 1), ("codigo_postal", 1)]).skip(skip).limit(limit + 1)
+        
+        # Página y conteo en paralelo
+        if include_total:
+            ubicaciones, total = await asyncio.gather(
+                cursor.to_list(length=limit + 1),
+                _contar_por_estado(db, clave, query)
+            )
+        else:
+            ubicaciones, total = await cursor.to_list(length=limit + 1), None
         
-        # Contar total de resultados
-        total = await collection.count_documents(query)
+        has_more = len(ubicaciones) > limit
+        ubicaciones = ubicaciones[:limit]
         
         return {
             "ubicaciones": ubicaciones,
             "total": total,
             "limit": limit,
             "skip": skip,
-            "has_more": skip + limit < total
+            "has_more": has_more,
+            "next_after": _codificar_cursor(ubicaciones[-1]) if has_more else None
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error en búsqueda por estado: {str(e)}")
 
@@ -667,45 +922,108 @@ async def debug_xml_sample(limit: int = 5):
         # Buscar archivo XML
         xml_file_path = find_xml_file()
         
-        tree = ET.parse(xml_file_path)
-        root = tree.getroot()
-        
-        # Buscar tables con namespace
-        namespace = {'ns': 'NewDataSet'}
-        tables = root.findall('.//ns:table', namespace)
-        
-        # Si no encuentra con namespace, intentar sin él
-        if not tables:
-            tables = root.findall('.//table')
-        
-        samples = []
-        count = 0
-        
-        for table in tables:
-            if count >= limit:
-                break
-                
-            d_codigo_raw = _get_element_text(table, 'd_codigo')
-            d_CP_raw = _get_element_text(table, 'd_CP')
-            
-            samples.append({
-                "d_codigo_raw": repr(d_codigo_raw),  # usar repr para ver caracteres especiales
-                "d_codigo_cleaned": ''.join(filter(str.isdigit, d_codigo_raw)) if d_codigo_raw else "",
-                "d_CP_raw": repr(d_CP_raw),
-                "municipio": _get_element_text(table, 'D_mnpio'),
-                "estado": _get_element_text(table, 'd_estado'),
-                "asentamiento": _get_element_text(table, 'd_asenta')
-            })
-            count += 1
+        # El recorrido completo (para el total) corre en el executor con iterparse
+        samples, total_tables = await asyncio.get_running_loop().run_in_executor(
+            None, _muestra_xml, xml_file_path, limit
+        )
         
         return {
             "xml_samples": samples,
-            "total_tables_found": len(tables)
+            "total_tables_found": total_tables
         }
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error leyendo XML: {str(e)}")
 
+def _validar_codigo_postal(codigo_postal: str) -> str:
+    """Normalizar un CP de consulta a 5 dígitos o lanzar HTTPException 400"""
+    codigo_postal_original = codigo_postal
+    codigo_postal = codigo_postal.strip()
+    
+    # Remover espacios y caracteres no numéricos
+    codigo_postal = ''.join(filter(str.isdigit, codigo_postal))
+    
+    if not codigo_postal:
+        raise HTTPException(
+            status_code=400, 
+            detail=f"El código postal '{codigo_postal_original}' no contiene dígitos válidos"
+        )
+    
+    # Normalizar a 5 dígitos agregando ceros a la izquierda
+    codigo_postal = codigo_postal.zfill(5)
+    
+    if len(codigo_postal) > 5:
+        raise HTTPException(
+            status_code=400, 
+            detail=f"El código postal '{codigo_postal_original}' tiene demasiados dígitos"
+        )
+    
+    return codigo_postal
+
+@router.post("/cp/batch", response_model=BatchCPResponse, summary="Buscar varios códigos postales en una sola llamada")
+async def get_ubicaciones_batch(
+    request: BatchCPRequest,
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """
+    Resolver una lista de códigos postales (por ejemplo, al validar una importación).
+    
+    - **codigos_postales**: Hasta 5000 CPs; se normalizan con las mismas reglas
+      que /cp/{codigo_postal}
+    
+    Devuelve un mapa con una entrada por cada CP recibido (tal como se envió):
+    los no encontrados y los inválidos aparecen explícitamente con `encontrado: false`.
+    """
+    if not request.codigos_postales:
+        raise HTTPException(status_code=400, detail="La lista de códigos postales está vacía")
+    if len(request.codigos_postales) > MAX_CPS_LOTE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Se permiten hasta {MAX_CPS_LOTE} códigos postales por consulta"
+        )
+    
+    try:
+        resultados: Dict[str, ResultadoCP] = {}
+        normalizados: Dict[str, str] = {}
+        for original in request.codigos_postales:
+            try:
+                normalizados[original] = _validar_codigo_postal(original)
+            except HTTPException as e:
+                resultados[original] = ResultadoCP(encontrado=False, error=e.detail)
+        
+        # Todos los CPs se resuelven de una vez: en memoria o con un solo $in
+        if CatalogoUbicaciones.cargado():
+            encontrados = {}
+            for codigo_postal in set(normalizados.values()):
+                ubicacion = CatalogoUbicaciones.buscar(codigo_postal)
+                if ubicacion is not None:
+                    encontrados[codigo_postal] = ubicacion
+        else:
+            cursor = db.ubicaciones.find(
+                {"codigo_postal": {"$in": list(set(normalizados.values()))}},
+                PROYECCION_PUBLICA
+            )
+            encontrados = {doc["codigo_postal"]: Ubicacion(**doc) async for doc in cursor}
+        
+        for original, codigo_postal in normalizados.items():
+            ubicacion = encontrados.get(codigo_postal)
+            resultados[original] = ResultadoCP(
+                codigo_postal=codigo_postal,
+                encontrado=ubicacion is not None,
+                ubicacion=ubicacion,
+                error=None if ubicacion is not None else "Código postal no encontrado"
+            )
+        
+        total_encontrados = sum(1 for r in resultados.values() if r.encontrado)
+        return BatchCPResponse(
+            resultados=resultados,
+            encontrados=total_encontrados,
+            no_encontrados=len(resultados) - total_encontrados
+        )
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error en búsqueda por lote: {str(e)}")
+
 @router.get("/cp/{codigo_postal}", response_model=Optional[Ubicacion], summary="Buscar ubicación por código postal")
 async def get_ubicacion_by_cp(
     codigo_postal: str,
@@ -720,25 +1038,22 @@ async def get_ubicacion_by_cp(
         collection = db.ubicaciones
         
         # Validar y limpiar el código postal
-        codigo_postal_original = codigo_postal
-        codigo_postal = codigo_postal.strip()
-        
-        # Remover espacios y caracteres no numéricos
-        codigo_postal = ''.join(filter(str.isdigit, codigo_postal))
-        
-        if not codigo_postal:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"El código postal '{codigo_postal_original}' no contiene dígitos válidos"
-            )
-        
-        # Normalizar a 5 dígitos agregando ceros a la izquierda
-        codigo_postal = codigo_postal.zfill(5)
-        
-        if len(codigo_postal) > 5:
+        codigo_postal = _validar_codigo_postal(codigo_postal)
+        
+        # Responder desde la copia en memoria del catálogo, sin ir a MongoDB;
+        # los bytes ya codificados evitan validar y serializar en cada consulta
+        if CatalogoUbicaciones.cargado():
+            contenido = CatalogoUbicaciones.respuesta_json(codigo_postal)
+            if contenido is not None:
+                return Response(content=contenido, media_type="application/json")
+            if CatalogoUbicaciones.total() == 0:
+                raise HTTPException(
+                    status_code=404, 
+                    detail="No hay ubicaciones cargadas. Use /ubicaciones/load para cargar los datos."
+                )
             raise HTTPException(
-                status_code=400, 
-                detail=f"El código postal '{codigo_postal_original}' tiene demasiados dígitos"
+                status_code=404, 
+                detail=f"No se encontró información para el código postal {codigo_postal}"
             )
         
         # Buscar por código postal
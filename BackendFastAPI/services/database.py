@@ -4,6 +4,11 @@ from typing import Optional
 class DatabaseService:
     _client: Optional[AsyncIOMotorClient] = None
     _db = None
+    # Cliente aparte para cargas masivas del catálogo (se crea al primer uso)
+    _bulk_client: Optional[AsyncIOMotorClient] = None
+    _bulk_db = None
+    _uri: Optional[str] = None
+    _db_name: Optional[str] = None
 
     @classmethod
     def connect(cls, uri: str, db_name: str):
@@ -18,6 +23,8 @@ class DatabaseService:
             w='majority'                     # Esperar confirmación de escritura
         )
         cls._db = cls._client[db_name]
+        cls._uri = uri
+        cls._db_name = db_name
 
     @classmethod
     def get_db(cls):
@@ -25,7 +32,34 @@ class DatabaseService:
             raise Exception("Database not connected. Call connect() first.")
         return cls._db
 
+    @classmethod
+    def get_bulk_db(cls):
+        """
+        Base de datos con el perfil de escritura para cargas masivas.
+
+        Confirma cada lote solo con el primario (w=1) y sin esperar al journal,
+        y comprime el tráfico. La durabilidad se verifica una sola vez al final
+        de la carga con una escritura 'majority' desde el cliente normal.
+        """
+        if cls._bulk_db is None:
+            if cls._uri is None:
+                raise Exception("Database not connected. Call connect() first.")
+            cls._bulk_client = AsyncIOMotorClient(
+                cls._uri,
+                serverSelectionTimeoutMS=30000,  # 30 segundos
+                connectTimeoutMS=30000,          # 30 segundos
+                socketTimeoutMS=120000,          # 2 minutos por lote
+                maxPoolSize=10,                  # Solo lo necesario para los lotes en vuelo
+                retryWrites=True,                # Reintentar escrituras automáticamente
+                w=1,                             # Confirmación solo del primario
+                journal=False,                   # Sin esperar el journal en cada lote
+                compressors='zlib',              # Comprimir el tráfico de los lotes
+                zlibCompressionLevel=1
+            )
+            cls._bulk_db = cls._bulk_client[cls._db_name]
+        return cls._bulk_db
+
 # Función de dependencia para FastAPI
 def get_database():
     """Función de dependencia para obtener la base de datos en los endpoints"""
-    return DatabaseService.get_db()
\ No newline at end of file
+    return DatabaseService.get_db()
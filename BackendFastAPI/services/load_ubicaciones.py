@@ -1,16 +1,24 @@
-import xml.etree.ElementTree as ET
 import asyncio
 from motor.motor_asyncio import AsyncIOMotorClient
-from typing import List, Dict
+from typing import List, Dict, Optional
 import os
+import sys
 from dotenv import load_dotenv
 
+# Permitir ejecutar el script directamente desde services/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from services.ubicaciones_fuentes import parsear_fuente  # noqa: E402
+from services.ubicaciones_jobs import carga_exclusiva  # noqa: E402
+from services.ubicaciones_writer import cargar_catalogo  # noqa: E402
+
 # Cargar variables de entorno
 load_dotenv()
 
 # Configuración de MongoDB
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
-DATABASE_NAME = "lacs_db"
+# Misma base que la API y el worker: el catálogo publicado aquí es el que sirven
+DATABASE_NAME = "lacs"
 COLLECTION_NAME = "ubicaciones"
 
 class UbicacionLoader:
@@ -42,65 +50,19 @@ class UbicacionLoader:
     
     def parse_xml_file(self, xml_file_path: str) -> List[Dict]:
         """
-        Parsear archivo XML y extraer datos de ubicaciones agrupados por código postal
+        Parsear el archivo fuente y agrupar los registros por código postal
+        
+        Usa el mismo parser que la API (XML o TXT, comprimido o no), así los
+        documentos tienen la misma forma sin importar cómo se cargaron.
         
         Args:
-            xml_file_path: Ruta al archivo XML
+            xml_file_path: Ruta al archivo fuente
             
         Returns:
             Lista de diccionarios con los datos de ubicaciones agrupados por CP
         """
-        cp_dict = {}  # Diccionario para agrupar por código postal
-        
         try:
-            # Parsear el archivo XML
-            tree = ET.parse(xml_file_path)
-            root = tree.getroot()
-            
-            # Buscar todos los elementos 'table' (cada uno representa una ubicación)
-            tables = root.findall('.//table')
-            
-            print(f"✓ Encontrados {len(tables)} registros en el archivo XML")
-            
-            for table in tables:
-                codigo_postal = self._get_element_text(table, 'd_codigo')
-                
-                # Solo procesar si tiene código postal válido
-                if not codigo_postal:
-                    continue
-                
-                # Crear estructura de asentamiento
-                asentamiento = {
-                    'nombre': self._get_element_text(table, 'd_asenta'),
-                    'tipo': self._get_element_text(table, 'd_tipo_asenta'),
-                    'zona': self._get_element_text(table, 'd_zona'),
-                    'codigo_tipo': self._get_element_text(table, 'c_tipo_asenta'),
-                    'id_asentamiento': self._get_element_text(table, 'id_asenta_cpcons')
-                }
-                
-                # Si el CP no existe, crear nuevo registro
-                if codigo_postal not in cp_dict:
-                    cp_dict[codigo_postal] = {
-                        'codigo_postal': codigo_postal,
-                        'municipio': self._get_element_text(table, 'D_mnpio'),
-                        'estado': self._get_element_text(table, 'd_estado'),
-                        'ciudad': self._get_element_text(table, 'd_ciudad'),
-                        'cp_oficina': self._get_element_text(table, 'd_CP'),
-                        'codigo_estado': self._get_element_text(table, 'c_estado'),
-                        'codigo_oficina': self._get_element_text(table, 'c_oficina'),
-                        'codigo_cp': self._get_element_text(table, 'c_CP'),
-                        'codigo_municipio': self._get_element_text(table, 'c_mnpio'),
-                        'codigo_ciudad': self._get_element_text(table, 'c_cve_ciudad'),
-                        'asentamientos': []
-                    }
-                
-                # Agregar asentamiento solo si no está duplicado
-                asentamientos_existentes = [a['nombre'] for a in cp_dict[codigo_postal]['asentamientos']]
-                if asentamiento['nombre'] not in asentamientos_existentes:
-                    cp_dict[codigo_postal]['asentamientos'].append(asentamiento)
-            
-            # Convertir diccionario a lista
-            ubicaciones = list(cp_dict.values())
+            ubicaciones = parsear_fuente(xml_file_path)
             
             # Estadísticas
             total_asentamientos = sum(len(ub['asentamientos']) for ub in ubicaciones)
@@ -109,86 +71,44 @@ class UbicacionLoader:
             
             return ubicaciones
             
-        except ET.ParseError as e:
-            print(f"✗ Error parseando XML: {e}")
-            raise
         except FileNotFoundError:
             print(f"✗ Archivo no encontrado: {xml_file_path}")
             raise
         except Exception as e:
-            print(f"✗ Error inesperado: {e}")
+            print(f"✗ Error parseando el archivo: {e}")
             raise
     
-    def _get_element_text(self, parent, tag_name: str) -> str:
+    async def insert_ubicaciones(self, ubicaciones: List[Dict], xml_file_path: Optional[str] = None):
         """
-        Obtener texto de un elemento hijo, manejo seguro de None
+        Publicar las ubicaciones con el mismo pipeline que la API
         
-        Args:
-            parent: Elemento padre
-            tag_name: Nombre del tag hijo
-            
-        Returns:
-            Texto del elemento o cadena vacía si no existe
-        """
-        element = parent.find(tag_name)
-        return element.text.strip() if element is not None and element.text else ""
-    
-    async def insert_ubicaciones(self, ubicaciones: List[Dict], batch_size: int = 1000):
-        """
-        Insertar ubicaciones en MongoDB en lotes
+        Se escriben en la colección sombra (lotes concurrentes, ver
+        UBICACIONES_BATCH_SIZE y UBICACIONES_WRITE_CONCURRENCY), se indexan y
+        se publican con un rename atómico que incrementa la versión del
+        catálogo; los procesos de la API la detectan y recargan su copia en
+        memoria y su snapshot. Si ya hay una carga activa se lanza CargaActiva.
         
         Args:
             ubicaciones: Lista de ubicaciones a insertar
-            batch_size: Tamaño del lote para inserción
+            xml_file_path: Archivo fuente, para guardar su nombre y checksum en los metadatos
         """
         try:
             total = len(ubicaciones)
-            inserted_count = 0
-            
-            # Limpiar colección existente (opcional)
-            print("⚠ Limpiando colección existente...")
-            await self.collection.delete_many({})
+            # Mismo candado que las cargas de la API: comparten la colección sombra
+            async with carga_exclusiva(self.db, "services/load_ubicaciones.py") as latido:
+                resultado = await cargar_catalogo(
+                    self.db, self.db, ubicaciones, progreso=latido, fuente=xml_file_path
+                )
             
-            # Insertar en lotes
-            for i in range(0, total, batch_size):
-                batch = ubicaciones[i:i + batch_size]
-                result = await self.collection.insert_many(batch)
-                inserted_count += len(result.inserted_ids)
-                
-                print(f"✓ Insertados {inserted_count}/{total} registros")
-            
-            print(f"✓ Proceso completado. Total insertado: {inserted_count} registros")
-            
-            # Crear índices para optimizar búsquedas
-            await self._create_indexes()
+            print(f"✓ Proceso completado. Total publicado: {resultado['total_codigos_postales']}/{total} registros "
+                  f"(versión {resultado['version']})")
+            for rechazo in resultado["rechazados"]:
+                print(f"⚠ CP rechazado {rechazo['codigo_postal']}: [{rechazo['codigo_error']}] {rechazo['mensaje']}")
             
         except Exception as e:
             print(f"✗ Error insertando en MongoDB: {e}")
             raise
     
-    async def _create_indexes(self):
-        """Crear índices para optimizar búsquedas"""
-        try:
-            # Índice único por código postal (campo principal de búsqueda)
-            await self.collection.create_index("codigo_postal", unique=True)
-            
-            # Índice por estado y municipio
-            await self.collection.create_index([("estado", 1), ("municipio", 1)])
-            
-            # Índice por nombre de asentamiento (dentro del array)
-            await self.collection.create_index("asentamientos.nombre")
-            
-            # Índice por tipo de asentamiento
-            await self.collection.create_index("asentamientos.tipo")
-            
-            # Índice compuesto para búsquedas geográficas
-            await self.collection.create_index([("codigo_postal", 1), ("estado", 1), ("municipio", 1)])
-            
-            print("✓ Índices creados exitosamente")
-            
-        except Exception as e:
-            print(f"⚠ Error creando índices: {e}")
-    
     async def get_sample_data(self, limit: int = 5):
         """
         Obtener muestra de datos insertados para verificación
@@ -289,7 +209,7 @@ async def main():
         
         # 4. Insertar en MongoDB
         print(f"\n💾 Insertando {len(ubicaciones)} ubicaciones en MongoDB...")
-        await loader.insert_ubicaciones(ubicaciones)
+        await loader.insert_ubicaciones(ubicaciones, XML_FILE_PATH)
         
         # 5. Mostrar muestra de datos
         await loader.get_sample_data()
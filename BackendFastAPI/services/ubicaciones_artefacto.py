@@ -0,0 +1,163 @@
+import asyncio
+import gzip
+import os
+import tempfile
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Iterable, Iterator, Optional
+
+import bson
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from services.ubicaciones_writer import (
+    CATALOGO_CONFIG_ID,
+    COLLECTION_NAME,
+    PROYECCION_PUBLICA,
+    BulkWriter,
+    cargar_catalogo,
+)
+
+# Artefacto del catálogo para restaurarlo sin parsear el XML; vacío lo desactiva
+ARTEFACTO_PATH = os.getenv(
+    "UBICACIONES_ARTEFACTO_PATH",
+    os.path.join(tempfile.gettempdir(), "ubicaciones_catalogo.bson.gz")
+)
+
+FORMATO = "ubicaciones-artefacto"
+VERSION_FORMATO = 1
+# Compresión de gzip: el artefacto se escribe una vez por carga y se lee muchas
+NIVEL_COMPRESION = 6
+
+
+def escribir_artefacto(path: str, documentos: Iterable[Dict], metadatos: Optional[Dict] = None) -> int:
+    """
+    Escribir los documentos de CP en un artefacto comprimido.
+
+    Estructura: un flujo gzip de documentos BSON (cada uno empieza con su
+    largo, así que se leen uno por uno sin índice). El primero es el
+    encabezado con el formato, los metadatos del catálogo y el total de
+    CPs; le siguen los documentos con la forma pública de la colección.
+    El archivo se escribe aparte y se reemplaza con os.replace.
+
+    Returns:
+        Número de CPs escritos
+    """
+    documentos = [
+        {k: v for k, v in doc.items() if k not in PROYECCION_PUBLICA}
+        for doc in documentos
+    ]
+    encabezado = {
+        "formato": FORMATO,
+        "version_formato": VERSION_FORMATO,
+        "creado": datetime.utcnow(),
+        **(metadatos or {}),
+        "total_codigos_postales": len(documentos),
+        "total_asentamientos": sum(len(doc.get("asentamientos", [])) for doc in documentos),
+    }
+
+    directorio = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directorio, exist_ok=True)
+    fd, temporal = tempfile.mkstemp(prefix=".ubicaciones_", dir=directorio)
+    try:
+        with os.fdopen(fd, "wb") as f, gzip.GzipFile(fileobj=f, mode="wb", compresslevel=NIVEL_COMPRESION) as gz:
+            gz.write(bson.encode(encabezado))
+            for doc in documentos:
+                gz.write(bson.encode(doc))
+        os.replace(temporal, path)
+    except BaseException:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+    return len(documentos)
+
+
+def _validar_encabezado(path: str, encabezado: Optional[Dict]) -> Dict:
+    if not encabezado or encabezado.get("formato") != FORMATO:
+        raise ValueError(f"{path} no es un artefacto del catálogo de ubicaciones")
+    if encabezado.get("version_formato") != VERSION_FORMATO:
+        raise ValueError(f"Formato de artefacto no soportado: {encabezado.get('version_formato')}")
+    return encabezado
+
+
+def leer_encabezado(path: str) -> Dict:
+    """Encabezado del artefacto; ValueError si el archivo no es un artefacto válido"""
+    with gzip.open(path, "rb") as f:
+        return _validar_encabezado(path, next(bson.decode_file_iter(f), None))
+
+
+def iter_artefacto(path: str) -> Iterator[Dict]:
+    """
+    Recorrer los documentos del artefacto descomprimiendo en streaming.
+
+    Al terminar se compara el número de documentos con el del encabezado,
+    así un artefacto truncado falla antes de publicarse.
+    """
+    with gzip.open(path, "rb") as f:
+        documentos = bson.decode_file_iter(f)
+        encabezado = _validar_encabezado(path, next(documentos, None))
+        leidos = 0
+        for doc in documentos:
+            leidos += 1
+            yield doc
+
+    if leidos != encabezado["total_codigos_postales"]:
+        raise ValueError(
+            f"El artefacto tiene {leidos} CPs y el encabezado indica {encabezado['total_codigos_postales']}"
+        )
+
+
+async def exportar_artefacto(db: AsyncIOMotorDatabase, path: str = ARTEFACTO_PATH) -> Optional[Dict]:
+    """
+    Escribir el artefacto del catálogo publicado en MongoDB.
+
+    Returns:
+        Encabezado escrito (versión y totales), o None si no hay catálogo publicado
+    """
+    config = await db.config.find_one({"_id": CATALOGO_CONFIG_ID}, {"_id": 0})
+    if not config or config.get("version") is None:
+        return None
+
+    metadatos = {
+        "version": config["version"],
+        "archivo_fuente": config.get("archivo_fuente"),
+        "checksum_fuente": config.get("checksum_fuente"),
+        "publicado": config.get("publicado"),
+    }
+    documentos = await db[COLLECTION_NAME].find({}, PROYECCION_PUBLICA).sort("codigo_postal", 1).to_list(length=None)
+    total = await asyncio.get_running_loop().run_in_executor(
+        None, escribir_artefacto, path, documentos, metadatos
+    )
+    print(f"Artefacto de ubicaciones escrito en {path}: {total} CPs, versión {config['version']}")
+    return await asyncio.get_running_loop().run_in_executor(None, leer_encabezado, path)
+
+
+async def cargar_artefacto(
+    db: AsyncIOMotorDatabase,
+    bulk_db: AsyncIOMotorDatabase,
+    path: str = ARTEFACTO_PATH,
+    progreso: Optional[Callable[[BulkWriter], Awaitable[None]]] = None
+) -> Dict:
+    """
+    Restaurar el catálogo desde un artefacto sin parsear el XML.
+
+    Los documentos se leen en streaming y se escriben con el mismo
+    pipeline que una carga normal (lotes concurrentes en la colección
+    sombra y publicación atómica), así que el catálogo actual se conserva
+    si el artefacto está incompleto. Los metadatos publicados describen el
+    archivo de SEPOMEX del que salió el artefacto (nombre y checksum de su
+    encabezado), no el artefacto.
+
+    Returns:
+        Totales publicados, versión y reporte de errores del escritor
+    """
+    # Validar antes de tocar la colección sombra
+    encabezado = await asyncio.get_running_loop().run_in_executor(None, leer_encabezado, path)
+    # Sin checksum de la fuente (catálogo anterior a los metadatos) no se registra ninguna
+    checksum_fuente = encabezado.get("checksum_fuente")
+    return await cargar_catalogo(
+        db,
+        bulk_db,
+        iter_artefacto(path),
+        progreso=progreso,
+        fuente=(encabezado.get("archivo_fuente") or "desconocido") if checksum_fuente else None,
+        checksum_fuente=checksum_fuente
+    )
@@ -0,0 +1,103 @@
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Tuple
+
+from services.ubicaciones_parser import normalizar_busqueda
+from services.ubicaciones_registros import (
+    CAMPOS_RESULTADO_ASENTAMIENTO,
+    CAMPOS_RESULTADO_CP,
+    CatalogoPosicional,
+    RegistroCP,
+)
+
+# Mayor que cualquier carácter de una clave: cierra el rango de un prefijo
+FIN_PREFIJO = "\uffff"
+LIMITE_MAXIMO = 50
+
+
+def _rango(claves: List[str], prefijo: str) -> Tuple[int, int]:
+    """Posiciones [inicio, fin) de las claves que empiezan con el prefijo"""
+    return bisect_left(claves, prefijo), bisect_left(claves, prefijo + FIN_PREFIJO)
+
+
+class IndiceAutocompletado:
+    """
+    Índice de prefijos en memoria para el autocompletado de direcciones.
+
+    Usa arreglos ordenados y búsqueda binaria: un prefijo se resuelve con
+    dos bisect y se leen solo los primeros `limite` elementos del rango.
+    Los nombres de asentamientos se indexan normalizados (sin acentos ni
+    mayúsculas) desde el inicio de cada palabra, así "centro" encuentra
+    también "Zona Centro". El índice guarda posiciones, no registros: los
+    resultados se leen del catálogo (registros compactos o snapshot mmap).
+    """
+
+    def __init__(self, registros: Iterable[RegistroCP], catalogo: CatalogoPosicional):
+        """
+        Args:
+            registros: Registros en el mismo orden que las posiciones de `catalogo`
+            catalogo: Catálogo del que se leen los resultados
+        """
+        codigos: List[Tuple[str, int]] = []
+        asentamiento_cp = array("I")
+        asentamiento_posicion = array("I")
+        entradas: List[Tuple[str, int]] = []
+
+        for i, registro in enumerate(registros):
+            codigos.append((registro.codigo_postal, i))
+            for j, asentamiento in enumerate(registro.asentamientos):
+                indice = len(asentamiento_cp)
+                asentamiento_cp.append(i)
+                asentamiento_posicion.append(j)
+                palabras = normalizar_busqueda(asentamiento.nombre).split()
+                for k in range(len(palabras)):
+                    entradas.append((" ".join(palabras[k:]), indice))
+
+        codigos.sort()
+        entradas.sort()
+        self._catalogo = catalogo
+        self._codigos = [c[0] for c in codigos]
+        self._posiciones = array("I", (c[1] for c in codigos))
+        self._claves = [e[0] for e in entradas]
+        self._indices = array("I", (e[1] for e in entradas))
+        self._asentamiento_cp = asentamiento_cp
+        self._asentamiento_posicion = asentamiento_posicion
+
+    def buscar_codigos(self, prefijo: str, limite: int = 10) -> List[Dict]:
+        """CPs que empiezan con los dígitos dados, en orden ascendente"""
+        inicio, fin = _rango(self._codigos, prefijo)
+        resultados = []
+        for posicion in self._posiciones[inicio:min(fin, inicio + limite)]:
+            codigo_postal, municipio, estado = self._catalogo.campos_cp(posicion, CAMPOS_RESULTADO_CP)
+            resultados.append({"codigo_postal": codigo_postal, "municipio": municipio, "estado": estado})
+        return resultados
+
+    def buscar_asentamientos(self, prefijo: str, limite: int = 10) -> List[Dict]:
+        """Asentamientos con una palabra que empieza con el prefijo (normalizado)"""
+        prefijo = normalizar_busqueda(prefijo)
+        if not prefijo:
+            return []
+
+        inicio, fin = _rango(self._claves, prefijo)
+        vistos = set()
+        resultados = []
+        for posicion in range(inicio, fin):
+            indice = self._indices[posicion]
+            if indice in vistos:
+                continue
+            vistos.add(indice)
+            i = self._asentamiento_cp[indice]
+            nombre, tipo = self._catalogo.campos_asentamiento(
+                i, self._asentamiento_posicion[indice], CAMPOS_RESULTADO_ASENTAMIENTO
+            )
+            codigo_postal, municipio, estado = self._catalogo.campos_cp(i, CAMPOS_RESULTADO_CP)
+            resultados.append({
+                "nombre": nombre,
+                "tipo": tipo,
+                "codigo_postal": codigo_postal,
+                "municipio": municipio,
+                "estado": estado,
+            })
+            if len(resultados) >= limite:
+                break
+        return resultados
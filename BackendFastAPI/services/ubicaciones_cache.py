@@ -0,0 +1,301 @@
+import asyncio
+import os
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from models.ubicacion_model import Ubicacion
+from services.ubicaciones_autocompletado import IndiceAutocompletado
+from services.ubicaciones_jerarquia import JerarquiaUbicaciones
+from services.ubicaciones_registros import RegistroCP, RegistrosCatalogo, codificar_respuesta, compactar
+from services.ubicaciones_snapshot import SNAPSHOT_PATH, SnapshotCatalogo, abrir_snapshot, escribir_snapshot
+from services.ubicaciones_trigramas import IndiceTrigramas
+from services.ubicaciones_writer import CATALOGO_CONFIG_ID, COLLECTION_NAME, PROYECCION_PUBLICA
+
+# Segundos entre verificaciones de la versión publicada del catálogo
+REFRESH_INTERVAL = float(os.getenv("UBICACIONES_CACHE_REFRESH_SECONDS", "30"))
+# Respuestas JSON ya codificadas que se conservan por CP (LRU)
+RESPUESTAS_MAX = int(os.getenv("UBICACIONES_RESPONSE_CACHE_SIZE", "4096"))
+
+
+def _construir_indices(
+    documentos: Iterable[Dict],
+    snapshot: Optional[SnapshotCatalogo] = None
+) -> Tuple[Dict[str, RegistroCP], Dict[str, bytes], IndiceAutocompletado, IndiceTrigramas, JerarquiaUbicaciones]:
+    """
+    Compactar los documentos y construir los índices de búsqueda.
+
+    Los índices guardan posiciones en el catálogo del que leen: con snapshot
+    es el mmap y los registros compactos solo existen mientras se construyen
+    (el diccionario por CP y las respuestas quedan vacíos, el snapshot ya
+    las trae); sin snapshot es la lista de registros, y el JSON de /cp de
+    cada CP se valida y se comprime aquí.
+    """
+    registros = compactar(documentos)
+    catalogo = snapshot if snapshot is not None else RegistrosCatalogo(registros)
+    indices = (
+        IndiceAutocompletado(registros, catalogo),
+        IndiceTrigramas(registros, catalogo),
+        JerarquiaUbicaciones(registros),
+    )
+    if snapshot is not None:
+        return ({}, {}, *indices)
+    por_cp = {registro.codigo_postal: registro for registro in registros}
+    respuestas = {registro.codigo_postal: codificar_respuesta(registro.a_documento()) for registro in registros}
+    return (por_cp, respuestas, *indices)
+
+
+class CatalogoUbicaciones:
+    """
+    Copia en memoria del catálogo de códigos postales para este proceso.
+
+    Se carga al iniciar la aplicación y se recarga cuando cambia la versión
+    publicada en config (ver `registrar_version`). MongoDB sigue siendo la
+    fuente de verdad.
+
+    Si hay un snapshot binario de la versión publicada (ver
+    ubicaciones_snapshot) se usa con mmap: los workers de uvicorn comparten
+    una sola copia de los CPs. El primer proceso que no lo encuentra lo
+    genera desde MongoDB. Sin snapshot, se usa un diccionario por proceso
+    de registros compactos (ver ubicaciones_registros).
+
+    Los índices de búsqueda (autocompletado, trigramas y jerarquía
+    estado/municipio) son de cada proceso y se construyen en cada carga.
+    Guardan posiciones, no registros, y leen los resultados del snapshot o
+    de los registros compactos; con snapshot, los registros se descartan
+    al terminar de construirlos.
+
+    En la primera carga con snapshot, /cp se sirve en cuanto el archivo
+    queda mapeado y los índices se construyen después en segundo plano
+    (mientras tanto `autocompletado`, `trigramas` y `jerarquia` devuelven
+    None). Las recargas por cambio de versión los construyen antes del
+    reemplazo, para no dejar de responder búsquedas que ya se servían.
+    """
+    _por_cp: Dict[str, RegistroCP] = {}
+    # CP -> JSON de /cp validado y comprimido (sin snapshot; con snapshot está en el archivo)
+    _comprimidas: Dict[str, bytes] = {}
+    _snapshot: Optional[SnapshotCatalogo] = None
+    _autocompletado: Optional[IndiceAutocompletado] = None
+    _trigramas: Optional[IndiceTrigramas] = None
+    _jerarquia: Optional[JerarquiaUbicaciones] = None
+    # CP -> JSON de /cp ya descomprimido de los CPs más consultados, del más antiguo al más reciente
+    _respuestas: "OrderedDict[str, bytes]" = OrderedDict()
+    _version: Optional[int] = None
+    _publicado: Optional[datetime] = None
+    _cargado = False
+    _tarea: Optional[asyncio.Task] = None
+    # Índices de la primera carga con snapshot, construyéndose en segundo plano
+    _indices_pendientes: Optional[asyncio.Task] = None
+
+    @classmethod
+    async def version_publicada(cls, db: AsyncIOMotorDatabase) -> Optional[int]:
+        config = await db.config.find_one({"_id": CATALOGO_CONFIG_ID}, {"version": 1})
+        return config.get("version") if config else None
+
+    @classmethod
+    async def cargar(cls, db: AsyncIOMotorDatabase):
+        """Leer el catálogo completo y reemplazar la copia en memoria"""
+        inicio = time.perf_counter()
+        config = await db.config.find_one({"_id": CATALOGO_CONFIG_ID}, {"version": 1, "publicado": 1}) or {}
+        version = config.get("version")
+
+        snapshot = abrir_snapshot(SNAPSHOT_PATH, version)
+        documentos = []
+        if snapshot is None:
+            documentos = await db[COLLECTION_NAME].find({}, PROYECCION_PUBLICA).to_list(length=None)
+            if SNAPSHOT_PATH and version is not None and documentos:
+                try:
+                    await asyncio.get_running_loop().run_in_executor(
+                        None, escribir_snapshot, SNAPSHOT_PATH, documentos, version
+                    )
+                    snapshot = abrir_snapshot(SNAPSHOT_PATH, version)
+                except (OSError, ValueError) as e:
+                    print(f"No se pudo escribir el snapshot de ubicaciones: {str(e)}")
+
+        # Con snapshot y sin nada cargado aún, /cp no espera a los índices
+        if snapshot is not None and not cls._cargado:
+            cls._reemplazar(snapshot, {}, {}, (None, None, None), version, config.get("publicado"))
+            cls._indices_pendientes = asyncio.create_task(cls._construir_en_segundo_plano(snapshot, inicio))
+            print(f"Catálogo en memoria (snapshot {SNAPSHOT_PATH}): {cls.total()} CPs, versión {version} "
+                  f"({time.perf_counter() - inicio:.2f} s); construyendo índices de búsqueda")
+            return
+
+        # Una recarga no cierra el snapshot que aún están recorriendo los índices pendientes
+        await cls._esperar_indices()
+
+        # Registros compactos e índices de búsqueda fuera del event loop
+        fuente = snapshot.iter_documentos() if snapshot is not None else documentos
+        por_cp, comprimidas, *indices = await asyncio.get_running_loop().run_in_executor(
+            None, _construir_indices, fuente, snapshot
+        )
+        cls._reemplazar(snapshot, por_cp, comprimidas, indices, version, config.get("publicado"))
+
+        origen = f"snapshot {SNAPSHOT_PATH}" if snapshot is not None else "diccionario"
+        print(f"Catálogo en memoria ({origen}): {cls.total()} CPs, versión {version} "
+              f"({time.perf_counter() - inicio:.2f} s)")
+
+    @classmethod
+    def _reemplazar(
+        cls,
+        snapshot: Optional[SnapshotCatalogo],
+        por_cp: Dict[str, RegistroCP],
+        comprimidas: Dict[str, bytes],
+        indices: Tuple,
+        version: Optional[int],
+        publicado: Optional[datetime]
+    ):
+        """Reemplazo atómico: las consultas ven la copia anterior o la nueva"""
+        anterior = cls._snapshot
+        cls._snapshot = snapshot
+        cls._por_cp = por_cp
+        cls._comprimidas = comprimidas
+        cls._respuestas = OrderedDict()
+        cls._autocompletado, cls._trigramas, cls._jerarquia = indices
+        cls._version = version
+        cls._publicado = publicado
+        cls._cargado = True
+        if anterior is not None and anterior is not snapshot:
+            anterior.cerrar()
+
+    @classmethod
+    async def _construir_en_segundo_plano(cls, snapshot: SnapshotCatalogo, inicio: float):
+        """Construir los índices sobre un snapshot que ya se está sirviendo"""
+        try:
+            _, _, *indices = await asyncio.get_running_loop().run_in_executor(
+                None, _construir_indices, snapshot.iter_documentos(), snapshot
+            )
+        except Exception as e:
+            print(f"Error construyendo los índices de búsqueda de ubicaciones: {str(e)}")
+            return
+        finally:
+            cls._indices_pendientes = None
+        if cls._snapshot is snapshot:
+            cls._autocompletado, cls._trigramas, cls._jerarquia = indices
+            print(f"Índices de búsqueda de ubicaciones listos ({time.perf_counter() - inicio:.2f} s)")
+
+    @classmethod
+    async def _esperar_indices(cls):
+        pendientes = cls._indices_pendientes
+        if pendientes is not None:
+            await asyncio.wait([pendientes])
+
+    @classmethod
+    async def refrescar(cls, db: AsyncIOMotorDatabase, forzar: bool = False) -> bool:
+        """
+        Recargar solo si la versión publicada cambió.
+
+        Returns:
+            True si se recargó el catálogo
+        """
+        version = await cls.version_publicada(db)
+        if not forzar and cls._cargado and version == cls._version:
+            return False
+        await cls.cargar(db)
+        return True
+
+    @classmethod
+    async def _vigilar(cls, db: AsyncIOMotorDatabase):
+        while True:
+            await asyncio.sleep(REFRESH_INTERVAL)
+            try:
+                await cls.refrescar(db)
+            except Exception as e:
+                print(f"Error refrescando catálogo en memoria: {str(e)}")
+
+    @classmethod
+    async def iniciar(cls, db: AsyncIOMotorDatabase):
+        """Cargar el catálogo y vigilar cambios de versión en segundo plano"""
+        try:
+            await cls.cargar(db)
+        except Exception as e:
+            # Sin copia en memoria las consultas usan MongoDB directamente
+            print(f"Error cargando catálogo en memoria: {str(e)}")
+        cls._tarea = asyncio.create_task(cls._vigilar(db))
+
+    @classmethod
+    async def detener(cls):
+        if cls._tarea:
+            cls._tarea.cancel()
+            cls._tarea = None
+        await cls._esperar_indices()
+        if cls._snapshot is not None:
+            cls._snapshot.cerrar()
+            cls._snapshot = None
+            cls._autocompletado = None
+            cls._trigramas = None
+            cls._jerarquia = None
+            cls._cargado = False
+
+    @classmethod
+    def cargado(cls) -> bool:
+        return cls._cargado
+
+    @classmethod
+    def version(cls) -> Optional[int]:
+        """Versión del catálogo que tiene este proceso (None si no se ha cargado)"""
+        return cls._version if cls._cargado else None
+
+    @classmethod
+    def publicado(cls) -> Optional[datetime]:
+        """Fecha de publicación (UTC) de la versión que tiene este proceso"""
+        return cls._publicado if cls._cargado else None
+
+    @classmethod
+    def total(cls) -> int:
+        if cls._snapshot is not None:
+            return len(cls._snapshot)
+        return len(cls._por_cp)
+
+    @classmethod
+    def autocompletado(cls) -> Optional[IndiceAutocompletado]:
+        return cls._autocompletado
+
+    @classmethod
+    def trigramas(cls) -> Optional[IndiceTrigramas]:
+        return cls._trigramas
+
+    @classmethod
+    def respuesta_json(cls, codigo_postal: str) -> Optional[bytes]:
+        """
+        JSON final de un CP, listo para enviarse como respuesta.
+
+        El modelo se valida y se codifica una sola vez por CP al cargar el
+        catálogo y se guarda comprimido con zlib (en el snapshot o en
+        memoria), así ninguna consulta valida ni serializa: solo se
+        descomprime. Los CPs más consultados se guardan ya descomprimidos
+        en un LRU de RESPUESTAS_MAX entradas, que se vacía al recargar.
+        """
+        contenido = cls._respuestas.get(codigo_postal)
+        if contenido is not None:
+            cls._respuestas.move_to_end(codigo_postal)
+            return contenido
+
+        if cls._snapshot is not None:
+            contenido = cls._snapshot.respuesta(codigo_postal)
+        else:
+            comprimido = cls._comprimidas.get(codigo_postal)
+            contenido = zlib.decompress(comprimido) if comprimido is not None else None
+        if contenido is None:
+            return None
+
+        cls._respuestas[codigo_postal] = contenido
+        if len(cls._respuestas) > RESPUESTAS_MAX:
+            cls._respuestas.popitem(last=False)
+        return contenido
+
+    @classmethod
+    def jerarquia(cls) -> Optional[JerarquiaUbicaciones]:
+        return cls._jerarquia
+
+    @classmethod
+    def buscar(cls, codigo_postal: str) -> Optional[Ubicacion]:
+        """Buscar un CP ya normalizado a 5 dígitos"""
+        if cls._snapshot is not None:
+            documento = cls._snapshot.buscar(codigo_postal)
+            return Ubicacion(**documento) if documento else None
+        registro = cls._por_cp.get(codigo_postal)
+        return Ubicacion(**registro.a_documento()) if registro is not None else None
@@ -0,0 +1,206 @@
+import gzip
+import io
+import itertools
+import mmap
+import os
+import zipfile
+from contextlib import contextmanager
+from typing import IO, Dict, Iterator, List, Optional, Tuple
+
+from services.ubicaciones_parser import (
+    AgrupadorCP,
+    agrupar_ubicaciones,
+    iter_xml_filas,
+    parse_xml_parallel,
+)
+
+# Codificación del TXT de SEPOMEX (el XML declara la suya)
+TXT_ENCODING = os.getenv("UBICACIONES_TXT_ENCODING", "latin-1")
+# Primer campo del encabezado del TXT; las líneas anteriores son el aviso de SEPOMEX
+TXT_PRIMER_CAMPO = "d_codigo"
+
+# Nombres del archivo fuente, del más chico al más grande: se usa el primero que exista
+NOMBRES_FUENTE = (
+    "CPdescarga.zip",
+    "CPdescargatxt.zip",
+    "CPdescarga.txt.gz",
+    "CPdescarga.txt",
+    "CPdescargaxml.zip",
+    "CPdescarga.xml.gz",
+    "CPdescarga.xml",
+)
+
+
+def _formato(nombre: str) -> str:
+    """'txt' o 'xml' según la extensión (sin contar .gz)"""
+    nombre = nombre.lower()
+    if nombre.endswith(".gz"):
+        nombre = nombre[:-3]
+    return "txt" if nombre.endswith(".txt") else "xml"
+
+
+def es_xml_plano(path: str) -> bool:
+    """El archivo es XML sin comprimir (el único que admite el parseo paralelo por rangos)"""
+    return path.lower().endswith(".xml")
+
+
+def _miembro_zip(archivo: zipfile.ZipFile) -> zipfile.ZipInfo:
+    """Archivo del catálogo dentro del zip, prefiriendo el TXT"""
+    miembros = [m for m in archivo.infolist() if not m.is_dir()]
+    for extension in (".txt", ".xml"):
+        for miembro in miembros:
+            if miembro.filename.lower().endswith(extension):
+                return miembro
+    raise ValueError(f"El zip no contiene un archivo .txt ni .xml: {[m.filename for m in miembros]}")
+
+
+@contextmanager
+def abrir_fuente(path: str) -> Iterator[Tuple[str, IO[bytes]]]:
+    """
+    Abrir el archivo fuente como flujo de bytes, descomprimiendo al vuelo.
+
+    Yields:
+        (formato, flujo): formato 'txt' o 'xml' y el contenido sin comprimir
+    """
+    nombre = path.lower()
+    if nombre.endswith(".zip"):
+        with zipfile.ZipFile(path) as archivo:
+            miembro = _miembro_zip(archivo)
+            with archivo.open(miembro) as flujo:
+                yield _formato(miembro.filename), flujo
+    elif nombre.endswith(".gz"):
+        with gzip.open(path, "rb") as flujo:
+            yield _formato(nombre), flujo
+    else:
+        with open(path, "rb") as flujo:
+            yield _formato(nombre), flujo
+
+
+def iter_txt_filas(flujo: IO[bytes], encoding: str = TXT_ENCODING, desde: int = 0) -> Iterator[Dict[str, str]]:
+    """
+    Recorrer el TXT de SEPOMEX (campos separados por '|') línea por línea.
+
+    Las filas tienen las mismas claves que los tags del XML, así que
+    alimentan la misma etapa de agrupación por CP.
+
+    Args:
+        flujo: Contenido del TXT en bytes
+        encoding: Codificación del archivo
+        desde: Filas a saltar (sin separar sus campos)
+
+    Yields:
+        Diccionario campo -> texto de cada registro
+    """
+    lineas = io.TextIOWrapper(flujo, encoding=encoding, newline="")
+
+    encabezado: Optional[List[str]] = None
+    for linea in lineas:
+        if linea.startswith(TXT_PRIMER_CAMPO + "|"):
+            encabezado = linea.rstrip("\r\n").split("|")
+            break
+    if encabezado is None:
+        raise ValueError(f"El TXT no tiene el encabezado de SEPOMEX ({TXT_PRIMER_CAMPO}|...)")
+
+    saltadas = 0
+    for linea in lineas:
+        linea = linea.rstrip("\r\n")
+        if not linea:
+            continue
+        if saltadas < desde:
+            saltadas += 1
+            continue
+        yield dict(zip(encabezado, map(str.strip, linea.split("|"))))
+
+
+class _XMLDesde(io.RawIOBase):
+    """Encabezado del XML (declaración, raíz y esquema) seguido del archivo desde un offset"""
+
+    def __init__(self, encabezado: bytes, archivo: IO[bytes]):
+        self._encabezado = encabezado
+        self._archivo = archivo
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self._encabezado:
+            n = min(len(buffer), len(self._encabezado))
+            buffer[:n] = self._encabezado[:n]
+            self._encabezado = self._encabezado[n:]
+            return n
+        return self._archivo.readinto(buffer)
+
+
+def _iter_xml_desde(path: str, desde: int) -> Iterator[Dict[str, str]]:
+    """
+    Registros del XML sin comprimir a partir del <table> número `desde`.
+
+    Los registros saltados solo se cuentan con mmap.find, sin parsearlos.
+    """
+    with open(path, "rb") as archivo:
+        with mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            posicion = mm.find(b"<table>")
+            encabezado = mm[:max(posicion, 0)]
+            for _ in range(desde):
+                if posicion == -1:
+                    break
+                posicion = mm.find(b"<table>", posicion + 1)
+        if posicion == -1:
+            return
+        archivo.seek(posicion)
+        yield from iter_xml_filas(io.BufferedReader(_XMLDesde(encabezado, archivo)))
+
+
+def iter_filas(path: str, desde: int = 0) -> Iterator[Dict[str, str]]:
+    """
+    Registros del archivo fuente en cualquier formato soportado.
+
+    Acepta el XML o el TXT de SEPOMEX, sin comprimir, en .gz o dentro de un
+    .zip. El contenido se descomprime y se parsea en streaming.
+
+    Args:
+        path: Ruta al archivo fuente
+        desde: Registros a saltar (para reanudar una carga). En el TXT y en
+            el XML sin comprimir se saltan sin parsearlos; en el XML
+            comprimido se parsean y se descartan
+    """
+    if desde and es_xml_plano(path):
+        yield from _iter_xml_desde(path, desde)
+        return
+
+    with abrir_fuente(path) as (formato, flujo):
+        if formato == "txt":
+            yield from iter_txt_filas(flujo, desde=desde)
+        else:
+            yield from itertools.islice(iter_xml_filas(flujo), desde, None)
+
+
+def iter_ubicaciones(path: str, agrupador: Optional[AgrupadorCP] = None, desde: int = 0) -> Iterator[Dict]:
+    """
+    Pipeline streaming: archivo fuente -> registros -> documentos agrupados por CP.
+
+    Args:
+        path: Ruta al archivo fuente (XML, TXT, .gz o .zip)
+        agrupador: Agrupador a usar, para consultar contadores y rezagados al final
+        desde: Registros a saltar; el agrupador ya debe estar en esa posición
+            (ver `AgrupadorCP.reanudar`)
+
+    Yields:
+        Documento de cada código postal
+    """
+    agrupador = agrupador or AgrupadorCP()
+    yield from agrupador.agrupar(iter_filas(path, desde))
+
+
+def parsear_fuente(path: str, parallel: bool = False, workers: Optional[int] = None) -> List[Dict]:
+    """
+    Parsear el archivo fuente completo agrupado por CP.
+
+    El parseo paralelo divide el archivo en rangos de bytes, por lo que solo
+    aplica al XML sin comprimir; cualquier otra fuente se lee en streaming.
+    """
+    if parallel and es_xml_plano(path):
+        return parse_xml_parallel(path, workers=workers)
+    if parallel:
+        print(f"Parseo paralelo no disponible para {os.path.basename(path)}; se lee en streaming")
+    return agrupar_ubicaciones(iter_filas(path))
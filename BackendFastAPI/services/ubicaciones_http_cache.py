@@ -0,0 +1,108 @@
+import os
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Callable, Coroutine, Dict, Optional, Tuple
+
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+
+from services.database import DatabaseService
+from services.ubicaciones_cache import CatalogoUbicaciones
+from services.ubicaciones_writer import CATALOGO_CONFIG_ID
+
+# Segundos que clientes y CDN pueden reutilizar una respuesta sin revalidarla
+CACHE_MAX_AGE = int(os.getenv("UBICACIONES_CACHE_MAX_AGE", "300"))
+
+# Rutas de lectura que no dependen de la versión del catálogo
+RUTAS_SIN_CACHE = ("/ubicaciones/jobs", "/ubicaciones/debug")
+# Rutas que leen MongoDB en lugar de la copia en memoria: su ETag sale de la
+# versión publicada en config, no de la que tiene el proceso (que puede ir atrás)
+RUTAS_MONGO = ("/ubicaciones/status", "/ubicaciones/buscar/estado")
+
+
+def cabeceras_catalogo(version: int, publicado: Optional[datetime]) -> Dict[str, str]:
+    """ETag, Last-Modified y Cache-Control de la versión del catálogo"""
+    cabeceras = {
+        "ETag": f'"ubicaciones-v{version}"',
+        "Cache-Control": f"public, max-age={CACHE_MAX_AGE}",
+    }
+    if publicado is not None:
+        # MongoDB devuelve fechas UTC sin zona horaria
+        if publicado.tzinfo is None:
+            publicado = publicado.replace(tzinfo=timezone.utc)
+        cabeceras["Last-Modified"] = format_datetime(publicado.replace(microsecond=0), usegmt=True)
+    return cabeceras
+
+
+def no_modificado(request: Request, cabeceras: Dict[str, str]) -> bool:
+    """
+    Evaluar If-None-Match (o If-Modified-Since si no viene) contra las cabeceras.
+
+    If-None-Match tiene prioridad, como indica RFC 9110.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        etags = [etag.strip() for etag in if_none_match.split(",")]
+        etag_actual = cabeceras["ETag"]
+        return any(etag == "*" or etag.removeprefix("W/") == etag_actual for etag in etags)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and "Last-Modified" in cabeceras:
+        try:
+            desde = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if desde.tzinfo is None:
+            desde = desde.replace(tzinfo=timezone.utc)
+        return parsedate_to_datetime(cabeceras["Last-Modified"]) <= desde
+
+    return False
+
+
+async def version_mongo() -> Tuple[Optional[int], Optional[datetime]]:
+    """Versión y fecha de publicación del catálogo según config/ubicaciones_catalogo"""
+    config = await DatabaseService.get_db().config.find_one(
+        {"_id": CATALOGO_CONFIG_ID}, {"version": 1, "publicado": 1}
+    ) or {}
+    return config.get("version"), config.get("publicado")
+
+
+class RutaCatalogo(APIRoute):
+    """
+    Ruta con caché HTTP condicional por versión del catálogo.
+
+    Las lecturas (GET/HEAD) responden con ETag, Last-Modified y Cache-Control
+    de la versión que tiene este proceso en memoria. Si el cliente ya tiene
+    esa versión (If-None-Match / If-Modified-Since) se responde 304 sin
+    ejecutar el endpoint, es decir, sin consultar MongoDB.
+
+    Las rutas de RUTAS_MONGO responden con datos de MongoDB, que pueden ser
+    más nuevos que la copia en memoria; para ellas la versión se lee de
+    config (una búsqueda por _id) y el 304 evita solo la consulta completa.
+    """
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[None, None, Response]]:
+        handler = super().get_route_handler()
+        if not self.methods & {"GET", "HEAD"} or any(ruta in self.path for ruta in RUTAS_SIN_CACHE):
+            return handler
+
+        desde_mongo = any(ruta in self.path for ruta in RUTAS_MONGO)
+
+        async def handler_con_cache(request: Request) -> Response:
+            if desde_mongo:
+                version, publicado = await version_mongo()
+            else:
+                version, publicado = CatalogoUbicaciones.version(), CatalogoUbicaciones.publicado()
+            if version is None:
+                return await handler(request)
+
+            cabeceras = cabeceras_catalogo(version, publicado)
+            if no_modificado(request, cabeceras):
+                return Response(status_code=304, headers=cabeceras)
+
+            response = await handler(request)
+            if response.status_code == 200:
+                response.headers.update(cabeceras)
+            return response
+
+        return handler_con_cache
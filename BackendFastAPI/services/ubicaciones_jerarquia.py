@@ -0,0 +1,98 @@
+import json
+from typing import Dict, Iterable, Optional, Tuple
+
+from services.ubicaciones_parser import normalizar_busqueda
+from services.ubicaciones_registros import RegistroCP
+
+
+def _serializar(datos) -> bytes:
+    return json.dumps(datos, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def normalizar_codigo(codigo: str, largo: int) -> str:
+    """Dejar solo dígitos y completar con ceros ("9" -> "09" para estados)"""
+    digitos = ''.join(filter(str.isdigit, codigo.strip()))
+    return digitos.zfill(largo) if digitos else ""
+
+
+class JerarquiaUbicaciones:
+    """
+    Árbol estado -> municipio -> CP para los selectores en cascada.
+
+    Se indexa por `codigo_estado` y `codigo_municipio` (el código de
+    municipio solo es único dentro de su estado). Cada respuesta se
+    serializa a JSON una sola vez al construir el árbol, así cada consulta
+    es una búsqueda en diccionario que devuelve bytes listos.
+    """
+
+    LARGO_ESTADO = 2
+    LARGO_MUNICIPIO = 3
+
+    def __init__(self, registros: Iterable[RegistroCP]):
+        estados: Dict[str, Dict] = {}
+        for registro in registros:
+            estado = estados.setdefault(registro.codigo_estado, {
+                "codigo_estado": registro.codigo_estado,
+                "estado": registro.estado,
+                "municipios": {},
+            })
+            municipio = estado["municipios"].setdefault(registro.codigo_municipio, {
+                "codigo_municipio": registro.codigo_municipio,
+                "municipio": registro.municipio,
+                "codigos_postales": [],
+            })
+            municipio["codigos_postales"].append({
+                "codigo_postal": registro.codigo_postal,
+                "ciudad": registro.ciudad,
+                "asentamientos": [
+                    {"nombre": a.nombre, "tipo": a.tipo} for a in registro.asentamientos
+                ],
+            })
+
+        self._estados: bytes = _serializar({"estados": [
+            {
+                "codigo_estado": e["codigo_estado"],
+                "estado": e["estado"],
+                "total_municipios": len(e["municipios"]),
+            }
+            for e in sorted(estados.values(), key=lambda e: normalizar_busqueda(e["estado"]))
+        ]})
+
+        self._municipios: Dict[str, bytes] = {}
+        self._codigos_postales: Dict[Tuple[str, str], bytes] = {}
+        for codigo_estado, estado in estados.items():
+            municipios = sorted(estado["municipios"].values(), key=lambda m: normalizar_busqueda(m["municipio"]))
+            self._municipios[codigo_estado] = _serializar({
+                "codigo_estado": codigo_estado,
+                "estado": estado["estado"],
+                "municipios": [
+                    {
+                        "codigo_municipio": m["codigo_municipio"],
+                        "municipio": m["municipio"],
+                        "total_codigos_postales": len(m["codigos_postales"]),
+                    }
+                    for m in municipios
+                ],
+            })
+            for municipio in municipios:
+                self._codigos_postales[(codigo_estado, municipio["codigo_municipio"])] = _serializar({
+                    "codigo_estado": codigo_estado,
+                    "estado": estado["estado"],
+                    "codigo_municipio": municipio["codigo_municipio"],
+                    "municipio": municipio["municipio"],
+                    "codigos_postales": sorted(
+                        municipio["codigos_postales"], key=lambda c: c["codigo_postal"]
+                    ),
+                })
+
+    def estados(self) -> bytes:
+        return self._estados
+
+    def municipios(self, codigo_estado: str) -> Optional[bytes]:
+        return self._municipios.get(normalizar_codigo(codigo_estado, self.LARGO_ESTADO))
+
+    def codigos_postales(self, codigo_estado: str, codigo_municipio: str) -> Optional[bytes]:
+        return self._codigos_postales.get((
+            normalizar_codigo(codigo_estado, self.LARGO_ESTADO),
+            normalizar_codigo(codigo_municipio, self.LARGO_MUNICIPIO),
+        ))
@@ -0,0 +1,316 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from services.ubicaciones_fuentes import parsear_fuente
+from services.ubicaciones_parser import AgrupadorCP
+from services.ubicaciones_snapshot import SNAPSHOT_PATH, exportar_snapshot
+from services.ubicaciones_writer import (
+    JOBS_COLLECTION_NAME,
+    TIPO_CARGA_UBICACIONES,
+    BulkWriter,
+    cargar_catalogo,
+    cargar_fuente,
+)
+
+# Origen de las cargas que corren dentro de la API; el worker no las reclama
+ORIGEN_API = "api"
+
+# Segundos mínimos entre actualizaciones de progreso del job
+INTERVALO_PROGRESO = 2.0
+# Un job 'running' sin heartbeat en este tiempo se considera abandonado
+HEARTBEAT_TIMEOUT = timedelta(minutes=10)
+
+
+class CargaCancelada(Exception):
+    """Se solicitó cancelar el job mientras se ejecutaba"""
+
+
+class CargaActiva(Exception):
+    """Ya hay una carga del catálogo activa (encolada o dentro de la API)"""
+
+    def __init__(self, job: Dict):
+        super().__init__("Ya hay una carga de ubicaciones activa")
+        self.job = job
+
+
+async def asegurar_indices(db: AsyncIOMotorDatabase):
+    """Índices de la colección de jobs; el único parcial impide dos cargas activas"""
+    jobs = db[JOBS_COLLECTION_NAME]
+    await jobs.create_index(
+        [("tipo", ASCENDING), ("activo", ASCENDING)],
+        unique=True,
+        partialFilterExpression={"activo": True},
+        name="una_carga_activa"
+    )
+    await jobs.create_index([("estado", ASCENDING), ("creado", ASCENDING)])
+
+
+async def encolar_carga(db: AsyncIOMotorDatabase, parametros: Dict) -> Tuple[Dict, bool]:
+    """
+    Registrar una carga pendiente para que la tome el worker.
+
+    Args:
+        db: Base de datos
+        parametros: Parámetros de la carga (xml_file_path, parallel)
+
+    Returns:
+        (job, creado): si ya hay una carga activa se devuelve esa con creado=False
+    """
+    await asegurar_indices(db)
+    jobs = db[JOBS_COLLECTION_NAME]
+
+    job = {
+        "tipo": TIPO_CARGA_UBICACIONES,
+        "estado": "pending",
+        "activo": True,
+        "cancelar": False,
+        "parametros": parametros,
+        "progreso": {
+            "filas_parseadas": 0,
+            "documentos_escritos": 0,
+            "filas_por_segundo": 0.0,
+            "documentos_por_segundo": 0.0,
+        },
+        "creado": datetime.utcnow(),
+    }
+    try:
+        await jobs.insert_one(job)
+        return job, True
+    except DuplicateKeyError:
+        activo = await jobs.find_one({"tipo": TIPO_CARGA_UBICACIONES, "activo": True})
+        return activo, False
+
+
+async def obtener_job(db: AsyncIOMotorDatabase, job_id: str) -> Optional[Dict]:
+    return await db[JOBS_COLLECTION_NAME].find_one({"_id": ObjectId(job_id)})
+
+
+async def cancelar_job(db: AsyncIOMotorDatabase, job_id: str) -> Optional[Dict]:
+    """
+    Cancelar un job: si está pendiente se cancela de inmediato; si ya corre,
+    se marca y el worker lo aborta en su siguiente reporte de progreso.
+    """
+    jobs = db[JOBS_COLLECTION_NAME]
+    job = await jobs.find_one_and_update(
+        {"_id": ObjectId(job_id), "estado": "pending"},
+        {"$set": {"estado": "cancelled", "cancelar": True, "terminado": datetime.utcnow()},
+         "$unset": {"activo": ""}},
+        return_document=ReturnDocument.AFTER
+    )
+    if job:
+        return job
+
+    return await jobs.find_one_and_update(
+        {"_id": ObjectId(job_id), "estado": "running"},
+        {"$set": {"cancelar": True}},
+        return_document=ReturnDocument.AFTER
+    ) or await obtener_job(db, job_id)
+
+
+async def reclamar_job(db: AsyncIOMotorDatabase, worker_id: str) -> Optional[Dict]:
+    """
+    Tomar el job pendiente más antiguo (o uno abandonado por otro worker).
+
+    La actualización es atómica, así que dos workers nunca toman el mismo job.
+    """
+    ahora = datetime.utcnow()
+    return await db[JOBS_COLLECTION_NAME].find_one_and_update(
+        {
+            "tipo": TIPO_CARGA_UBICACIONES,
+            "origen": {"$ne": ORIGEN_API},
+            "$or": [
+                {"estado": "pending"},
+                {"estado": "running", "heartbeat": {"$lt": ahora - HEARTBEAT_TIMEOUT}},
+            ],
+        },
+        {"$set": {"estado": "running", "worker": worker_id, "iniciado": ahora, "heartbeat": ahora}},
+        sort=[("creado", ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def _liberar_carga_api_abandonada(db: AsyncIOMotorDatabase) -> bool:
+    """Liberar el candado de una carga de la API cuyo proceso murió sin terminarla"""
+    ahora = datetime.utcnow()
+    resultado = await db[JOBS_COLLECTION_NAME].update_one(
+        {
+            "tipo": TIPO_CARGA_UBICACIONES,
+            "activo": True,
+            "origen": ORIGEN_API,
+            "heartbeat": {"$lt": ahora - HEARTBEAT_TIMEOUT},
+        },
+        {"$set": {"estado": "failed", "error": "Carga abandonada", "terminado": ahora},
+         "$unset": {"activo": ""}}
+    )
+    return resultado.modified_count > 0
+
+
+@asynccontextmanager
+async def carga_exclusiva(
+    db: AsyncIOMotorDatabase,
+    endpoint: str
+) -> AsyncIterator[Callable[..., Awaitable[None]]]:
+    """
+    Tomar el mismo candado que las cargas encoladas para una carga que corre
+    dentro de la API.
+
+    Todas las cargas comparten la colección sombra, así que la carga se
+    registra como job activo (el índice único parcial impide una segunda;
+    una carga reanudable guarda ahí su checkpoint) y se marca como
+    terminada al salir.
+
+    Yields:
+        Corrutina `latido(*_)` que renueva el heartbeat (se puede pasar como
+        `progreso` del escritor); lanza CargaCancelada si se pidió cancelar
+
+    Raises:
+        CargaActiva: Si ya hay otra carga activa
+    """
+    await asegurar_indices(db)
+    jobs = db[JOBS_COLLECTION_NAME]
+    ahora = datetime.utcnow()
+    job = {
+        "tipo": TIPO_CARGA_UBICACIONES,
+        "origen": ORIGEN_API,
+        "estado": "running",
+        "activo": True,
+        "cancelar": False,
+        "parametros": {"endpoint": endpoint},
+        "creado": ahora,
+        "iniciado": ahora,
+        "heartbeat": ahora,
+    }
+    try:
+        await jobs.insert_one(job)
+    except DuplicateKeyError:
+        if not await _liberar_carga_api_abandonada(db):
+            raise CargaActiva(await jobs.find_one({"tipo": TIPO_CARGA_UBICACIONES, "activo": True}))
+        job.pop("_id", None)
+        try:
+            await jobs.insert_one(job)
+        except DuplicateKeyError:
+            raise CargaActiva(await jobs.find_one({"tipo": TIPO_CARGA_UBICACIONES, "activo": True}))
+
+    ultimo_latido = time.monotonic()
+
+    async def latido(*_):
+        nonlocal ultimo_latido
+        if time.monotonic() - ultimo_latido < INTERVALO_PROGRESO:
+            return
+        ultimo_latido = time.monotonic()
+        actual = await jobs.find_one_and_update(
+            {"_id": job["_id"]},
+            {"$set": {"heartbeat": datetime.utcnow()}},
+            projection={"cancelar": 1}
+        )
+        if actual and actual.get("cancelar"):
+            raise CargaCancelada()
+
+    try:
+        yield latido
+    except CargaCancelada:
+        await _terminar_job(db, job["_id"], {"estado": "cancelled"})
+        raise
+    except BaseException as e:
+        await _terminar_job(db, job["_id"], {"estado": "failed", "error": str(e)})
+        raise
+    else:
+        await _terminar_job(db, job["_id"], {"estado": "completed"})
+
+
+async def _terminar_job(db: AsyncIOMotorDatabase, job_id, cambios: Dict):
+    cambios["terminado"] = datetime.utcnow()
+    await db[JOBS_COLLECTION_NAME].update_one(
+        {"_id": job_id},
+        {"$set": cambios, "$unset": {"activo": ""}}
+    )
+
+
+async def ejecutar_job(db: AsyncIOMotorDatabase, bulk_db: AsyncIOMotorDatabase, job: Dict):
+    """
+    Ejecutar una carga del catálogo reportando progreso en el documento del job.
+
+    Args:
+        db: Base de datos con el perfil normal
+        bulk_db: Base de datos con el perfil de carga masiva
+        job: Documento del job ya reclamado
+    """
+    jobs = db[JOBS_COLLECTION_NAME]
+    parametros = job.get("parametros", {})
+    xml_file_path = parametros["xml_file_path"]
+    inicio = time.monotonic()
+    ultimo_reporte = 0.0
+    agrupador = AgrupadorCP()
+
+    def _progreso(documentos_escritos: int) -> Dict:
+        transcurrido = max(time.monotonic() - inicio, 1e-6)
+        filas = agrupador.filas_procesadas
+        return {
+            "filas_parseadas": filas,
+            "documentos_escritos": documentos_escritos,
+            "filas_por_segundo": round(filas / transcurrido, 1),
+            "documentos_por_segundo": round(documentos_escritos / transcurrido, 1),
+        }
+
+    async def reportar(writer: BulkWriter):
+        nonlocal ultimo_reporte
+        if time.monotonic() - ultimo_reporte < INTERVALO_PROGRESO:
+            return
+        ultimo_reporte = time.monotonic()
+
+        # El checkpoint lo escribe la carga en este mismo documento (ver guardar_checkpoint)
+        cambios = {"progreso": _progreso(writer.total_insertados), "heartbeat": datetime.utcnow()}
+        actual = await jobs.find_one_and_update(
+            {"_id": job["_id"]},
+            {"$set": cambios},
+            projection={"cancelar": 1}
+        )
+        if actual and actual.get("cancelar"):
+            raise CargaCancelada()
+
+    print(f"Job {job['_id']}: carga desde {xml_file_path}")
+    try:
+        if parametros.get("parallel"):
+            # El parseo paralelo no reporta filas; el progreso se mide en documentos
+            documentos = await asyncio.get_running_loop().run_in_executor(
+                None, parsear_fuente, xml_file_path, True, parametros.get("workers")
+            )
+            resultado = await cargar_catalogo(
+                db, bulk_db, documentos, progreso=reportar, fuente=xml_file_path
+            )
+        else:
+            # Reanudable: si el job se reclama tras una caída, continúa desde el checkpoint
+            resultado = await cargar_fuente(
+                db, bulk_db, xml_file_path, agrupador=agrupador, progreso=reportar
+            )
+
+        await _terminar_job(db, job["_id"], {
+            "estado": "completed",
+            "progreso": _progreso(resultado["total_codigos_postales"]),
+            "resultado": resultado,
+        })
+        print(f"Job {job['_id']}: completado ({resultado['total_codigos_postales']} CPs)")
+
+        # Los procesos de la API que compartan el archivo abren el snapshot sin
+        # cargar el catálogo; si falla lo regeneran ellos mismos
+        if SNAPSHOT_PATH:
+            try:
+                await exportar_snapshot(db, SNAPSHOT_PATH)
+            except Exception as e:
+                print(f"Job {job['_id']}: no se pudo escribir el snapshot: {str(e)}")
+
+    except CargaCancelada:
+        await _terminar_job(db, job["_id"], {"estado": "cancelled"})
+        print(f"Job {job['_id']}: cancelado")
+
+    except Exception as e:
+        await _terminar_job(db, job["_id"], {"estado": "failed", "error": str(e)})
+        print(f"Job {job['_id']}: error {str(e)}")
@@ -0,0 +1,383 @@
+import mmap
+import multiprocessing
+import os
+import re
+import sys
+import unicodedata
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+# Campos del asentamiento -> tag del XML
+CAMPOS_ASENTAMIENTO = {
+    'nombre': 'd_asenta',
+    'tipo': 'd_tipo_asenta',
+    'zona': 'd_zona',
+    'codigo_tipo': 'c_tipo_asenta',
+    'id_asentamiento': 'id_asenta_cpcons',
+}
+
+# Campos del documento por código postal -> tag del XML
+CAMPOS_UBICACION = {
+    'municipio': 'D_mnpio',
+    'estado': 'd_estado',
+    'ciudad': 'd_ciudad',
+    'cp_oficina': 'd_CP',
+    'codigo_estado': 'c_estado',
+    'codigo_oficina': 'c_oficina',
+    'codigo_cp': 'c_CP',
+    'codigo_municipio': 'c_mnpio',
+    'codigo_ciudad': 'c_cve_ciudad',
+}
+
+
+def resolver_prefijo(root_tag: str) -> str:
+    """Obtener el prefijo '{namespace}' del elemento raíz (vacío si no tiene)"""
+    return root_tag[:root_tag.index('}') + 1] if root_tag.startswith('{') else ""
+
+
+def normalizar_codigo_postal(codigo_postal_raw: str) -> str:
+    """
+    Dejar solo los dígitos del código postal y completarlo a 5 posiciones.
+
+    Returns:
+        Código postal normalizado o cadena vacía si no contiene dígitos
+    """
+    codigo_postal = ''.join(filter(str.isdigit, codigo_postal_raw.strip()))
+    return codigo_postal.zfill(5) if codigo_postal else ""
+
+
+def normalizar_busqueda(texto: str) -> str:
+    """
+    Clave de búsqueda: minúsculas, sin acentos y con espacios simples.
+
+    "  Ciudad de MÉXICO " -> "ciudad de mexico"
+    """
+    descompuesto = unicodedata.normalize('NFKD', texto or "")
+    sin_acentos = ''.join(c for c in descompuesto if not unicodedata.combining(c))
+    return ' '.join(sin_acentos.lower().split())
+
+
+def decodificar_fila(table, prefijo: str = "") -> Dict[str, str]:
+    """
+    Leer un elemento <table> en una sola pasada sobre sus hijos.
+
+    Args:
+        table: Elemento <table> del XML
+        prefijo: Prefijo '{namespace}' resuelto una vez por archivo
+
+    Returns:
+        Diccionario tag (sin namespace) -> texto
+    """
+    corte = len(prefijo)
+    fila = {}
+    for child in table:
+        tag = child.tag
+        if corte and tag.startswith(prefijo):
+            tag = tag[corte:]
+        text = child.text
+        fila[tag] = text.strip() if text else ""
+    return fila
+
+
+def iter_xml_filas(xml_file_path: Union[str, IO[bytes]]) -> Iterator[Dict[str, str]]:
+    """
+    Recorrer el XML con iterparse y entregar cada <table> como diccionario.
+
+    Cada elemento se libera en cuanto se consume, por lo que la memoria
+    no crece con el tamaño del archivo.
+
+    Args:
+        xml_file_path: Ruta al archivo XML o flujo de bytes ya abierto
+
+    Yields:
+        Diccionario tag -> texto de cada registro
+    """
+    context = ET.iterparse(xml_file_path, events=('start', 'end'))
+    _, root = next(context)
+
+    # El namespace se resuelve una sola vez a partir de la raíz
+    prefijo = resolver_prefijo(root.tag)
+    tag_table = prefijo + 'table'
+
+    for event, element in context:
+        if event != 'end' or element.tag != tag_table:
+            continue
+
+        yield decodificar_fila(element, prefijo)
+
+        # Liberar el registro ya consumido y desligarlo de la raíz
+        element.clear()
+        root.clear()
+
+
+def _nuevo_documento(codigo_postal: str, fila: Dict[str, str]) -> Dict:
+    """
+    Crear el documento de un código postal a partir de su primer registro.
+
+    Los valores se internan: estado, municipio, ciudad y los códigos se
+    repiten en miles de CPs y así todos comparten el mismo objeto.
+    """
+    documento = {'codigo_postal': codigo_postal}
+    for campo, tag in CAMPOS_UBICACION.items():
+        documento[campo] = sys.intern(fila.get(tag, ""))
+    documento['asentamientos'] = []
+    return documento
+
+
+def _nuevo_asentamiento(fila: Dict[str, str]) -> Dict[str, str]:
+    """Crear la estructura de asentamiento de un registro (valores internados)"""
+    return {campo: sys.intern(fila.get(tag, "")) for campo, tag in CAMPOS_ASENTAMIENTO.items()}
+
+
+def fusionar_asentamientos(documento: Dict, asentamientos: Iterable[Dict]) -> int:
+    """
+    Agregar asentamientos a un documento omitiendo nombres ya presentes.
+
+    Returns:
+        Número de asentamientos agregados
+    """
+    nombres = {a['nombre'] for a in documento['asentamientos']}
+    agregados = 0
+    for asentamiento in asentamientos:
+        if asentamiento['nombre'] in nombres:
+            continue
+        nombres.add(asentamiento['nombre'])
+        documento['asentamientos'].append(asentamiento)
+        agregados += 1
+    return agregados
+
+
+class AgrupadorCP:
+    """
+    Agrupar registros consecutivos por código postal sin materializar el archivo.
+
+    SEPOMEX publica los registros ordenados por código postal dentro de cada
+    estado, así que un CP se emite en cuanto aparece un código distinto. Si un
+    CP ya emitido vuelve a aparecer, sus registros se acumulan en `rezagados`
+    para que el cargador los fusione al final con el documento ya escrito.
+
+    `filas_emitidas` cuenta las filas ya cubiertas por los documentos
+    emitidos (y los rezagados); es la posición desde la que se puede
+    reanudar una carga interrumpida (ver `marca` y `reanudar`).
+    """
+
+    def __init__(self):
+        self.emitidos: Set[str] = set()
+        self.rezagados: Dict[str, Dict] = {}
+        self.filas_procesadas = 0
+        self.filas_emitidas = 0
+
+    def reanudar(self, filas: int, emitidos: Iterable[str], rezagados: Dict[str, Dict]):
+        """
+        Continuar una agrupación interrumpida a partir de la fila `filas`.
+
+        Args:
+            filas: Filas ya cubiertas por la carga anterior
+            emitidos: CPs ya escritos por la carga anterior
+            rezagados: CPs rezagados pendientes de fusionar al momento de la marca
+        """
+        self.filas_procesadas = self.filas_emitidas = filas
+        self.emitidos = set(emitidos)
+        self.rezagados = rezagados
+
+    def marca(self) -> Dict:
+        """
+        Posición actual para un checkpoint: filas cubiertas y cuántos
+        asentamientos tenía cada rezagado (las listas solo crecen, así que
+        basta con recortarlas a ese largo al guardar).
+        """
+        return {
+            "filas": self.filas_emitidas,
+            "rezagados": {cp: len(doc['asentamientos']) for cp, doc in self.rezagados.items()},
+        }
+
+    def agrupar(self, filas: Iterable[Dict[str, str]]) -> Iterator[Dict]:
+        """
+        Convertir un flujo de registros en documentos agrupados por CP.
+
+        Args:
+            filas: Registros tag -> texto (ver `iter_xml_filas`)
+
+        Yields:
+            Documento completo de cada código postal
+        """
+        actual: Optional[Dict] = None
+        nombres: Set[str] = set()
+
+        for fila in filas:
+            self.filas_procesadas += 1
+
+            codigo_postal = normalizar_codigo_postal(fila.get('d_codigo', ""))
+            if not codigo_postal:
+                continue
+
+            asentamiento = _nuevo_asentamiento(fila)
+
+            if actual is None or actual['codigo_postal'] != codigo_postal:
+                if actual is not None:
+                    # La fila actual ya es del siguiente CP
+                    self.filas_emitidas = self.filas_procesadas - 1
+                    self._emitir(actual)
+                    yield actual
+
+                if codigo_postal in self.emitidos:
+                    # CP fuera de orden: guardarlo aparte para fusionarlo después
+                    rezagado = self.rezagados.setdefault(
+                        codigo_postal, _nuevo_documento(codigo_postal, fila)
+                    )
+                    fusionar_asentamientos(rezagado, [asentamiento])
+                    actual = None
+                    continue
+
+                actual = _nuevo_documento(codigo_postal, fila)
+                nombres = set()
+
+            # Agregar asentamiento si no está duplicado
+            if asentamiento['nombre'] not in nombres:
+                nombres.add(asentamiento['nombre'])
+                actual['asentamientos'].append(asentamiento)
+
+        self.filas_emitidas = self.filas_procesadas
+        if actual is not None:
+            self._emitir(actual)
+            yield actual
+
+    def _emitir(self, documento: Dict):
+        self.emitidos.add(documento['codigo_postal'])
+
+
+def agrupar_ubicaciones(filas: Iterable[Dict[str, str]]) -> List[Dict]:
+    """
+    Agrupar todos los registros por código postal en memoria.
+
+    A diferencia de `AgrupadorCP`, fusiona un CP aunque sus registros no sean
+    consecutivos. Los nombres de asentamiento se deduplican con un set por CP.
+
+    Args:
+        filas: Registros tag -> texto
+
+    Returns:
+        Lista de documentos agrupados por CP, en orden de aparición
+    """
+    cp_dict: Dict[str, Dict] = {}
+    nombres_por_cp: Dict[str, Set[str]] = {}
+
+    for fila in filas:
+        codigo_postal = normalizar_codigo_postal(fila.get('d_codigo', ""))
+        if not codigo_postal:
+            continue
+
+        documento = cp_dict.get(codigo_postal)
+        if documento is None:
+            documento = cp_dict[codigo_postal] = _nuevo_documento(codigo_postal, fila)
+            nombres_por_cp[codigo_postal] = set()
+
+        nombre = fila.get('d_asenta', "")
+        nombres = nombres_por_cp[codigo_postal]
+        if nombre not in nombres:
+            nombres.add(nombre)
+            documento['asentamientos'].append(_nuevo_asentamiento(fila))
+
+    return list(cp_dict.values())
+
+
+def dividir_xml_en_rangos(xml_file_path: str, num_rangos: int) -> Tuple[bytes, bytes, List[Tuple[int, int]]]:
+    """
+    Dividir el XML en rangos de bytes que empiezan siempre en un <table>.
+
+    Args:
+        xml_file_path: Ruta al archivo XML
+        num_rangos: Número de rangos deseado (puede resultar en menos)
+
+    Returns:
+        (encabezado, cierre, rangos): el encabezado es todo lo anterior al
+        primer <table> (declaración, raíz y esquema) y el cierre es la
+        etiqueta de fin de la raíz; con ambos cada rango es un XML válido
+    """
+    with open(xml_file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        primer_table = mm.find(b'<table>')
+        if primer_table == -1:
+            return b"", b"", []
+
+        encabezado = mm[:primer_table]
+        # Nombre de la raíz: primer elemento que no sea declaración ni comentario
+        raiz = re.search(rb'<([A-Za-z_][\w.:-]*)', re.sub(rb'<[?!][^>]*>', b'', encabezado))
+        cierre = b'</' + raiz.group(1) + b'>'
+        fin = mm.rfind(cierre)
+
+        paso = max((fin - primer_table) // max(num_rangos, 1), 1)
+        inicios = [primer_table]
+        while True:
+            siguiente = mm.find(b'<table>', inicios[-1] + paso, fin)
+            if siguiente == -1:
+                break
+            inicios.append(siguiente)
+
+        rangos = list(zip(inicios, inicios[1:] + [fin]))
+        return encabezado, cierre, rangos
+
+
+def _parsear_rango(xml_file_path: str, encabezado: bytes, cierre: bytes, inicio: int, fin: int) -> List[Dict]:
+    """Parsear un rango de bytes del XML (se ejecuta en un proceso del pool)"""
+    with open(xml_file_path, 'rb') as f:
+        f.seek(inicio)
+        fragmento = f.read(fin - inicio)
+
+    root = ET.fromstring(encabezado + fragmento + cierre)
+    prefijo = resolver_prefijo(root.tag)
+    filas = (decodificar_fila(table, prefijo) for table in root.iter(prefijo + 'table'))
+    return agrupar_ubicaciones(filas)
+
+
+def parse_xml_parallel(xml_file_path: str, workers: Optional[int] = None, rangos_por_worker: int = 4) -> List[Dict]:
+    """
+    Parsear el XML repartiendo rangos de bytes entre varios procesos.
+
+    Los resultados parciales se fusionan en el orden del archivo con
+    `fusionar_asentamientos`, así que el resultado es el mismo que el de
+    `agrupar_ubicaciones(iter_xml_filas(xml_file_path))`.
+
+    Args:
+        xml_file_path: Ruta al archivo XML
+        workers: Número de procesos (default: núcleos disponibles)
+        rangos_por_worker: Rangos por proceso, para balancear la carga
+
+    Returns:
+        Lista de documentos agrupados por CP, en orden de aparición
+    """
+    workers = workers or os.cpu_count() or 1
+    encabezado, cierre, rangos = dividir_xml_en_rangos(xml_file_path, workers * rangos_por_worker)
+    if not rangos:
+        return []
+
+    cp_dict: Dict[str, Dict] = {}
+
+    # spawn evita heredar el event loop y los hilos del cliente de MongoDB
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        parciales = pool.map(
+            _parsear_rango,
+            *zip(*[(xml_file_path, encabezado, cierre, inicio, fin) for inicio, fin in rangos])
+        )
+
+        for parcial in parciales:
+            for documento in parcial:
+                existente = cp_dict.get(documento['codigo_postal'])
+                if existente is None:
+                    cp_dict[documento['codigo_postal']] = documento
+                else:
+                    fusionar_asentamientos(existente, documento['asentamientos'])
+
+    return list(cp_dict.values())
+
+
+def iter_lotes(documentos: Iterable[Dict], batch_size: int) -> Iterator[List[Dict]]:
+    """Agrupar un flujo de documentos en listas de tamaño `batch_size`"""
+    lote = []
+    for documento in documentos:
+        lote.append(documento)
+        if len(lote) >= batch_size:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
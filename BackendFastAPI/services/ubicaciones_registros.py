@@ -0,0 +1,121 @@
+import json
+import sys
+import zlib
+from typing import Dict, Iterable, List, Protocol, Sequence, Tuple
+
+from models.ubicacion_model import Ubicacion
+from services.ubicaciones_parser import CAMPOS_ASENTAMIENTO, CAMPOS_UBICACION
+
+# Campos que devuelven el autocompletado y la búsqueda difusa
+CAMPOS_RESULTADO_CP = ("codigo_postal", "municipio", "estado")
+CAMPOS_RESULTADO_ASENTAMIENTO = ("nombre", "tipo")
+
+# Compresión del JSON de /cp guardado por CP: ~1/3 del tamaño y unos µs al descomprimir
+NIVEL_COMPRESION_RESPUESTA = 6
+
+
+class RegistroCP:
+    """
+    Código postal del catálogo en memoria.
+
+    Usa __slots__ (sin __dict__ por instancia) y sus cadenas están
+    internadas: los valores que se repiten (estado, municipio, ciudad,
+    códigos) son un solo objeto para todo el catálogo.
+    """
+
+    __slots__ = ("codigo_postal", *CAMPOS_UBICACION, "asentamientos")
+
+    codigo_postal: str
+    asentamientos: Tuple["RegistroAsentamiento", ...]
+
+    def a_documento(self) -> Dict:
+        """Documento con la misma forma que la colección (para el modelo Ubicacion)"""
+        documento = {"codigo_postal": self.codigo_postal}
+        for campo in CAMPOS_UBICACION:
+            documento[campo] = getattr(self, campo)
+        documento["asentamientos"] = [a.a_documento() for a in self.asentamientos]
+        return documento
+
+
+class RegistroAsentamiento:
+    """Asentamiento con referencia a su RegistroCP en lugar de copiar sus datos"""
+
+    __slots__ = (*CAMPOS_ASENTAMIENTO, "cp")
+
+    cp: RegistroCP
+
+    def a_documento(self) -> Dict:
+        return {campo: getattr(self, campo) for campo in CAMPOS_ASENTAMIENTO}
+
+
+def compactar(documentos: Iterable[Dict]) -> List[RegistroCP]:
+    """
+    Convertir documentos de CP a registros compactos con cadenas internadas.
+
+    Los asentamientos quedan en una tupla y apuntan a su CP, así los
+    índices de búsqueda guardan una referencia al asentamiento en lugar
+    de copiar nombre, CP, municipio y estado.
+    """
+    registros = []
+    for doc in documentos:
+        registro = RegistroCP()
+        registro.codigo_postal = sys.intern(doc["codigo_postal"])
+        for campo in CAMPOS_UBICACION:
+            setattr(registro, campo, sys.intern(doc.get(campo, "")))
+
+        asentamientos = []
+        for a in doc.get("asentamientos", []):
+            asentamiento = RegistroAsentamiento()
+            for campo in CAMPOS_ASENTAMIENTO:
+                setattr(asentamiento, campo, sys.intern(a.get(campo, "")))
+            asentamiento.cp = registro
+            asentamientos.append(asentamiento)
+        registro.asentamientos = tuple(asentamientos)
+
+        registros.append(registro)
+    return registros
+
+
+def codificar_respuesta(documento: Dict) -> bytes:
+    """
+    JSON final de /cp/{codigo_postal} para un CP, validado y comprimido con zlib.
+
+    Se calcula una vez por CP al cargar el catálogo; cada consulta solo
+    descomprime. Mismo formato que JSONResponse: UTF-8 sin escapar y sin espacios.
+    """
+    contenido = json.dumps(Ubicacion(**documento).dict(), ensure_ascii=False, separators=(",", ":"))
+    return zlib.compress(contenido.encode("utf-8"), NIVEL_COMPRESION_RESPUESTA)
+
+
+class CatalogoPosicional(Protocol):
+    """Catálogo cuyos CPs se leen por posición (orden de iteración al construir los índices)"""
+
+    def campos_cp(self, i: int, campos: Tuple[str, ...]) -> Tuple[str, ...]: ...
+
+    def campos_asentamiento(self, i: int, j: int, campos: Tuple[str, ...]) -> Tuple[str, ...]: ...
+
+
+class RegistrosCatalogo:
+    """
+    Acceso por posición a una lista de registros compactos.
+
+    Los índices de búsqueda guardan posiciones (CP y asentamiento dentro del
+    CP) y leen los campos de aquí o del snapshot mmap (ver
+    `SnapshotCatalogo`), que expone los mismos métodos.
+    """
+
+    __slots__ = ("_registros",)
+
+    def __init__(self, registros: Sequence[RegistroCP]):
+        self._registros = registros
+
+    def __len__(self) -> int:
+        return len(self._registros)
+
+    def campos_cp(self, i: int, campos: Tuple[str, ...]) -> Tuple[str, ...]:
+        registro = self._registros[i]
+        return tuple(getattr(registro, campo) for campo in campos)
+
+    def campos_asentamiento(self, i: int, j: int, campos: Tuple[str, ...]) -> Tuple[str, ...]:
+        asentamiento = self._registros[i].asentamientos[j]
+        return tuple(getattr(asentamiento, campo) for campo in campos)
@@ -0,0 +1,274 @@
+import asyncio
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import zlib
+from bisect import bisect_left
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from services.ubicaciones_registros import codificar_respuesta
+from services.ubicaciones_writer import CATALOGO_CONFIG_ID, COLLECTION_NAME, PROYECCION_PUBLICA
+
+# Archivo con la copia binaria del catálogo; vacío desactiva el snapshot.
+# Todos los workers de uvicorn que lo abren comparten las mismas páginas en memoria
+SNAPSHOT_PATH = os.getenv(
+    "UBICACIONES_SNAPSHOT_PATH",
+    os.path.join(tempfile.gettempdir(), "ubicaciones_catalogo.snap")
+)
+
+MAGIC = b"UBCP"
+FORMATO = 2
+LARGO_CP = 5
+
+# magic, formato, reservado, versión del catálogo, CPs, cadenas,
+# inicio de registros, inicio del índice de cadenas, inicio de cadenas,
+# inicio del índice de respuestas, inicio de respuestas
+ENCABEZADO = struct.Struct("<4sHHIIIIIIII")
+U32 = struct.Struct("<I")
+U16 = struct.Struct("<H")
+
+# Campos del CP y de cada asentamiento, guardados como índices del pool de cadenas
+CAMPOS_CP = (
+    "municipio", "estado", "ciudad", "cp_oficina", "codigo_estado",
+    "codigo_oficina", "codigo_cp", "codigo_municipio", "codigo_ciudad",
+)
+CAMPOS_ASENTAMIENTO = ("nombre", "tipo", "zona", "codigo_tipo", "id_asentamiento")
+REGISTRO_CP = struct.Struct(f"<{len(CAMPOS_CP)}IH")
+REGISTRO_ASENTAMIENTO = struct.Struct(f"<{len(CAMPOS_ASENTAMIENTO)}I")
+POSICION_CP = {campo: i for i, campo in enumerate(CAMPOS_CP)}
+POSICION_ASENTAMIENTO = {campo: i for i, campo in enumerate(CAMPOS_ASENTAMIENTO)}
+
+
+def escribir_snapshot(path: str, documentos: Iterable[Dict], version: int) -> int:
+    """
+    Escribir el catálogo en formato binario compacto.
+
+    Estructura: encabezado, claves de CP de ancho fijo ordenadas, tabla de
+    offsets de los registros, registros (índices de cadenas), el pool de
+    cadenas sin repetidos y el JSON de /cp de cada CP ya validado y
+    comprimido (ver `codificar_respuesta`). El archivo se escribe aparte y se reemplaza con
+    os.replace, así quien ya lo tiene mapeado conserva la versión anterior.
+
+    Returns:
+        Número de CPs escritos
+    """
+    documentos = sorted(documentos, key=lambda d: d["codigo_postal"])
+    cadenas: Dict[str, int] = {}
+
+    def indice(valor: str) -> int:
+        return cadenas.setdefault(valor or "", len(cadenas))
+
+    claves = bytearray()
+    offsets = bytearray()
+    registros = bytearray()
+    indice_respuestas = bytearray()
+    respuestas = bytearray()
+    for doc in documentos:
+        codigo_postal = doc["codigo_postal"].encode("ascii")
+        if len(codigo_postal) != LARGO_CP:
+            raise ValueError(f"Código postal inválido para el snapshot: {doc['codigo_postal']!r}")
+        claves += codigo_postal
+        offsets += U32.pack(len(registros))
+
+        asentamientos = doc.get("asentamientos", [])
+        registros += REGISTRO_CP.pack(*(indice(doc.get(c, "")) for c in CAMPOS_CP), len(asentamientos))
+        for asentamiento in asentamientos:
+            registros += REGISTRO_ASENTAMIENTO.pack(
+                *(indice(asentamiento.get(c, "")) for c in CAMPOS_ASENTAMIENTO)
+            )
+
+        indice_respuestas += U32.pack(len(respuestas))
+        respuestas += codificar_respuesta(doc)
+    indice_respuestas += U32.pack(len(respuestas))
+
+    pool = bytearray()
+    indice_cadenas = bytearray()
+    for valor in cadenas:  # los dict conservan el orden de inserción = índice
+        indice_cadenas += U32.pack(len(pool))
+        pool += valor.encode("utf-8")
+    indice_cadenas += U32.pack(len(pool))
+
+    inicio_registros = ENCABEZADO.size + len(claves) + len(offsets)
+    inicio_indice = inicio_registros + len(registros)
+    inicio_cadenas = inicio_indice + len(indice_cadenas)
+    inicio_indice_respuestas = inicio_cadenas + len(pool)
+    inicio_respuestas = inicio_indice_respuestas + len(indice_respuestas)
+    encabezado = ENCABEZADO.pack(
+        MAGIC, FORMATO, 0, version, len(documentos), len(cadenas),
+        inicio_registros, inicio_indice, inicio_cadenas,
+        inicio_indice_respuestas, inicio_respuestas
+    )
+
+    directorio = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directorio, exist_ok=True)
+    fd, temporal = tempfile.mkstemp(prefix=".ubicaciones_", dir=directorio)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for parte in (encabezado, claves, offsets, registros, indice_cadenas, pool, indice_respuestas, respuestas):
+                f.write(parte)
+        os.replace(temporal, path)
+    except BaseException:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+    return len(documentos)
+
+
+class _Claves:
+    """Vista de las claves de CP del mmap como secuencia, para bisect"""
+
+    def __init__(self, datos: mmap.mmap, total: int):
+        self._datos = datos
+        self._total = total
+
+    def __len__(self) -> int:
+        return self._total
+
+    def __getitem__(self, i: int) -> bytes:
+        inicio = ENCABEZADO.size + i * LARGO_CP
+        return self._datos[inicio:inicio + LARGO_CP]
+
+
+class SnapshotCatalogo:
+    """
+    Catálogo de CPs leído con mmap desde el archivo de `escribir_snapshot`.
+
+    No se carga nada al abrirlo: las búsquedas hacen búsqueda binaria sobre
+    las claves y decodifican solo el registro encontrado. El sistema
+    operativo comparte las páginas del archivo entre procesos.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._datos = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            (magic, formato, _, self.version, self._total, self._total_cadenas,
+             self._inicio_registros, self._inicio_indice, self._inicio_cadenas,
+             self._inicio_indice_respuestas, self._inicio_respuestas) = ENCABEZADO.unpack_from(self._datos)
+            if magic != MAGIC or formato != FORMATO:
+                raise ValueError(f"{path} no es un snapshot de ubicaciones compatible")
+        except Exception:
+            self._datos.close()
+            raise
+        self._claves = _Claves(self._datos, self._total)
+        self._inicio_offsets = ENCABEZADO.size + self._total * LARGO_CP
+
+    def __len__(self) -> int:
+        return self._total
+
+    def cerrar(self):
+        self._datos.close()
+
+    def _cadena(self, i: int) -> str:
+        inicio, fin = struct.unpack_from("<II", self._datos, self._inicio_indice + i * 4)
+        return self._datos[self._inicio_cadenas + inicio:self._inicio_cadenas + fin].decode("utf-8")
+
+    def _posicion(self, i: int) -> int:
+        (offset,) = U32.unpack_from(self._datos, self._inicio_offsets + i * 4)
+        return self._inicio_registros + offset
+
+    def _cadenas(self) -> List[str]:
+        """Pool de cadenas completo, decodificado una vez (para recorrer todo el catálogo)"""
+        indice = struct.unpack_from(f"<{self._total_cadenas + 1}I", self._datos, self._inicio_indice)
+        pool = self._datos[self._inicio_cadenas:self._inicio_cadenas + indice[-1]]
+        return [sys.intern(pool[inicio:fin].decode("utf-8")) for inicio, fin in zip(indice, indice[1:])]
+
+    def _documento(self, i: int, cadenas: Optional[List[str]] = None) -> Dict:
+        cadena = cadenas.__getitem__ if cadenas is not None else self._cadena
+        posicion = self._posicion(i)
+        valores = REGISTRO_CP.unpack_from(self._datos, posicion)
+        posicion += REGISTRO_CP.size
+
+        doc = {"codigo_postal": self._claves[i].decode("ascii")}
+        for campo, indice in zip(CAMPOS_CP, valores):
+            doc[campo] = cadena(indice)
+
+        asentamientos: List[Dict] = []
+        for _ in range(valores[-1]):
+            indices = REGISTRO_ASENTAMIENTO.unpack_from(self._datos, posicion)
+            posicion += REGISTRO_ASENTAMIENTO.size
+            asentamientos.append({c: cadena(j) for c, j in zip(CAMPOS_ASENTAMIENTO, indices)})
+        doc["asentamientos"] = asentamientos
+        return doc
+
+    def campos_cp(self, i: int, campos: Tuple[str, ...]) -> Tuple[str, ...]:
+        """Campos del CP en la posición i, decodificando solo esas cadenas"""
+        valores = REGISTRO_CP.unpack_from(self._datos, self._posicion(i))
+        return tuple(
+            self._claves[i].decode("ascii") if campo == "codigo_postal" else self._cadena(valores[POSICION_CP[campo]])
+            for campo in campos
+        )
+
+    def campos_asentamiento(self, i: int, j: int, campos: Tuple[str, ...]) -> Tuple[str, ...]:
+        """Campos del asentamiento j del CP en la posición i"""
+        posicion = self._posicion(i) + REGISTRO_CP.size + j * REGISTRO_ASENTAMIENTO.size
+        valores = REGISTRO_ASENTAMIENTO.unpack_from(self._datos, posicion)
+        return tuple(self._cadena(valores[POSICION_ASENTAMIENTO[campo]]) for campo in campos)
+
+    def _buscar_posicion(self, codigo_postal: str) -> Optional[int]:
+        clave = codigo_postal.encode("ascii", "ignore")
+        i = bisect_left(self._claves, clave)
+        if i < self._total and self._claves[i] == clave:
+            return i
+        return None
+
+    def buscar(self, codigo_postal: str) -> Optional[Dict]:
+        """Buscar un CP ya normalizado a 5 dígitos"""
+        i = self._buscar_posicion(codigo_postal)
+        return self._documento(i) if i is not None else None
+
+    def respuesta(self, codigo_postal: str) -> Optional[bytes]:
+        """JSON de /cp ya validado para un CP normalizado, sin decodificar el registro"""
+        i = self._buscar_posicion(codigo_postal)
+        if i is None:
+            return None
+        inicio, fin = struct.unpack_from("<II", self._datos, self._inicio_indice_respuestas + i * 4)
+        return zlib.decompress(self._datos[self._inicio_respuestas + inicio:self._inicio_respuestas + fin])
+
+    def iter_documentos(self) -> Iterator[Dict]:
+        """Recorrer el catálogo completo en orden de CP"""
+        cadenas = self._cadenas()
+        for i in range(self._total):
+            yield self._documento(i, cadenas)
+
+
+def abrir_snapshot(path: str, version: Optional[int]) -> Optional[SnapshotCatalogo]:
+    """Abrir el snapshot solo si existe y corresponde a la versión publicada"""
+    if not path or version is None or not os.path.exists(path):
+        return None
+    try:
+        snapshot = SnapshotCatalogo(path)
+    except (OSError, ValueError, struct.error) as e:
+        print(f"Snapshot de ubicaciones ilegible ({path}): {str(e)}")
+        return None
+    if snapshot.version != version:
+        snapshot.cerrar()
+        return None
+    return snapshot
+
+
+async def exportar_snapshot(db: AsyncIOMotorDatabase, path: str = SNAPSHOT_PATH) -> Optional[int]:
+    """
+    Escribir el snapshot del catálogo publicado en MongoDB.
+
+    La versión se lee antes que los documentos: si otra carga publica
+    mientras tanto, el snapshot queda con la versión anterior y los procesos
+    de la API lo regeneran en lugar de servir datos viejos.
+
+    Returns:
+        Versión escrita, o None si no hay catálogo publicado
+    """
+    config = await db.config.find_one({"_id": CATALOGO_CONFIG_ID}, {"version": 1})
+    if not config or config.get("version") is None:
+        return None
+
+    documentos = await db[COLLECTION_NAME].find({}, PROYECCION_PUBLICA).to_list(length=None)
+    total = await asyncio.get_running_loop().run_in_executor(
+        None, escribir_snapshot, path, documentos, config["version"]
+    )
+    print(f"Snapshot de ubicaciones escrito en {path}: {total} CPs, versión {config['version']}")
+    return config["version"]
@@ -0,0 +1,153 @@
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set
+
+from services.ubicaciones_parser import normalizar_busqueda
+from services.ubicaciones_registros import (
+    CAMPOS_RESULTADO_ASENTAMIENTO,
+    CAMPOS_RESULTADO_CP,
+    CatalogoPosicional,
+    RegistroCP,
+)
+
+# Similitud mínima (coeficiente de Dice sobre trigramas) para aceptar un resultado
+SIMILITUD_MINIMA = 0.3
+LIMITE_MAXIMO = 50
+
+
+def trigramas(texto: str) -> Set[str]:
+    """
+    Trigramas de cada palabra del texto normalizado, con relleno.
+
+    Se rellena como pg_trgm ("  palabra ") para que el inicio y el fin de
+    cada palabra cuenten más que el centro.
+    """
+    resultado = set()
+    for palabra in normalizar_busqueda(texto).split():
+        relleno = f"  {palabra} "
+        for i in range(len(relleno) - 2):
+            resultado.add(relleno[i:i + 3])
+    return resultado
+
+
+class IndiceTrigramas:
+    """
+    Índice invertido de trigramas sobre los nombres de asentamientos.
+
+    Cada nombre distinto (normalizado) se indexa una sola vez y apunta a
+    todos los asentamientos que lo usan. Una búsqueda cuenta los trigramas
+    compartidos con cada nombre candidato y ordena por similitud, así se
+    toleran errores de dedo, palabras incompletas y acentos faltantes.
+    Cada asentamiento se guarda como posición en el catálogo (registros
+    compactos o snapshot mmap); los resultados se leen de ahí.
+    """
+
+    def __init__(self, registros: Iterable[RegistroCP], catalogo: CatalogoPosicional):
+        """
+        Args:
+            registros: Registros en el mismo orden que las posiciones de `catalogo`
+            catalogo: Catálogo del que se leen los resultados
+        """
+        nombres: Dict[str, int] = {}
+        # Estado o municipio normalizado -> id; cada CP guarda los ids de los suyos
+        self._lugares: Dict[str, int] = {}
+        lugar_por_texto: Dict[str, int] = {}
+        self._estado_cp = array("I")
+        self._municipio_cp = array("I")
+        self._asentamiento_cp = array("I")
+        self._asentamiento_posicion = array("I")
+        self._por_nombre: List[array] = []
+        self._total_trigramas: List[int] = []
+        postings: Dict[str, array] = {}
+
+        def id_lugar(texto: str) -> int:
+            id_texto = lugar_por_texto.get(texto)
+            if id_texto is None:
+                id_texto = lugar_por_texto[texto] = self._lugares.setdefault(
+                    normalizar_busqueda(texto), len(self._lugares)
+                )
+            return id_texto
+
+        for i, registro in enumerate(registros):
+            self._estado_cp.append(id_lugar(registro.estado))
+            self._municipio_cp.append(id_lugar(registro.municipio))
+            for j, asentamiento in enumerate(registro.asentamientos):
+                clave = normalizar_busqueda(asentamiento.nombre)
+                id_nombre = nombres.get(clave)
+                if id_nombre is None:
+                    id_nombre = nombres[clave] = len(nombres)
+                    self._por_nombre.append(array("I"))
+                    tris = trigramas(clave)
+                    self._total_trigramas.append(len(tris))
+                    for tri in tris:
+                        postings.setdefault(tri, array("I")).append(id_nombre)
+                self._por_nombre[id_nombre].append(len(self._asentamiento_cp))
+                self._asentamiento_cp.append(i)
+                self._asentamiento_posicion.append(j)
+
+        self._catalogo = catalogo
+        self._postings = postings
+
+    def buscar(
+        self,
+        consulta: str,
+        estado: Optional[str] = None,
+        municipio: Optional[str] = None,
+        limite: int = 10,
+        similitud_minima: float = SIMILITUD_MINIMA
+    ) -> List[Dict]:
+        """
+        Asentamientos ordenados por similitud con la consulta.
+
+        Args:
+            consulta: Texto a buscar (con o sin acentos)
+            estado: Filtrar por estado (sin importar acentos ni mayúsculas)
+            municipio: Filtrar por municipio (sin importar acentos ni mayúsculas)
+            limite: Número máximo de resultados
+            similitud_minima: Similitud de Dice mínima (0 a 1)
+        """
+        tris = trigramas(consulta)
+        if not tris:
+            return []
+
+        coincidencias = Counter()
+        for tri in tris:
+            posting = self._postings.get(tri)
+            if posting is not None:
+                coincidencias.update(posting)
+
+        total_consulta = len(tris)
+        candidatos = []
+        for id_nombre, comunes in coincidencias.items():
+            similitud = 2.0 * comunes / (total_consulta + self._total_trigramas[id_nombre])
+            if similitud >= similitud_minima:
+                candidatos.append((similitud, id_nombre))
+        candidatos.sort(key=lambda c: (-c[0], c[1]))
+
+        # Un filtro que no coincide con ningún estado o municipio no tiene resultados
+        id_estado = self._lugares.get(normalizar_busqueda(estado), -1) if estado else None
+        id_municipio = self._lugares.get(normalizar_busqueda(municipio), -1) if municipio else None
+
+        resultados = []
+        for similitud, id_nombre in candidatos:
+            for indice in self._por_nombre[id_nombre]:
+                i = self._asentamiento_cp[indice]
+                if id_estado is not None and self._estado_cp[i] != id_estado:
+                    continue
+                if id_municipio is not None and self._municipio_cp[i] != id_municipio:
+                    continue
+                nombre, tipo = self._catalogo.campos_asentamiento(
+                    i, self._asentamiento_posicion[indice], CAMPOS_RESULTADO_ASENTAMIENTO
+                )
+                codigo_postal, municipio_cp, estado_cp = self._catalogo.campos_cp(i, CAMPOS_RESULTADO_CP)
+                resultados.append({
+                    "nombre": nombre,
+                    "tipo": tipo,
+                    "codigo_postal": codigo_postal,
+                    "municipio": municipio_cp,
+                    "estado": estado_cp,
+                    "similitud": round(similitud, 3),
+                })
+                if len(resultados) >= limite:
+                    return resultados
+        return resultados
@@ -0,0 +1,860 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import aclosing
+from datetime import datetime
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, TypeVar
+
+from motor.motor_asyncio import AsyncIOMotorCollection, AsyncIOMotorDatabase
+from pymongo import DeleteMany, InsertOne, ReplaceOne, ReturnDocument, UpdateOne, WriteConcern
+from pymongo.read_concern import ReadConcern
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from services.ubicaciones_fuentes import iter_ubicaciones
+from services.ubicaciones_parser import AgrupadorCP, fusionar_asentamientos, iter_lotes, normalizar_busqueda
+
+# Colección que consultan los endpoints
+COLLECTION_NAME = "ubicaciones"
+# Colección sombra donde se construye el catálogo antes de publicarlo
+STAGING_COLLECTION_NAME = "ubicaciones_staging"
+# Campo con el hash del contenido de cada documento, usado por la recarga diferencial
+HASH_FIELD = "hash_contenido"
+# Claves normalizadas (minúsculas, sin acentos) que usan las búsquedas con índice
+CLAVES_BUSQUEDA = {"estado": "estado_busqueda", "municipio": "municipio_busqueda"}
+# Proyección de lectura que oculta los campos internos en las respuestas
+PROYECCION_PUBLICA = {"_id": 0, HASH_FIELD: 0, **{clave: 0 for clave in CLAVES_BUSQUEDA.values()}}
+# Documento de la colección 'config' con la versión publicada del catálogo y
+# sus metadatos (totales, checksum del archivo fuente, duración de la carga)
+CATALOGO_CONFIG_ID = "ubicaciones_catalogo"
+# Documento de 'config' donde se confirma la durabilidad de la carga en curso
+CARGA_CONFIG_ID = "ubicaciones_carga"
+# Colección con las cargas del catálogo (ver ubicaciones_jobs); el job activo guarda el checkpoint
+JOBS_COLLECTION_NAME = "catalog_jobs"
+TIPO_CARGA_UBICACIONES = "load_ubicaciones"
+
+# Documentos por insert_many y lotes en vuelo simultáneamente
+DEFAULT_BATCH_SIZE = int(os.getenv("UBICACIONES_BATCH_SIZE", "500"))
+DEFAULT_CONCURRENCY = int(os.getenv("UBICACIONES_WRITE_CONCURRENCY", "4"))
+# Reintentos por lote para los documentos con errores transitorios
+MAX_REINTENTOS = 3
+# Lotes ya parseados que pueden esperar en la cola entre el hilo del parser y el escritor
+LOTES_EN_COLA = 4
+# Segundos mínimos entre checkpoints guardados de una carga reanudable
+INTERVALO_CHECKPOINT = float(os.getenv("UBICACIONES_CHECKPOINT_SECONDS", "5"))
+
+# Códigos de error de escritura transitorios (cambio de primario, apagado, timeouts)
+CODIGOS_REINTENTABLES = {
+    6, 7, 89, 91, 189, 262, 9001, 10107, 11600, 11602, 13435, 13436, 112, 50
+}
+DUPLICATE_KEY = 11000
+
+
+T = TypeVar("T")
+_FIN = object()
+
+
+async def iter_en_hilo(elementos: Iterable[T], maxsize: int = LOTES_EN_COLA) -> AsyncIterator[T]:
+    """
+    Consumir un iterable síncrono (parser, hash) en un hilo del executor.
+
+    El hilo deja cada elemento en una cola acotada y el event loop los toma
+    con `async for`; si el consumidor se atrasa, el hilo espera. Así el
+    parseo nunca bloquea el event loop ni acumula más de `maxsize`
+    elementos en memoria. Si el consumidor se detiene (error o
+    cancelación), el hilo termina en el siguiente elemento.
+    """
+    loop = asyncio.get_running_loop()
+    cola: asyncio.Queue = asyncio.Queue(maxsize)
+    detener = threading.Event()
+
+    def poner(elemento):
+        asyncio.run_coroutine_threadsafe(cola.put(elemento), loop).result()
+
+    def producir():
+        try:
+            for elemento in elementos:
+                if detener.is_set():
+                    return
+                poner(elemento)
+            final = _FIN
+        except BaseException as error:
+            final = error
+        if not detener.is_set():
+            poner(final)
+
+    hilo = loop.run_in_executor(None, producir)
+    try:
+        while True:
+            elemento = await cola.get()
+            if elemento is _FIN:
+                break
+            if isinstance(elemento, BaseException):
+                raise elemento
+            yield elemento
+        await hilo
+    finally:
+        detener.set()
+        # Liberar un put pendiente para que el hilo vea la señal y termine
+        while not cola.empty():
+            cola.get_nowait()
+
+
+def _es_id_duplicado(error: Dict) -> bool:
+    """Un _id duplicado en un reintento significa que el documento ya se insertó"""
+    if error.get("code") != DUPLICATE_KEY:
+        return False
+    key_pattern = error.get("keyPattern")
+    if key_pattern is not None:
+        return list(key_pattern) == ["_id"]
+    return "index: _id_ " in error.get("errmsg", "")
+
+
+def calcular_hash(documento: Dict) -> str:
+    """Hash estable del contenido de un documento de CP (sin _id ni el propio hash)"""
+    contenido = {k: v for k, v in documento.items() if k not in ("_id", HASH_FIELD)}
+    serializado = json.dumps(contenido, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha1(serializado.encode("utf-8")).hexdigest()
+
+
+def checksum_archivo(path: str) -> str:
+    """SHA-256 del archivo fuente, leído por bloques"""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 20), b""):
+            sha.update(bloque)
+    return sha.hexdigest()
+
+
+def agregar_hash(documento: Dict) -> Dict:
+    """Guardar en el documento el hash de su contenido y devolverlo"""
+    documento[HASH_FIELD] = calcular_hash(documento)
+    return documento
+
+
+def preparar_documento(documento: Dict) -> Dict:
+    """Agregar las claves de búsqueda normalizadas y el hash antes de escribir"""
+    for campo, clave in CLAVES_BUSQUEDA.items():
+        documento[clave] = normalizar_busqueda(documento.get(campo, ""))
+    return agregar_hash(documento)
+
+
+class BulkWriter:
+    """
+    Escritor de lotes con un número acotado de insert_many en vuelo.
+
+    Mientras hay `concurrency` lotes esperando respuesta de MongoDB,
+    `escribir` no regresa; así el productor (el parser) se frena en lugar
+    de acumular lotes en memoria.
+
+    Los lotes terminan en cualquier orden; `checkpoint` es la marca del
+    último lote tal que él y todos los anteriores ya terminaron.
+    """
+
+    def __init__(
+        self,
+        collection: AsyncIOMotorCollection,
+        batch_size: Optional[int] = None,
+        concurrency: Optional[int] = None
+    ):
+        self.collection = collection
+        self.batch_size = batch_size or DEFAULT_BATCH_SIZE
+        self.concurrency = concurrency or DEFAULT_CONCURRENCY
+        self.total_insertados = 0
+        self.lotes_enviados = 0
+        self.reintentos = 0
+        # Reporte de la carga: un registro por CP rechazado
+        self.rechazados: List[Dict] = []
+        self._semaforo = asyncio.Semaphore(self.concurrency)
+        self._tareas: Set[asyncio.Task] = set()
+        # Marca del último lote confirmado en orden (ver `escribir`)
+        self.checkpoint: Optional[Dict] = None
+        self._marcas: Dict[int, Dict] = {}
+        self._terminados: Set[int] = set()
+        self._confirmado = 0
+
+    async def escribir(self, lote: List[Dict], marca: Optional[Dict] = None):
+        """
+        Enviar un lote; espera si ya hay `concurrency` lotes en vuelo.
+
+        Args:
+            lote: Documentos a insertar
+            marca: Posición de la fuente al terminar este lote; pasa a
+                `checkpoint` cuando este lote y los anteriores terminan
+        """
+        await self._semaforo.acquire()
+        self.lotes_enviados += 1
+        if marca is not None:
+            self._marcas[self.lotes_enviados] = marca
+        tarea = asyncio.create_task(self._insertar(lote, self.lotes_enviados))
+        self._tareas.add(tarea)
+        tarea.add_done_callback(self._tareas.discard)
+
+    async def escribir_todo(self, documentos: Iterable[Dict]) -> int:
+        """
+        Escribir un flujo de documentos en lotes y esperar a que terminen.
+
+        Returns:
+            Total de documentos insertados
+        """
+        for lote in iter_lotes(documentos, self.batch_size):
+            await self.escribir(lote)
+        await self.cerrar()
+        return self.total_insertados
+
+    async def cerrar(self):
+        """Esperar a que terminen todos los lotes en vuelo"""
+        if self._tareas:
+            await asyncio.gather(*self._tareas)
+
+    def reporte(self) -> Dict:
+        """Resumen de la carga con los CPs rechazados y los reintentos hechos"""
+        return {
+            "total_insertados": self.total_insertados,
+            "total_rechazados": len(self.rechazados),
+            "reintentos": self.reintentos,
+            "rechazados": self.rechazados,
+        }
+
+    def _terminar(self, numero_lote: int):
+        """Registrar un lote terminado y avanzar el checkpoint hasta el primer hueco"""
+        self._terminados.add(numero_lote)
+        while self._confirmado + 1 in self._terminados:
+            self._confirmado += 1
+            self._terminados.discard(self._confirmado)
+            marca = self._marcas.pop(self._confirmado, None)
+            if marca is not None:
+                self.checkpoint = marca
+
+    def _rechazar(self, documento: Dict, codigo: Optional[int], mensaje: str):
+        self.rechazados.append({
+            "codigo_postal": documento.get("codigo_postal", ""),
+            "codigo_error": codigo,
+            "mensaje": mensaje[:200],
+        })
+
+    def _separar_errores(self, details: Dict, pendientes: List[Dict]) -> List[Dict]:
+        """
+        Clasificar los writeErrors de un BulkWriteError.
+
+        Los documentos con error transitorio se devuelven para reintentarlos;
+        los demás quedan en el reporte de rechazados. Los que no aparecen en
+        writeErrors ya se insertaron.
+        """
+        self.total_insertados += details.get("nInserted", 0)
+        reintentar = []
+
+        for error in details.get("writeErrors", []):
+            documento = pendientes[error["index"]]
+            if _es_id_duplicado(error):
+                # Insertado en un intento anterior cuya respuesta se perdió
+                self.total_insertados += 1
+            elif error.get("code") in CODIGOS_REINTENTABLES:
+                reintentar.append(documento)
+            else:
+                self._rechazar(documento, error.get("code"), error.get("errmsg", ""))
+
+        for error in details.get("writeConcernErrors", []):
+            print(f"Advertencia - write concern: {error.get('errmsg', '')}")
+
+        return reintentar
+
+    async def _insertar(self, lote: List[Dict], numero_lote: int):
+        pendientes = lote
+        try:
+            for intento in range(MAX_REINTENTOS + 1):
+                if intento:
+                    self.reintentos += 1
+                    await asyncio.sleep(0.5 * 2 ** (intento - 1))
+
+                try:
+                    # insert_many desordenado: un documento con error no detiene al resto
+                    result = await self.collection.insert_many(pendientes, ordered=False)
+                    self.total_insertados += len(result.inserted_ids)
+                    pendientes = []
+                except BulkWriteError as bwe:
+                    pendientes = self._separar_errores(bwe.details, pendientes)
+                except AutoReconnect as network_error:
+                    # Resultado desconocido: se reintenta el lote completo; los
+                    # documentos ya escritos regresan como _id duplicado
+                    print(f"Error de red en lote {numero_lote}: {str(network_error)}")
+
+                if not pendientes:
+                    break
+            else:
+                for documento in pendientes:
+                    self._rechazar(documento, None, f"Reintentos agotados ({MAX_REINTENTOS})")
+
+            # Log de progreso cada 10 lotes
+            if numero_lote % 10 == 0:
+                print(f"Procesado lote {numero_lote} - Insertados: {self.total_insertados}")
+
+        except Exception as batch_error:
+            print(f"Error en lote {numero_lote}: {str(batch_error)}")
+            for documento in pendientes:
+                self._rechazar(documento, getattr(batch_error, "code", None), str(batch_error))
+        finally:
+            self._terminar(numero_lote)
+            self._semaforo.release()
+
+
+async def completar_claves_busqueda(collection: AsyncIOMotorCollection) -> int:
+    """
+    Agregar las claves de búsqueda y el hash a los documentos que no los tienen.
+
+    Los catálogos escritos antes de que existieran (o por otra herramienta)
+    no aparecerían en /buscar/estado. Si todos los documentos ya los tienen
+    no se escribe nada.
+
+    Returns:
+        Número de documentos actualizados
+    """
+    campos = [*CLAVES_BUSQUEDA.values(), HASH_FIELD]
+    faltantes = {"$or": [{campo: {"$exists": False}} for campo in campos]}
+    operaciones = []
+    actualizados = 0
+    async for documento in collection.find(faltantes):
+        _id = documento.pop("_id")
+        preparar_documento(documento)
+        operaciones.append(UpdateOne({"_id": _id}, {"$set": {campo: documento[campo] for campo in campos}}))
+        if len(operaciones) >= DEFAULT_BATCH_SIZE:
+            await collection.bulk_write(operaciones, ordered=False)
+            actualizados += len(operaciones)
+            operaciones = []
+    if operaciones:
+        await collection.bulk_write(operaciones, ordered=False)
+        actualizados += len(operaciones)
+    if actualizados:
+        print(f"Claves de búsqueda agregadas a {actualizados} CPs de {collection.name}")
+    return actualizados
+
+
+async def crear_indices(collection: AsyncIOMotorCollection):
+    """Crear los índices que usan las consultas de ubicaciones (y completar sus claves)"""
+    await completar_claves_busqueda(collection)
+    await collection.create_index("codigo_postal", unique=True)
+    await collection.create_index([("estado", 1), ("municipio", 1)])
+    # Búsqueda por estado: igualdad o prefijo anclado sobre la clave normalizada,
+    # ordenada por CP sin ordenar en memoria
+    await collection.create_index([(CLAVES_BUSQUEDA["estado"], 1), ("codigo_postal", 1)])
+    await collection.create_index("asentamientos.nombre")
+
+
+async def migrar_catalogo(db: AsyncIOMotorDatabase):
+    """
+    Poner al día la colección en vivo al iniciar: claves de búsqueda e índices.
+
+    Es idempotente; un catálogo cargado antes de estos campos queda listo
+    para /buscar/estado sin tener que recargarlo.
+    """
+    if await db.list_collection_names(filter={"name": COLLECTION_NAME}):
+        await crear_indices(db[COLLECTION_NAME])
+
+
+async def preparar_staging(db: AsyncIOMotorDatabase) -> AsyncIOMotorCollection:
+    """
+    Obtener una colección sombra vacía para construir el catálogo.
+
+    Si quedó una colección sombra de una carga interrumpida, se descarta
+    junto con su checkpoint.
+    """
+    await borrar_checkpoint(db)
+    await db.drop_collection(STAGING_COLLECTION_NAME)
+    return db[STAGING_COLLECTION_NAME]
+
+
+async def guardar_checkpoint(db: AsyncIOMotorDatabase, checkpoint: Dict):
+    """
+    Guardar hasta dónde llegó una carga reanudable en el documento de su job.
+
+    Se guarda en el job activo: el índice único parcial de catalog_jobs
+    garantiza que hay uno solo, y toda carga reanudable corre como job (el
+    worker o `carga_exclusiva`). Sin job activo no se guarda nada.
+
+    Se escribe con el mismo perfil que los lotes: el oplog es ordenado, así
+    que si el checkpoint sobrevive también sobreviven los lotes que cubre.
+    """
+    await db[JOBS_COLLECTION_NAME].update_one(
+        {"tipo": TIPO_CARGA_UBICACIONES, "activo": True},
+        {"$set": {"checkpoint": {**checkpoint, "actualizado": datetime.utcnow()}}}
+    )
+
+
+async def borrar_checkpoint(db: AsyncIOMotorDatabase):
+    """Descartar el checkpoint de cualquier job: la colección sombra ya no es la que describe"""
+    await db[JOBS_COLLECTION_NAME].update_many(
+        {"tipo": TIPO_CARGA_UBICACIONES, "checkpoint": {"$exists": True}},
+        {"$unset": {"checkpoint": ""}}
+    )
+
+
+async def obtener_checkpoint(db: AsyncIOMotorDatabase, checksum_fuente: str) -> Optional[Dict]:
+    """
+    Checkpoint de una carga interrumpida del mismo archivo fuente.
+
+    Puede estar en el mismo job (reclamado por el worker tras una caída) o
+    en uno anterior (otra llamada a /load-streaming): vale el más reciente,
+    porque el job que reanuda continúa la colección sombra del anterior.
+
+    Returns:
+        El checkpoint, o None si no hay, es de otro archivo o ya no existe
+        la colección sombra que describe
+    """
+    jobs = await db[JOBS_COLLECTION_NAME].find(
+        {"tipo": TIPO_CARGA_UBICACIONES, "checkpoint": {"$exists": True}},
+        {"checkpoint": 1}
+    ).sort("checkpoint.actualizado", -1).limit(1).to_list(1)
+    checkpoint = jobs[0]["checkpoint"] if jobs else None
+    if not checkpoint or checkpoint.get("checksum_fuente") != checksum_fuente:
+        return None
+    if not await db.list_collection_names(filter={"name": STAGING_COLLECTION_NAME}):
+        return None
+    return checkpoint
+
+
+async def confirmar_durabilidad(db: AsyncIOMotorDatabase):
+    """
+    Confirmar con una sola escritura 'majority' los lotes escritos con w=1.
+
+    El oplog es ordenado: cuando la mayoría confirma esta escritura también
+    tiene todas las anteriores de la carga.
+    """
+    config = db.config.with_options(write_concern=WriteConcern(w="majority", j=True))
+    await config.update_one(
+        {"_id": CARGA_CONFIG_ID},
+        {"$set": {"confirmado": datetime.utcnow()}},
+        upsert=True
+    )
+
+
+async def contar_asentamientos(collection: AsyncIOMotorCollection) -> int:
+    """Total de asentamientos sumando el tamaño de cada arreglo (sin $unwind)"""
+    resultado = await collection.aggregate([
+        {"$group": {"_id": None, "total": {"$sum": {"$size": "$asentamientos"}}}}
+    ]).to_list(1)
+    return resultado[0]["total"] if resultado else 0
+
+
+async def registrar_version(db: AsyncIOMotorDatabase, metadatos: Optional[Dict] = None) -> Dict:
+    """
+    Incrementar la versión del catálogo publicado y guardar sus metadatos.
+
+    Los procesos de la API comparan esta versión para saber cuándo recargar
+    su copia en memoria; /status lee los totales de este mismo documento.
+
+    Returns:
+        Documento de config actualizado (sin _id)
+    """
+    config = await db.config.find_one_and_update(
+        {"_id": CATALOGO_CONFIG_ID},
+        {"$inc": {"version": 1}, "$set": {"publicado": datetime.utcnow(), **(metadatos or {})}},
+        projection={"_id": 0},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return config
+
+
+async def exportar_publicado(db: AsyncIOMotorDatabase):
+    """
+    Regenerar el artefacto del catálogo recién publicado.
+
+    Se llama en cada publicación (carga completa o diferencial, desde la
+    API, el worker o el cargador), así /load-artifact nunca restaura una
+    versión anterior a la publicada. Un error solo se reporta: el catálogo
+    ya está publicado.
+    """
+    # Importación local: ubicaciones_artefacto usa el pipeline de carga de este módulo
+    from services.ubicaciones_artefacto import ARTEFACTO_PATH, exportar_artefacto
+    if not ARTEFACTO_PATH:
+        return
+    try:
+        await exportar_artefacto(db, ARTEFACTO_PATH)
+    except Exception as e:
+        print(f"No se pudo escribir el artefacto de ubicaciones: {str(e)}")
+
+
+async def obtener_metadatos(db: AsyncIOMotorDatabase) -> Optional[Dict]:
+    """
+    Metadatos del catálogo publicado con una sola lectura por _id.
+
+    Un catálogo cargado antes de que existieran los metadatos se cuenta una
+    vez y se guarda; las llamadas siguientes ya no recorren la colección.
+
+    Returns:
+        Metadatos (sin _id) o None si no hay catálogo cargado
+    """
+    config = await db.config.find_one({"_id": CATALOGO_CONFIG_ID}, {"_id": 0})
+    if config and "total_codigos_postales" in config:
+        return config
+
+    collection = db[COLLECTION_NAME]
+    total = await collection.count_documents({})
+    if total == 0:
+        return None
+
+    totales = {
+        "total_codigos_postales": total,
+        "total_asentamientos": await contar_asentamientos(collection),
+    }
+    await db.config.update_one({"_id": CATALOGO_CONFIG_ID}, {"$set": totales}, upsert=True)
+    return {**(config or {}), **totales}
+
+
+async def publicar_staging(
+    db: AsyncIOMotorDatabase,
+    staging: AsyncIOMotorCollection,
+    esperados: int,
+    metadatos: Optional[Dict] = None
+) -> Dict:
+    """
+    Validar la colección sombra, indexarla y reemplazar la colección en vivo.
+
+    El reemplazo usa renameCollection con dropTarget, que es atómico: las
+    consultas ven el catálogo anterior o el nuevo, nunca uno vacío o parcial.
+
+    Args:
+        db: Base de datos con el perfil normal (w='majority')
+        staging: Colección sombra ya poblada (puede venir del perfil de carga)
+        esperados: Número de documentos que la carga reporta como escritos
+        metadatos: Datos de la carga a guardar junto con la versión
+
+    Returns:
+        Metadatos del catálogo publicado (totales, versión, fuente)
+    """
+    # Durabilidad y conteo se verifican con el perfil estricto
+    await confirmar_durabilidad(db)
+    staging = db.get_collection(staging.name, read_concern=ReadConcern("majority"))
+
+    total = await staging.count_documents({})
+    if total == 0 or total != esperados:
+        await db.drop_collection(staging.name)
+        raise RuntimeError(
+            f"La colección sombra tiene {total} documentos y se esperaban {esperados}; "
+            "se conserva el catálogo actual"
+        )
+
+    # Los índices se construyen antes del cambio, sin competir con las inserciones
+    try:
+        await crear_indices(staging)
+        total_asentamientos = await contar_asentamientos(staging)
+    except Exception:
+        await db.drop_collection(staging.name)
+        raise
+
+    await staging.rename(COLLECTION_NAME, dropTarget=True)
+    publicado = await registrar_version(db, {
+        **(metadatos or {}),
+        "total_codigos_postales": total,
+        "total_asentamientos": total_asentamientos,
+    })
+    await exportar_publicado(db)
+    return publicado
+
+
+async def fusionar_rezagados(collection: AsyncIOMotorCollection, rezagados: Dict[str, Dict]) -> int:
+    """
+    Fusionar los CPs que aparecieron fuera de orden con el documento ya escrito.
+
+    Es idempotente (se puede repetir al reanudar una carga): los nombres ya
+    presentes no se agregan y los CPs nuevos se escriben con un upsert por
+    `codigo_postal`.
+
+    Returns:
+        Número de documentos nuevos (CPs cuyo primer bloque no se escribió)
+    """
+    nuevos = 0
+    for codigo_postal, rezagado in rezagados.items():
+        existente = await collection.find_one({"codigo_postal": codigo_postal})
+        if existente:
+            fusionar_asentamientos(existente, rezagado['asentamientos'])
+            await collection.update_one(
+                {"_id": existente["_id"]},
+                {"$set": {
+                    "asentamientos": existente["asentamientos"],
+                    HASH_FIELD: calcular_hash(existente)
+                }}
+            )
+        else:
+            await collection.replace_one(
+                {"codigo_postal": codigo_postal}, preparar_documento(rezagado), upsert=True
+            )
+            nuevos += 1
+    return nuevos
+
+
+def _lotes_marcados(
+    documentos: Iterable[Dict],
+    batch_size: int,
+    agrupador: Optional[AgrupadorCP]
+) -> Iterator[Tuple[List[Dict], Optional[Dict]]]:
+    """
+    Lotes listos para escribir con la posición de la fuente al cerrar cada uno.
+
+    El generador del agrupador queda suspendido justo después del último
+    documento del lote, así que su marca cubre exactamente ese lote.
+    """
+    for lote in iter_lotes(map(preparar_documento, documentos), batch_size):
+        marca = None
+        if agrupador is not None:
+            marca = {**agrupador.marca(), "codigo_postal": lote[-1]["codigo_postal"]}
+        yield lote, marca
+
+
+def _checkpoint(checksum_fuente: str, marca: Dict, agrupador: AgrupadorCP) -> Dict:
+    """Checkpoint a guardar a partir de la marca de un lote confirmado"""
+    rezagados = []
+    for codigo_postal, largo in marca["rezagados"].items():
+        rezagado = agrupador.rezagados[codigo_postal]
+        rezagados.append({**rezagado, "asentamientos": rezagado["asentamientos"][:largo]})
+    return {
+        "checksum_fuente": checksum_fuente,
+        "filas": marca["filas"],
+        "codigo_postal": marca["codigo_postal"],
+        "rezagados": rezagados,
+    }
+
+
+async def cargar_catalogo(
+    db: AsyncIOMotorDatabase,
+    bulk_db: AsyncIOMotorDatabase,
+    documentos: Iterable[Dict],
+    agrupador: Optional[AgrupadorCP] = None,
+    progreso: Optional[Callable[[BulkWriter], Awaitable[None]]] = None,
+    fuente: Optional[str] = None,
+    reanudacion: Optional[Dict] = None,
+    checksum_fuente: Optional[str] = None
+) -> Dict:
+    """
+    Construir el catálogo completo en la colección sombra y publicarlo.
+
+    Args:
+        db: Base de datos con el perfil normal (verificación y publicación)
+        bulk_db: Base de datos con el perfil de carga masiva (lotes)
+        documentos: Documentos agrupados por CP (lista o generador)
+        agrupador: Agrupador streaming, para fusionar sus CPs rezagados
+        progreso: Corrutina que se llama tras cada lote enviado; si lanza
+            una excepción la carga se aborta y el catálogo actual se conserva
+        fuente: Ruta del archivo fuente, para guardar su nombre y checksum en los metadatos
+        checksum_fuente: Checksum ya conocido de la fuente; si se da, `fuente`
+            solo se registra como nombre y no se lee (ver `cargar_artefacto`)
+        reanudacion: Carga reanudable (ver `cargar_fuente`): checksum de la
+            fuente y filas ya cubiertas. Se guarda un checkpoint cada
+            INTERVALO_CHECKPOINT segundos y, si la carga falla, la colección
+            sombra se conserva para continuar desde ahí
+
+    Returns:
+        Totales publicados, versión y reporte de errores del escritor
+    """
+    inicio = time.monotonic()
+    loop = asyncio.get_running_loop()
+    metadatos = {}
+    if fuente:
+        metadatos["archivo_fuente"] = fuente
+        metadatos["checksum_fuente"] = (
+            checksum_fuente
+            or (reanudacion or {}).get("checksum_fuente")
+            or await loop.run_in_executor(None, checksum_archivo, fuente)
+        )
+
+    reanudable = reanudacion is not None and agrupador is not None
+    if reanudable and reanudacion.get("filas"):
+        # La colección sombra ya tiene los lotes anteriores al checkpoint
+        staging = bulk_db[STAGING_COLLECTION_NAME]
+        escritos_antes = await staging.count_documents({})
+    else:
+        staging = await preparar_staging(bulk_db)
+        escritos_antes = 0
+    writer = BulkWriter(staging)
+    guardado = None
+    ultimo_checkpoint = time.monotonic()
+    abortada = False
+
+    async def guardar(forzar: bool = False):
+        nonlocal guardado, ultimo_checkpoint
+        if not reanudable or writer.checkpoint is None or writer.checkpoint is guardado:
+            return
+        if not forzar and time.monotonic() - ultimo_checkpoint < INTERVALO_CHECKPOINT:
+            return
+        guardado, ultimo_checkpoint = writer.checkpoint, time.monotonic()
+        await guardar_checkpoint(bulk_db, _checkpoint(reanudacion["checksum_fuente"], guardado, agrupador))
+
+    try:
+        # Parseo y hash en un hilo; los lotes llegan por una cola acotada
+        lotes = iter_en_hilo(_lotes_marcados(documentos, writer.batch_size, agrupador if reanudable else None))
+        async with aclosing(lotes):
+            async for lote, marca in lotes:
+                await writer.escribir(lote, marca)
+                await guardar()
+                if progreso:
+                    try:
+                        await progreso(writer)
+                    except BaseException:
+                        abortada = True
+                        raise
+        await writer.cerrar()
+        # Con todo el archivo escrito, una reanudación solo fusiona y publica
+        await guardar(forzar=True)
+
+        total_inserted = escritos_antes + writer.total_insertados
+        if agrupador:
+            total_inserted += await fusionar_rezagados(staging, agrupador.rezagados)
+
+        if writer.rechazados:
+            print(f"CPs rechazados: {len(writer.rechazados)} (reintentos: {writer.reintentos})")
+
+        # Validar conteo, crear índices y publicar con renameCollection
+        metadatos["duracion_segundos"] = round(time.monotonic() - inicio, 2)
+        publicado = await publicar_staging(db, staging, total_inserted, metadatos)
+        if reanudable:
+            await borrar_checkpoint(bulk_db)
+
+    except BaseException:
+        await writer.cerrar()
+        if reanudable and not abortada:
+            # Se conservan la colección sombra y el último checkpoint (el nuevo o el anterior)
+            await guardar(forzar=True)
+            marca = guardado or reanudacion
+            if marca.get("filas"):
+                print(f"Carga interrumpida; se puede reanudar desde la fila {marca['filas']} "
+                      f"(CP {marca['codigo_postal']})")
+        else:
+            await borrar_checkpoint(bulk_db)
+            await db.drop_collection(STAGING_COLLECTION_NAME)
+        raise
+
+    return {
+        "total_codigos_postales": publicado["total_codigos_postales"],
+        "total_asentamientos": publicado["total_asentamientos"],
+        "version": publicado["version"],
+        **writer.reporte(),
+    }
+
+
+async def cargar_fuente(
+    db: AsyncIOMotorDatabase,
+    bulk_db: AsyncIOMotorDatabase,
+    fuente: str,
+    agrupador: Optional[AgrupadorCP] = None,
+    progreso: Optional[Callable[[BulkWriter], Awaitable[None]]] = None
+) -> Dict:
+    """
+    Carga streaming reanudable del catálogo desde el archivo fuente.
+
+    Si una carga anterior del mismo archivo (mismo checksum) se interrumpió,
+    continúa desde su checkpoint: las filas ya escritas se saltan sin
+    parsearlas (TXT y XML sin comprimir) y los CPs que ya están en la
+    colección sombra se fusionan en lugar de insertarse otra vez.
+
+    Args:
+        db: Base de datos con el perfil normal
+        bulk_db: Base de datos con el perfil de carga masiva
+        fuente: Ruta del archivo fuente (XML, TXT, .gz o .zip)
+        agrupador: Agrupador a usar, para consultar contadores al final
+        progreso: Ver `cargar_catalogo`
+
+    Returns:
+        Totales publicados, versión y reporte de errores del escritor
+    """
+    agrupador = agrupador or AgrupadorCP()
+    checksum = await asyncio.get_running_loop().run_in_executor(None, checksum_archivo, fuente)
+
+    reanudacion = await obtener_checkpoint(bulk_db, checksum)
+    if reanudacion:
+        staging = bulk_db[STAGING_COLLECTION_NAME]
+        # Mismo índice que crear_indices: busca rápido al fusionar y no admite CPs repetidos
+        await staging.create_index("codigo_postal", unique=True)
+        agrupador.reanudar(
+            reanudacion["filas"],
+            await staging.distinct("codigo_postal"),
+            {r["codigo_postal"]: r for r in reanudacion.get("rezagados", [])}
+        )
+        print(f"Reanudando carga desde la fila {reanudacion['filas']} (CP {reanudacion['codigo_postal']})")
+    else:
+        reanudacion = {"checksum_fuente": checksum, "filas": 0}
+
+    return await cargar_catalogo(
+        db,
+        bulk_db,
+        iter_ubicaciones(fuente, agrupador, desde=reanudacion["filas"]),
+        agrupador=agrupador,
+        progreso=progreso,
+        fuente=fuente,
+        reanudacion=reanudacion
+    )
+
+
+async def aplicar_diferencias(
+    collection: AsyncIOMotorCollection,
+    ubicaciones: List[Dict],
+    fuente: Optional[str] = None
+) -> Dict[str, int]:
+    """
+    Actualizar la colección en vivo aplicando solo lo que cambió.
+
+    Compara el hash de cada CP recién parseado con el guardado en la colección
+    y envía las altas, cambios y bajas en un único bulk_write. Si no hay
+    diferencias no se escribe nada.
+
+    Args:
+        collection: Colección en vivo
+        ubicaciones: Catálogo completo recién parseado
+        fuente: Ruta del archivo fuente, para guardar su checksum en los metadatos
+
+    Returns:
+        Conteo de insertados, actualizados, eliminados y sin cambios
+    """
+    if not ubicaciones:
+        raise ValueError("El catálogo parseado está vacío; no se aplican diferencias")
+
+    inicio = time.monotonic()
+    actuales = {}
+    async for doc in collection.find({}, {"_id": 0, "codigo_postal": 1, HASH_FIELD: 1}):
+        actuales[doc["codigo_postal"]] = doc.get(HASH_FIELD)
+
+    operaciones = []
+    resumen = {"insertados": 0, "actualizados": 0, "eliminados": 0, "sin_cambios": 0}
+
+    # Claves y hashes de todo el catálogo fuera del event loop
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, lambda: [preparar_documento(d) for d in ubicaciones])
+
+    for documento in ubicaciones:
+        codigo_postal = documento["codigo_postal"]
+
+        if codigo_postal not in actuales:
+            operaciones.append(InsertOne(documento))
+            resumen["insertados"] += 1
+        elif actuales.pop(codigo_postal) != documento[HASH_FIELD]:
+            operaciones.append(ReplaceOne({"codigo_postal": codigo_postal}, documento))
+            resumen["actualizados"] += 1
+        else:
+            resumen["sin_cambios"] += 1
+
+    # Lo que quedó en `actuales` ya no existe en el archivo nuevo
+    if actuales:
+        operaciones.append(DeleteMany({"codigo_postal": {"$in": list(actuales)}}))
+        resumen["eliminados"] = len(actuales)
+
+    if operaciones:
+        await collection.bulk_write(operaciones, ordered=False)
+
+        metadatos = {
+            "total_codigos_postales": len(ubicaciones),
+            "total_asentamientos": sum(len(u["asentamientos"]) for u in ubicaciones),
+            "duracion_segundos": round(time.monotonic() - inicio, 2),
+        }
+        if fuente:
+            metadatos["archivo_fuente"] = fuente
+            metadatos["checksum_fuente"] = await loop.run_in_executor(None, checksum_archivo, fuente)
+        await registrar_version(collection.database, metadatos)
+
+    # create_index no hace nada si el índice ya existe; así un catálogo cargado
+    # antes de agregar un índice también lo recibe
+    await crear_indices(collection)
+    if operaciones:
+        await exportar_publicado(collection.database)
+
+    return resumen
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+# Las pruebas importan los módulos como lo hace la API (services.*, routers.*)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.mongo_falso import BaseDatosFalsa  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def archivos_temporales(tmp_path, monkeypatch):
+    """Artefacto y snapshot de cada prueba en su propio directorio"""
+    from services import ubicaciones_artefacto
+    monkeypatch.setattr(ubicaciones_artefacto, "ARTEFACTO_PATH", str(tmp_path / "catalogo.bson.gz"))
+    return tmp_path
+
+
+@pytest.fixture
+def db():
+    return BaseDatosFalsa()
+
+
+@pytest.fixture
+def xml_sintetico(tmp_path):
+    """Ruta de un CPdescarga.xml sintético con `filas` registros (ver tools/bench_ubicaciones_parser.py)"""
+    from tools.bench_ubicaciones_parser import generar_xml_sintetico
+
+    def generar(filas: int = 2000, nombre: str = "CPdescarga.xml") -> str:
+        path = str(tmp_path / nombre)
+        generar_xml_sintetico(path, filas)
+        return path
+
+    return generar
@@ -0,0 +1,392 @@
+"""
+Base de datos MongoDB en memoria para las pruebas del catálogo de ubicaciones.
+
+Implementa solo la parte de la API asíncrona de motor que usan los servicios
+del catálogo (inserciones en lote, upserts, índices únicos, renameCollection,
+find con proyección, orden, skip y limit). No valida tipos ni soporta todos
+los operadores: un filtro u operador que no entiende lanza NotImplementedError
+para que la prueba falle en lugar de dar un resultado incorrecto.
+"""
+import copy
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import DeleteMany, InsertOne, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+_FALTA = object()
+DUPLICATE_KEY = 11000
+
+
+def _valor(documento: Dict, campo: str):
+    actual = documento
+    for parte in campo.split("."):
+        if not isinstance(actual, dict) or parte not in actual:
+            return _FALTA
+        actual = actual[parte]
+    return actual
+
+
+def _cumple_operadores(actual, condiciones: Dict) -> bool:
+    for operador, esperado in condiciones.items():
+        if operador == "$exists":
+            if (actual is not _FALTA) != bool(esperado):
+                return False
+        elif operador == "$in":
+            if actual is _FALTA or actual not in esperado:
+                return False
+        elif operador == "$ne":
+            if actual is not _FALTA and actual == esperado:
+                return False
+        elif operador in ("$gt", "$gte", "$lt", "$lte"):
+            if actual is _FALTA or actual is None:
+                return False
+            if operador == "$gt" and not actual > esperado:
+                return False
+            if operador == "$gte" and not actual >= esperado:
+                return False
+            if operador == "$lt" and not actual < esperado:
+                return False
+            if operador == "$lte" and not actual <= esperado:
+                return False
+        else:
+            raise NotImplementedError(operador)
+    return True
+
+
+def coincide(documento: Dict, filtro: Optional[Dict]) -> bool:
+    for campo, condicion in (filtro or {}).items():
+        if campo == "$or":
+            if not any(coincide(documento, f) for f in condicion):
+                return False
+        elif campo == "$and":
+            if not all(coincide(documento, f) for f in condicion):
+                return False
+        elif campo.startswith("$"):
+            raise NotImplementedError(campo)
+        elif isinstance(condicion, dict) and condicion and all(k.startswith("$") for k in condicion):
+            if not _cumple_operadores(_valor(documento, campo), condicion):
+                return False
+        else:
+            actual = _valor(documento, campo)
+            if condicion is None:
+                if actual is not _FALTA and actual is not None:
+                    return False
+            elif actual != condicion:
+                return False
+    return True
+
+
+def proyectar(documento: Dict, proyeccion: Optional[Dict]) -> Dict:
+    documento = copy.deepcopy(documento)
+    if not proyeccion:
+        return documento
+    incluir = {campo for campo, valor in proyeccion.items() if valor and campo != "_id"}
+    if incluir:
+        resultado = {campo: documento[campo] for campo in incluir if campo in documento}
+        if proyeccion.get("_id", 1) and "_id" in documento:
+            resultado["_id"] = documento["_id"]
+        return resultado
+    for campo, valor in proyeccion.items():
+        if not valor:
+            documento.pop(campo, None)
+    return documento
+
+
+def _aplicar_actualizacion(documento: Dict, actualizacion: Dict):
+    for operador, campos in actualizacion.items():
+        for campo, valor in campos.items():
+            if "." in campo:
+                raise NotImplementedError(campo)
+            if operador == "$set":
+                documento[campo] = copy.deepcopy(valor)
+            elif operador == "$unset":
+                documento.pop(campo, None)
+            elif operador == "$inc":
+                documento[campo] = documento.get(campo, 0) + valor
+            elif operador == "$setOnInsert":
+                pass
+            else:
+                raise NotImplementedError(operador)
+
+
+def _documento_upsert(filtro: Dict, actualizacion: Dict) -> Dict:
+    documento = {
+        campo: valor for campo, valor in filtro.items()
+        if not campo.startswith("$") and not isinstance(valor, dict)
+    }
+    _aplicar_actualizacion(documento, actualizacion)
+    for campo, valor in actualizacion.get("$setOnInsert", {}).items():
+        documento[campo] = copy.deepcopy(valor)
+    return documento
+
+
+class CursorFalso:
+    def __init__(self, documentos: List[Dict]):
+        self._documentos = documentos
+        self._orden = []
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, clave, direccion: int = 1):
+        self._orden = [(clave, direccion)] if isinstance(clave, str) else list(clave)
+        return self
+
+    def skip(self, skip: int):
+        self._skip = skip
+        return self
+
+    def limit(self, limit: int):
+        self._limit = limit
+        return self
+
+    def _resultado(self) -> List[Dict]:
+        documentos = list(self._documentos)
+        for campo, direccion in reversed(self._orden):
+            documentos.sort(key=lambda d: (_valor(d, campo) is _FALTA, _valor(d, campo)), reverse=direccion < 0)
+        documentos = documentos[self._skip:]
+        return documentos[:self._limit] if self._limit else documentos
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict]:
+        documentos = self._resultado()
+        return documentos[:length] if length else documentos
+
+    def __aiter__(self):
+        return self._iterar()
+
+    async def _iterar(self):
+        for documento in self._resultado():
+            yield documento
+
+
+class ColeccionFalsa:
+    def __init__(self, db: "BaseDatosFalsa", name: str):
+        self.database = db
+        self.name = name
+        self.documentos: List[Dict] = []
+        # Índices únicos: (campos, filtro parcial)
+        self.unicos = []
+
+    # Índices y administración
+
+    async def create_index(self, claves, unique: bool = False, partialFilterExpression: Optional[Dict] = None, **_):
+        campos = (claves,) if isinstance(claves, str) else tuple(campo for campo, _ in claves)
+        if unique and (campos, partialFilterExpression) not in self.unicos:
+            self.unicos.append((campos, partialFilterExpression))
+        return "_".join(campos)
+
+    async def rename(self, nuevo: str, dropTarget: bool = False):
+        if nuevo in self.database.colecciones and not dropTarget:
+            raise RuntimeError(f"target namespace exists: {nuevo}")
+        self.database.colecciones.pop(self.name, None)
+        self.name = nuevo
+        self.database.colecciones[nuevo] = self
+
+    def with_options(self, **_):
+        return self
+
+    # Escritura
+
+    def _duplicado(self, documento: Dict, ignorar: Optional[Dict] = None) -> Optional[Dict]:
+        """Patrón de clave del índice único que viola `documento`, o None"""
+        if any(d["_id"] == documento["_id"] for d in self.documentos if d is not ignorar):
+            return {"_id": 1}
+        for campos, parcial in self.unicos:
+            if parcial and not coincide(documento, parcial):
+                continue
+            clave = tuple(documento.get(campo) for campo in campos)
+            for existente in self.documentos:
+                if existente is ignorar or (parcial and not coincide(existente, parcial)):
+                    continue
+                if tuple(existente.get(campo) for campo in campos) == clave:
+                    return {campo: 1 for campo in campos}
+        return None
+
+    def _agregar(self, documento: Dict) -> Optional[Dict]:
+        documento.setdefault("_id", ObjectId())
+        patron = self._duplicado(documento)
+        if patron is None:
+            self.documentos.append(copy.deepcopy(documento))
+        return patron
+
+    async def insert_one(self, documento: Dict):
+        patron = self._agregar(documento)
+        if patron is not None:
+            raise DuplicateKeyError(f"E11000 duplicate key error dup key: {patron}", DUPLICATE_KEY)
+        return SimpleNamespace(inserted_id=documento["_id"])
+
+    async def insert_many(self, documentos: List[Dict], ordered: bool = True):
+        insertados, errores = [], []
+        for indice, documento in enumerate(documentos):
+            patron = self._agregar(documento)
+            if patron is None:
+                insertados.append(documento["_id"])
+                continue
+            errores.append({
+                "index": indice,
+                "code": DUPLICATE_KEY,
+                "keyPattern": patron,
+                "errmsg": f"E11000 duplicate key error collection: {self.name} dup key: {patron}",
+            })
+            if ordered:
+                break
+        if errores:
+            raise BulkWriteError({
+                "nInserted": len(insertados), "writeErrors": errores, "writeConcernErrors": []
+            })
+        return SimpleNamespace(inserted_ids=insertados)
+
+    def _reemplazar(self, existente: Dict, nuevo: Dict):
+        patron = self._duplicado(nuevo, ignorar=existente)
+        if patron is not None:
+            raise DuplicateKeyError(f"E11000 duplicate key error dup key: {patron}", DUPLICATE_KEY)
+        existente.clear()
+        existente.update(copy.deepcopy(nuevo))
+
+    async def update_one(self, filtro: Dict, actualizacion: Dict, upsert: bool = False):
+        for documento in self.documentos:
+            if coincide(documento, filtro):
+                nuevo = copy.deepcopy(documento)
+                _aplicar_actualizacion(nuevo, actualizacion)
+                self._reemplazar(documento, nuevo)
+                return SimpleNamespace(matched_count=1, modified_count=1, upserted_id=None)
+        if upsert:
+            resultado = await self.insert_one(_documento_upsert(filtro, actualizacion))
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=resultado.inserted_id)
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+
+    async def update_many(self, filtro: Dict, actualizacion: Dict):
+        modificados = 0
+        for documento in self.documentos:
+            if coincide(documento, filtro):
+                _aplicar_actualizacion(documento, actualizacion)
+                modificados += 1
+        return SimpleNamespace(matched_count=modificados, modified_count=modificados)
+
+    async def replace_one(self, filtro: Dict, reemplazo: Dict, upsert: bool = False):
+        for documento in self.documentos:
+            if coincide(documento, filtro):
+                self._reemplazar(documento, {**reemplazo, "_id": documento["_id"]})
+                return SimpleNamespace(matched_count=1, modified_count=1, upserted_id=None)
+        if upsert:
+            resultado = await self.insert_one({**reemplazo})
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=resultado.inserted_id)
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+
+    async def find_one_and_update(
+        self,
+        filtro: Dict,
+        actualizacion: Dict,
+        projection: Optional[Dict] = None,
+        upsert: bool = False,
+        return_document: bool = ReturnDocument.BEFORE,
+        sort=None,
+        **_
+    ):
+        candidatos = CursorFalso([d for d in self.documentos if coincide(d, filtro)])
+        if sort:
+            candidatos.sort(sort)
+        encontrados = await candidatos.to_list(1)
+        if encontrados:
+            documento = next(d for d in self.documentos if d["_id"] == encontrados[0]["_id"])
+            anterior = copy.deepcopy(documento)
+            nuevo = copy.deepcopy(documento)
+            _aplicar_actualizacion(nuevo, actualizacion)
+            self._reemplazar(documento, nuevo)
+            return proyectar(documento if return_document == ReturnDocument.AFTER else anterior, projection)
+        if not upsert:
+            return None
+        documento = _documento_upsert(filtro, actualizacion)
+        await self.insert_one(documento)
+        return proyectar(documento, projection) if return_document == ReturnDocument.AFTER else None
+
+    async def delete_many(self, filtro: Dict):
+        antes = len(self.documentos)
+        self.documentos = [d for d in self.documentos if not coincide(d, filtro)]
+        return SimpleNamespace(deleted_count=antes - len(self.documentos))
+
+    async def delete_one(self, filtro: Dict):
+        for documento in self.documentos:
+            if coincide(documento, filtro):
+                self.documentos.remove(documento)
+                return SimpleNamespace(deleted_count=1)
+        return SimpleNamespace(deleted_count=0)
+
+    async def bulk_write(self, operaciones: List, ordered: bool = True):
+        conteo = {"inserted_count": 0, "modified_count": 0, "deleted_count": 0, "upserted_count": 0}
+        for operacion in operaciones:
+            if isinstance(operacion, InsertOne):
+                await self.insert_one(operacion._doc)
+                conteo["inserted_count"] += 1
+            elif isinstance(operacion, UpdateOne):
+                resultado = await self.update_one(operacion._filter, operacion._doc, upsert=bool(operacion._upsert))
+                conteo["modified_count"] += resultado.modified_count
+            elif isinstance(operacion, ReplaceOne):
+                resultado = await self.replace_one(operacion._filter, operacion._doc, upsert=bool(operacion._upsert))
+                conteo["modified_count"] += resultado.modified_count
+            elif isinstance(operacion, DeleteMany):
+                conteo["deleted_count"] += (await self.delete_many(operacion._filter)).deleted_count
+            else:
+                raise NotImplementedError(type(operacion).__name__)
+        return SimpleNamespace(**conteo)
+
+    # Lectura
+
+    async def find_one(self, filtro: Optional[Dict] = None, projection: Optional[Dict] = None, **_):
+        for documento in self.documentos:
+            if coincide(documento, filtro):
+                return proyectar(documento, projection)
+        return None
+
+    def find(self, filtro: Optional[Dict] = None, projection: Optional[Dict] = None, **_):
+        return CursorFalso([proyectar(d, projection) for d in self.documentos if coincide(d, filtro)])
+
+    async def count_documents(self, filtro: Dict, **_) -> int:
+        self.database.conteos += 1
+        return sum(1 for d in self.documentos if coincide(d, filtro))
+
+    async def distinct(self, campo: str, filtro: Optional[Dict] = None) -> List:
+        valores = []
+        for documento in self.documentos:
+            valor = _valor(documento, campo)
+            if coincide(documento, filtro) and valor is not _FALTA and valor not in valores:
+                valores.append(valor)
+        return valores
+
+    def aggregate(self, pipeline: List[Dict]):
+        # Solo el conteo de asentamientos de contar_asentamientos
+        if pipeline != [{"$group": {"_id": None, "total": {"$sum": {"$size": "$asentamientos"}}}}]:
+            raise NotImplementedError(pipeline)
+        documentos = self.documentos
+        total = sum(len(d.get("asentamientos", [])) for d in documentos)
+        return CursorFalso([{"_id": None, "total": total}] if documentos else [])
+
+
+
+class BaseDatosFalsa:
+    def __init__(self):
+        self.colecciones: Dict[str, ColeccionFalsa] = {}
+        # count_documents ejecutados, para verificar cachés de conteo
+        self.conteos = 0
+
+    def __getitem__(self, nombre: str) -> ColeccionFalsa:
+        if nombre not in self.colecciones:
+            self.colecciones[nombre] = ColeccionFalsa(self, nombre)
+        return self.colecciones[nombre]
+
+    def __getattr__(self, nombre: str) -> ColeccionFalsa:
+        if nombre.startswith("_"):
+            raise AttributeError(nombre)
+        return self[nombre]
+
+    def get_collection(self, nombre: str, **_) -> ColeccionFalsa:
+        return self[nombre]
+
+    async def drop_collection(self, nombre: str):
+        self.colecciones.pop(nombre, None)
+
+    async def list_collection_names(self, filter: Optional[Dict] = None) -> List[str]:
+        # Una colección existe si tiene documentos o índices, como en MongoDB
+        nombres = [n for n, c in self.colecciones.items() if c.documentos or c.unicos]
+        return [n for n in nombres if coincide({"name": n}, filter)]
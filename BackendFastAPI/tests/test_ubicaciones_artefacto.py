@@ -0,0 +1,41 @@
+import pytest
+
+from services import ubicaciones_artefacto
+from services.ubicaciones_artefacto import cargar_artefacto, leer_encabezado
+from services.ubicaciones_fuentes import parsear_fuente
+from services.ubicaciones_writer import CATALOGO_CONFIG_ID, COLLECTION_NAME, aplicar_diferencias, cargar_catalogo
+
+pytestmark = pytest.mark.asyncio
+
+
+async def version_publicada(db):
+    return (await db.config.find_one({"_id": CATALOGO_CONFIG_ID}))["version"]
+
+
+async def test_cada_publicacion_regenera_el_artefacto(db, xml_sintetico):
+    fuente = xml_sintetico(1500)
+    ubicaciones = parsear_fuente(fuente)
+    await cargar_catalogo(db, db, ubicaciones, fuente=fuente)
+    encabezado = leer_encabezado(ubicaciones_artefacto.ARTEFACTO_PATH)
+    assert encabezado["version"] == await version_publicada(db) == 1
+    assert encabezado["total_codigos_postales"] == len(ubicaciones)
+
+    # Recarga diferencial: otra versión, otro artefacto
+    await aplicar_diferencias(db[COLLECTION_NAME], ubicaciones[1:])
+    encabezado = leer_encabezado(ubicaciones_artefacto.ARTEFACTO_PATH)
+    assert encabezado["version"] == await version_publicada(db) == 2
+    assert encabezado["total_codigos_postales"] == len(ubicaciones) - 1
+
+
+async def test_restaurar_artefacto_conserva_la_fuente(db, xml_sintetico):
+    fuente = xml_sintetico(1500)
+    await cargar_catalogo(db, db, parsear_fuente(fuente), fuente=fuente)
+    original = await db.config.find_one({"_id": CATALOGO_CONFIG_ID})
+
+    resultado = await cargar_artefacto(db, db, ubicaciones_artefacto.ARTEFACTO_PATH)
+
+    restaurado = await db.config.find_one({"_id": CATALOGO_CONFIG_ID})
+    assert resultado["version"] == 2
+    assert restaurado["checksum_fuente"] == original["checksum_fuente"]
+    assert restaurado["total_codigos_postales"] == original["total_codigos_postales"]
+    assert leer_encabezado(ubicaciones_artefacto.ARTEFACTO_PATH)["version"] == 2
@@ -0,0 +1,88 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from routers import ubicaciones_endpoint
+from services.database import DatabaseService
+from services.ubicaciones_fuentes import parsear_fuente
+from services.ubicaciones_writer import CATALOGO_CONFIG_ID, preparar_documento
+
+
+@pytest.fixture
+def cliente(db, xml_sintetico, monkeypatch):
+    """API de ubicaciones sobre un catálogo sintético en la base falsa"""
+    db.ubicaciones.documentos = [preparar_documento(d) for d in parsear_fuente(xml_sintetico(3000))]
+    db.config.documentos = [{"_id": CATALOGO_CONFIG_ID, "version": 1}]
+    monkeypatch.setattr(DatabaseService, "_db", db)
+    monkeypatch.setattr(ubicaciones_endpoint, "_totales_estado", {})
+    app = FastAPI()
+    app.include_router(ubicaciones_endpoint.router)
+    return TestClient(app)
+
+
+def cps_del_estado(db, estado):
+    return sorted(d["codigo_postal"] for d in db.ubicaciones.documentos if d["estado"] == estado)
+
+
+def test_cursor_ida_y_vuelta():
+    ubicacion = {"estado": "Nuevo León", "codigo_postal": "64000"}
+    cursor = ubicaciones_endpoint._codificar_cursor(ubicacion)
+    assert "=" not in cursor
+    assert ubicaciones_endpoint._decodificar_cursor(cursor) == ("nuevo leon", "64000")
+
+
+@pytest.mark.parametrize("after", ["no-es-base64!", "bm8tanNvbg", "WzEsMl0", "WyJhIl0"])
+def test_cursor_invalido_responde_400(cliente, after):
+    response = cliente.get("/ubicaciones/buscar/estado/mexico", params={"after": after})
+    assert response.status_code == 400
+    assert "after" in response.json()["detail"]
+
+
+def test_paginas_con_cursor_sin_repetidos(cliente, db):
+    vistos, after, paginas = [], None, 0
+    while True:
+        params = {"limit": 25, "include_total": False}
+        if after:
+            params["after"] = after
+        pagina = cliente.get("/ubicaciones/buscar/estado/mexico", params=params).json()
+        vistos += [u["codigo_postal"] for u in pagina["ubicaciones"]]
+        paginas += 1
+        after = pagina["next_after"]
+        if not pagina["has_more"]:
+            assert after is None
+            break
+
+    esperados = cps_del_estado(db, "México")
+    assert paginas > 3
+    assert len(vistos) == len(set(vistos))
+    assert vistos == esperados
+
+
+def test_total_por_version_publicada(cliente, db):
+    total = len(cps_del_estado(db, "México"))
+    assert cliente.get("/ubicaciones/buscar/estado/mexico").json()["total"] == total
+    conteos = db.conteos
+    assert cliente.get("/ubicaciones/buscar/estado/mexico").json()["total"] == total
+    assert db.conteos == conteos
+
+    # Otra versión publicada (aunque este proceso no haya recargado su copia) se cuenta de nuevo
+    primero = cps_del_estado(db, "México")[0]
+    db.ubicaciones.documentos = [d for d in db.ubicaciones.documentos if d["codigo_postal"] != primero]
+    db.config.documentos[0]["version"] = 2
+    assert cliente.get("/ubicaciones/buscar/estado/mexico").json()["total"] == total - 1
+    assert db.conteos == conteos + 1
+
+
+@pytest.mark.parametrize("ruta", [
+    "/ubicaciones/autocomplete?q=centro",
+    "/ubicaciones/buscar/asentamiento?q=centro",
+    "/ubicaciones/estados",
+    "/ubicaciones/estados/09/municipios",
+])
+def test_indices_sin_construir_responden_503(cliente, ruta, monkeypatch):
+    from services.ubicaciones_cache import CatalogoUbicaciones
+    for atributo in ("_autocompletado", "_trigramas", "_jerarquia"):
+        monkeypatch.setattr(CatalogoUbicaciones, atributo, None)
+    response = cliente.get(ruta)
+    assert response.status_code == 503
+    assert response.json()["detail"] == "El catálogo de ubicaciones no está disponible en memoria"
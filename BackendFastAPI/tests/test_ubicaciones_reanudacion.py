@@ -0,0 +1,166 @@
+import asyncio
+
+import pytest
+
+from services import ubicaciones_writer
+from services.ubicaciones_jobs import carga_exclusiva
+from services.ubicaciones_writer import (
+    COLLECTION_NAME,
+    JOBS_COLLECTION_NAME,
+    STAGING_COLLECTION_NAME,
+    cargar_fuente,
+    checksum_archivo,
+    obtener_checkpoint,
+)
+from tests.mongo_falso import BaseDatosFalsa, ColeccionFalsa
+
+pytestmark = pytest.mark.asyncio
+
+FILAS = 8000
+LOTE = 40
+
+
+@pytest.fixture(autouse=True)
+def lotes_pequenos(monkeypatch):
+    """Muchos lotes y un checkpoint por lote, para interrumpir a media carga"""
+    monkeypatch.setattr(ubicaciones_writer, "DEFAULT_BATCH_SIZE", LOTE)
+    monkeypatch.setattr(ubicaciones_writer, "INTERVALO_CHECKPOINT", 0)
+
+
+@pytest.fixture
+def fuente_con_rezagados(xml_sintetico, tmp_path):
+    """
+    XML sintético con registros fuera de orden: a la mitad del archivo
+    reaparecen CPs del principio, con un asentamiento nuevo y uno repetido.
+    """
+    lineas = open(xml_sintetico(FILAS), encoding="utf-8").readlines()
+    tablas = [i for i, linea in enumerate(lineas) if linea.startswith("<table>")]
+    rezagados = []
+    for i in tablas[:30:3]:
+        rezagados.append(lineas[i])
+        rezagados.append(lineas[i].replace("<d_asenta>Asentamiento", "<d_asenta>Rezagado"))
+    mitad = tablas[len(tablas) // 2]
+    while not lineas[mitad].startswith("<table><d_codigo>") or lineas[mitad][17:22] == lineas[mitad - 1][17:22]:
+        mitad += 1
+    path = tmp_path / "rezagados.xml"
+    path.write_text("".join(lineas[:mitad] + rezagados + lineas[mitad:]), encoding="utf-8")
+    return str(path)
+
+
+async def cargar(db, fuente):
+    async with carga_exclusiva(db, "pruebas") as latido:
+        return await cargar_fuente(db, db, fuente, progreso=latido)
+
+
+async def cargar_interrumpida(db, fuente, monkeypatch, despues_de_lotes: int):
+    """Cancelar la carga (como un reinicio del contenedor) tras `despues_de_lotes` inserciones"""
+    tarea = asyncio.create_task(cargar(db, fuente))
+    insert_many = ColeccionFalsa.insert_many
+    lotes = 0
+
+    async def insert_many_interrumpido(self, documentos, ordered=True):
+        nonlocal lotes
+        lotes += 1
+        if lotes == despues_de_lotes:
+            tarea.cancel()
+        return await insert_many(self, documentos, ordered=ordered)
+
+    monkeypatch.setattr(ColeccionFalsa, "insert_many", insert_many_interrumpido)
+    with pytest.raises(asyncio.CancelledError):
+        await tarea
+    monkeypatch.setattr(ColeccionFalsa, "insert_many", insert_many)
+
+
+def catalogo(db):
+    """Documentos publicados por CP, sin _id"""
+    documentos = {}
+    for documento in db[COLLECTION_NAME].documentos:
+        documento = {k: v for k, v in documento.items() if k != "_id"}
+        assert documento["codigo_postal"] not in documentos, "CP duplicado"
+        documentos[documento["codigo_postal"]] = documento
+    return documentos
+
+
+async def checkpoints(db):
+    return [job["checkpoint"] async for job in db[JOBS_COLLECTION_NAME].find({"checkpoint": {"$exists": True}})]
+
+
+async def test_reanudar_da_el_mismo_catalogo(fuente_con_rezagados, monkeypatch, capsys):
+    completa = BaseDatosFalsa()
+    await cargar(completa, fuente_con_rezagados)
+
+    db = BaseDatosFalsa()
+    await cargar_interrumpida(db, fuente_con_rezagados, monkeypatch, despues_de_lotes=20)
+    checkpoint = await obtener_checkpoint(db, checksum_archivo(fuente_con_rezagados))
+    assert 0 < checkpoint["filas"] < FILAS
+    assert not db[COLLECTION_NAME].documentos
+    capsys.readouterr()
+
+    resultado = await cargar(db, fuente_con_rezagados)
+
+    assert f"Reanudando carga desde la fila {checkpoint['filas']}" in capsys.readouterr().out
+    assert catalogo(db) == catalogo(completa)
+    assert resultado["total_codigos_postales"] == len(catalogo(completa))
+    assert STAGING_COLLECTION_NAME not in await db.list_collection_names()
+    assert await checkpoints(db) == []
+
+
+@pytest.mark.parametrize("checkpoint_rezagados", [False, True])
+async def test_reanudar_fusiona_rezagados_sin_duplicar(fuente_con_rezagados, monkeypatch, checkpoint_rezagados):
+    completa = BaseDatosFalsa()
+    await cargar(completa, fuente_con_rezagados)
+
+    # Caída dura: la colección sombra tiene lotes posteriores al último
+    # checkpoint que alcanzó a guardarse. Ese checkpoint es anterior a los
+    # registros rezagados (se vuelven a leer) o ya los trae pendientes
+    guardados = []
+    guardar_checkpoint = ubicaciones_writer.guardar_checkpoint
+
+    async def registrar(db, checkpoint):
+        guardados.append(checkpoint)
+        await guardar_checkpoint(db, checkpoint)
+
+    monkeypatch.setattr(ubicaciones_writer, "guardar_checkpoint", registrar)
+    db = BaseDatosFalsa()
+    await cargar_interrumpida(db, fuente_con_rezagados, monkeypatch, despues_de_lotes=28)
+    assert guardados[-1]["rezagados"], "la interrupción debe caer después de los rezagados"
+    if checkpoint_rezagados:
+        anterior = next(c for c in guardados if c["rezagados"])
+    else:
+        anterior = [c for c in guardados if not c["rezagados"]][-1]
+    assert anterior["filas"] < guardados[-1]["filas"]
+    assert len(db[STAGING_COLLECTION_NAME].documentos) > 0
+    await db[JOBS_COLLECTION_NAME].update_many(
+        {"checkpoint": {"$exists": True}}, {"$set": {"checkpoint": anterior}}
+    )
+
+    resultado = await cargar(db, fuente_con_rezagados)
+
+    assert resultado["total_rechazados"] == 0
+    esperado = catalogo(completa)
+    obtenido = catalogo(db)
+    assert obtenido == esperado
+    for codigo_postal, documento in obtenido.items():
+        nombres = [a["nombre"] for a in documento["asentamientos"]]
+        assert len(nombres) == len(set(nombres)), codigo_postal
+    assert any(
+        a["nombre"].startswith("Rezagado") for documento in obtenido.values() for a in documento["asentamientos"]
+    )
+
+
+async def test_otro_archivo_descarta_el_checkpoint(fuente_con_rezagados, xml_sintetico, monkeypatch, capsys):
+    db = BaseDatosFalsa()
+    await cargar_interrumpida(db, fuente_con_rezagados, monkeypatch, despues_de_lotes=20)
+    assert await checkpoints(db)
+
+    otra = xml_sintetico(3000, "otra.xml")
+    assert await obtener_checkpoint(db, checksum_archivo(otra)) is None
+    completa = BaseDatosFalsa()
+    await cargar(completa, otra)
+    capsys.readouterr()
+
+    await cargar(db, otra)
+
+    assert "Reanudando" not in capsys.readouterr().out
+    assert catalogo(db) == catalogo(completa)
+    assert await checkpoints(db) == []
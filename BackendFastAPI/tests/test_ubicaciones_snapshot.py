@@ -0,0 +1,87 @@
+import json
+import os
+import zlib
+
+import pytest
+
+from models.ubicacion_model import Ubicacion
+from services.ubicaciones_fuentes import parsear_fuente
+from services.ubicaciones_registros import codificar_respuesta
+from services.ubicaciones_snapshot import ENCABEZADO, SnapshotCatalogo, abrir_snapshot, escribir_snapshot
+
+
+@pytest.fixture
+def documentos(xml_sintetico):
+    return parsear_fuente(xml_sintetico(2000))
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "catalogo.snap")
+
+
+def test_ida_y_vuelta(documentos, path):
+    assert escribir_snapshot(path, reversed(documentos), version=7) == len(documentos)
+
+    snapshot = abrir_snapshot(path, 7)
+    try:
+        assert snapshot.version == 7
+        assert len(snapshot) == len(documentos)
+        por_cp = {doc["codigo_postal"]: doc for doc in documentos}
+
+        # Recorrido completo, en orden de CP
+        assert list(snapshot.iter_documentos()) == [por_cp[cp] for cp in sorted(por_cp)]
+
+        for i, codigo_postal in enumerate(sorted(por_cp)):
+            doc = por_cp[codigo_postal]
+            assert snapshot.buscar(codigo_postal) == doc
+            assert snapshot.respuesta(codigo_postal) == zlib.decompress(codificar_respuesta(doc))
+            assert json.loads(snapshot.respuesta(codigo_postal)) == Ubicacion(**doc).dict()
+            assert snapshot.campos_cp(i, ("codigo_postal", "estado")) == (codigo_postal, doc["estado"])
+            ultimo = doc["asentamientos"][-1]
+            assert snapshot.campos_asentamiento(i, len(doc["asentamientos"]) - 1, ("nombre", "zona")) == (
+                ultimo["nombre"], ultimo["zona"]
+            )
+
+        for faltante in ("00000", "99999", "0100", "abcde"):
+            assert snapshot.buscar(faltante) is None
+            assert snapshot.respuesta(faltante) is None
+    finally:
+        snapshot.cerrar()
+
+
+def test_otra_version_no_se_abre(documentos, path):
+    escribir_snapshot(path, documentos, version=3)
+    assert abrir_snapshot(path, 4) is None
+    assert abrir_snapshot(path, None) is None
+    assert abrir_snapshot(str(os.path.dirname(path) + "/no-existe.snap"), 3) is None
+
+
+@pytest.mark.parametrize("contenido", [
+    b"",
+    b"UBCP",
+    b"no es un snapshot" * 10,
+    b"XXXX" + bytes(ENCABEZADO.size),
+])
+def test_archivo_corrupto_no_se_abre(path, contenido):
+    with open(path, "wb") as f:
+        f.write(contenido)
+    assert abrir_snapshot(path, 0) is None
+
+
+def test_formato_anterior_no_se_abre(documentos, path):
+    escribir_snapshot(path, documentos, version=1)
+    with open(path, "r+b") as f:
+        f.seek(4)
+        f.write((1).to_bytes(2, "little"))
+    assert abrir_snapshot(path, 1) is None
+    with pytest.raises(ValueError):
+        SnapshotCatalogo(path)
+
+
+@pytest.mark.parametrize("codigo_postal", ["1000", "010000", "0100á"])
+def test_cp_que_no_tiene_cinco_digitos(documentos, path, codigo_postal):
+    documentos[0]["codigo_postal"] = codigo_postal
+    with pytest.raises(ValueError):
+        escribir_snapshot(path, documentos, version=1)
+    assert not os.path.exists(path)
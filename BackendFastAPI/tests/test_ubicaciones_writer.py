@@ -0,0 +1,130 @@
+import asyncio
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+from services import ubicaciones_writer
+from services.ubicaciones_writer import CODIGOS_REINTENTABLES, DUPLICATE_KEY, MAX_REINTENTOS, BulkWriter
+
+pytestmark = pytest.mark.asyncio
+
+REINTENTABLE = sorted(CODIGOS_REINTENTABLES)[0]
+
+
+@pytest.fixture(autouse=True)
+def sin_esperas(monkeypatch):
+    """Los reintentos no esperan el backoff real"""
+    dormir = asyncio.sleep
+    monkeypatch.setattr(ubicaciones_writer.asyncio, "sleep", lambda _: dormir(0))
+
+
+def error(indice: int, codigo: int, clave: str = "codigo_postal") -> dict:
+    return {"index": indice, "code": codigo, "keyPattern": {clave: 1}, "errmsg": f"error {codigo} en {indice}"}
+
+
+class ColeccionConErrores:
+    """
+    Colección cuyo insert_many responde con los errores programados por intento.
+
+    Cada intento recibe una lista de writeErrors (índices relativos a los
+    documentos de ese intento); los documentos sin error se insertan.
+    """
+
+    def __init__(self, *intentos):
+        self.intentos = list(intentos)
+        self.llamadas = []
+        self.insertados = []
+
+    async def insert_many(self, documentos, ordered=True):
+        assert ordered is False
+        self.llamadas.append([d["codigo_postal"] for d in documentos])
+        errores = self.intentos.pop(0) if self.intentos else []
+        fallidos = {e["index"] for e in errores}
+        nuevos = [d for i, d in enumerate(documentos) if i not in fallidos]
+        self.insertados += [d["codigo_postal"] for d in nuevos]
+        if errores:
+            raise BulkWriteError({"nInserted": len(nuevos), "writeErrors": errores, "writeConcernErrors": []})
+        return type("Resultado", (), {"inserted_ids": [object() for _ in nuevos]})()
+
+
+def lote(total: int):
+    return [{"codigo_postal": f"{i:05d}"} for i in range(1, total + 1)]
+
+
+async def test_errores_mixtos_se_reintentan_solo_los_transitorios():
+    coleccion = ColeccionConErrores(
+        [
+            error(1, DUPLICATE_KEY),              # CP repetido en el archivo
+            error(2, REINTENTABLE),
+            error(3, DUPLICATE_KEY, clave="_id"),  # ya insertado en un intento perdido
+            error(5, REINTENTABLE),
+        ],
+        [error(1, REINTENTABLE)],                  # 00006 vuelve a fallar
+    )
+    writer = BulkWriter(coleccion)
+
+    await writer.escribir(lote(6))
+    await writer.cerrar()
+
+    assert coleccion.llamadas == [
+        ["00001", "00002", "00003", "00004", "00005", "00006"],
+        ["00003", "00006"],
+        ["00006"],
+    ]
+    reporte = writer.reporte()
+    # 00001 y 00005 al primer intento, 00004 por _id duplicado, 00003 y 00006 reintentados
+    assert reporte["total_insertados"] == 5
+    assert reporte["reintentos"] == 2
+    assert reporte["total_rechazados"] == 1
+    assert reporte["rechazados"] == [
+        {"codigo_postal": "00002", "codigo_error": DUPLICATE_KEY, "mensaje": "error 11000 en 1"}
+    ]
+
+
+async def test_reintentos_agotados_quedan_en_el_reporte():
+    coleccion = ColeccionConErrores(*[[error(0, REINTENTABLE)] for _ in range(MAX_REINTENTOS + 1)])
+    writer = BulkWriter(coleccion)
+
+    await writer.escribir(lote(3))
+    await writer.cerrar()
+
+    assert len(coleccion.llamadas) == MAX_REINTENTOS + 1
+    assert all(llamada == ["00001"] for llamada in coleccion.llamadas[1:])
+    assert writer.total_insertados == 2
+    assert writer.rechazados == [
+        {"codigo_postal": "00001", "codigo_error": None, "mensaje": f"Reintentos agotados ({MAX_REINTENTOS})"}
+    ]
+
+
+async def test_separar_errores():
+    writer = BulkWriter(ColeccionConErrores())
+    pendientes = lote(4)
+
+    reintentar = writer._separar_errores(
+        {
+            "nInserted": 1,
+            "writeErrors": [
+                error(0, REINTENTABLE),
+                error(1, DUPLICATE_KEY, clave="_id"),
+                error(2, 121),
+            ],
+        },
+        pendientes,
+    )
+
+    assert reintentar == [pendientes[0]]
+    assert writer.total_insertados == 2
+    assert writer.rechazados == [{"codigo_postal": "00003", "codigo_error": 121, "mensaje": "error 121 en 2"}]
+
+
+async def test_checkpoint_avanza_en_orden():
+    writer = BulkWriter(ColeccionConErrores())
+    for numero in (1, 2, 3):
+        writer._marcas[numero] = {"filas": numero * 10}
+
+    writer._terminar(2)
+    assert writer.checkpoint is None
+    writer._terminar(1)
+    assert writer.checkpoint == {"filas": 20}
+    writer._terminar(3)
+    assert writer.checkpoint == {"filas": 30}
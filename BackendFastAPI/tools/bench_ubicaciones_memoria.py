@@ -0,0 +1,76 @@
+"""
+Memoria del catálogo de CPs en sus distintas representaciones.
+
+Mide con tracemalloc lo que ocupa el catálogo completo:
+  - documentos como los entrega MongoDB (cada cadena es un objeto nuevo)
+  - documentos del parser (valores internados)
+  - registros compactos de services/ubicaciones_registros.py
+
+Por default usa un archivo sintético con la estructura de CPdescarga.xml;
+con --xml se mide el archivo real de SEPOMEX.
+
+Uso (desde BackendFastAPI/):
+    python tools/bench_ubicaciones_memoria.py --rows 150000
+    python tools/bench_ubicaciones_memoria.py --xml CPdescarga.xml
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bench_ubicaciones_parser import generar_xml_sintetico  # noqa: E402
+from services.ubicaciones_parser import agrupar_ubicaciones, iter_xml_filas  # noqa: E402
+from services.ubicaciones_registros import compactar  # noqa: E402
+
+
+def medir(nombre: str, construir):
+    """Bytes retenidos por el resultado de `construir()` (sin contar temporales)"""
+    gc.collect()
+    antes = tracemalloc.get_traced_memory()[0]
+    resultado = construir()
+    gc.collect()
+    retenido = tracemalloc.get_traced_memory()[0] - antes
+    print(f"{nombre:<26} {retenido / 1e6:8.1f} MB")
+    return resultado, retenido
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--rows", type=int, default=150_000, help="Número de registros <table> a generar")
+    arg_parser.add_argument("--xml", help="Archivo CPdescarga.xml real (en lugar del sintético)")
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        xml_file_path = args.xml
+        if not xml_file_path:
+            xml_file_path = os.path.join(tmp, "CPdescarga.xml")
+            generar_xml_sintetico(xml_file_path, args.rows)
+        documentos = agrupar_ubicaciones(iter_xml_filas(xml_file_path))
+
+    total_asentamientos = sum(len(doc["asentamientos"]) for doc in documentos)
+    print(f"{len(documentos)} CPs, {total_asentamientos} asentamientos\n")
+
+    # Copia sin cadenas compartidas, como la decodifica el driver desde BSON
+    serializado = json.dumps(documentos)
+
+    tracemalloc.start()
+    _, t_mongo = medir("documentos (MongoDB)", lambda texto=serializado: json.loads(texto))
+    del serializado
+    # Los documentos del parser ya existen: se mide una copia que comparte sus cadenas
+    _, t_parser = medir("documentos (internados)", lambda: [
+        {**doc, "asentamientos": [dict(a) for a in doc["asentamientos"]]} for doc in documentos
+    ])
+    _, t_registros = medir("registros compactos", lambda: compactar(documentos))
+    tracemalloc.stop()
+
+    print(f"\n  registros vs documentos MongoDB:    x{t_mongo / t_registros:.2f} menos memoria")
+    print(f"  registros vs documentos internados: x{t_parser / t_registros:.2f} menos memoria")
+
+
+if __name__ == "__main__":
+    main()
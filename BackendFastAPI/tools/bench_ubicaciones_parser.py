@@ -0,0 +1,203 @@
+"""
+Benchmark del parser de CPdescarga.xml sobre un archivo sintético.
+
+Compara el parser anterior (ET.parse + dos find() por campo + deduplicación
+por lista) contra el decodificador de una sola pasada de
+services/ubicaciones_parser.py, primero sobre el mismo árbol completo y
+después con el recorrido streaming (iterparse) que usa la aplicación.
+También mide las otras fuentes que acepta la carga: el TXT separado por
+'|' y los archivos .zip/.gz, todos con el mismo contenido.
+
+Uso (desde BackendFastAPI/):
+    python tools/bench_ubicaciones_parser.py --rows 150000
+"""
+import argparse
+import gzip
+import os
+import random
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from services.ubicaciones_fuentes import iter_filas  # noqa: E402
+from services.ubicaciones_parser import (  # noqa: E402
+    agrupar_ubicaciones,
+    decodificar_fila,
+    iter_xml_filas,
+    resolver_prefijo,
+)
+
+ESTADOS = ["Aguascalientes", "Ciudad de México", "Jalisco", "México", "Nuevo León", "Yucatán"]
+TIPOS = ["Colonia", "Fraccionamiento", "Barrio", "Pueblo", "Unidad habitacional"]
+
+
+def generar_xml_sintetico(path: str, rows: int, seed: int = 42):
+    """Escribir un archivo con la misma estructura que CPdescarga.xml"""
+    rnd = random.Random(seed)
+    codigo_postal = 1000
+    escritos = 0
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" standalone="yes"?>\n<NewDataSet xmlns="NewDataSet">\n')
+        while escritos < rows:
+            estado = ESTADOS[codigo_postal % len(ESTADOS)]
+            for i in range(rnd.randint(1, 12)):
+                if escritos >= rows:
+                    break
+                f.write(
+                    "<table>"
+                    f"<d_codigo>{codigo_postal:05d}</d_codigo>"
+                    f"<d_asenta>Asentamiento {i % 9}</d_asenta>"
+                    f"<d_tipo_asenta>{rnd.choice(TIPOS)}</d_tipo_asenta>"
+                    f"<D_mnpio>Municipio {codigo_postal // 100}</D_mnpio>"
+                    f"<d_estado>{estado}</d_estado>"
+                    f"<d_ciudad>Ciudad {codigo_postal // 1000}</d_ciudad>"
+                    f"<d_CP>{codigo_postal // 10 * 10 + 1:05d}</d_CP>"
+                    f"<c_estado>{codigo_postal % 32 + 1:02d}</c_estado>"
+                    f"<c_oficina>{codigo_postal // 10 * 10 + 1:05d}</c_oficina>"
+                    "<c_CP />"
+                    "<c_tipo_asenta>09</c_tipo_asenta>"
+                    f"<c_mnpio>{codigo_postal // 100 % 1000:03d}</c_mnpio>"
+                    f"<id_asenta_cpcons>{i:04d}</id_asenta_cpcons>"
+                    f"<d_zona>{'Urbano' if i % 3 else 'Rural'}</d_zona>"
+                    "<c_cve_ciudad>01</c_cve_ciudad>"
+                    "</table>\n"
+                )
+                escritos += 1
+            codigo_postal += 1
+        f.write("</NewDataSet>\n")
+
+
+def generar_txt_sintetico(xml_file_path: str, txt_file_path: str):
+    """Escribir el TXT de SEPOMEX (aviso, encabezado y campos con '|') con los registros del XML"""
+    filas = iter_xml_filas(xml_file_path)
+    primera = next(filas)
+    campos = list(primera)
+    with open(txt_file_path, "w", encoding="latin-1", newline="") as f:
+        f.write("El Catálogo Nacional de Códigos Postales, es elaborado por Correos de México.\r\n")
+        f.write("|".join(campos) + "\r\n")
+        for fila in [primera, *filas]:
+            f.write("|".join(fila.get(c, "") for c in campos) + "\r\n")
+
+
+def comprimir(path: str, formato: str) -> str:
+    """Copia del archivo en .zip o .gz"""
+    if formato == "zip":
+        destino = os.path.splitext(path)[0] + ".zip"
+        with zipfile.ZipFile(destino, "w", zipfile.ZIP_DEFLATED) as archivo:
+            archivo.write(path, os.path.basename(path))
+    else:
+        destino = path + ".gz"
+        with open(path, "rb") as origen, gzip.open(destino, "wb") as f:
+            f.write(origen.read())
+    return destino
+
+
+def _get_element_text_anterior(parent, tag_name: str) -> str:
+    namespace = {'ns': 'NewDataSet'}
+    element = parent.find(f'ns:{tag_name}', namespace)
+    if element is None:
+        element = parent.find(tag_name)
+    return element.text.strip() if element is not None and element.text else ""
+
+
+def parser_anterior(xml_file_path: str):
+    """Copia del parse_xml_to_ubicaciones original, como referencia"""
+    cp_dict = {}
+    root = ET.parse(xml_file_path).getroot()
+    namespace = {'ns': 'NewDataSet'}
+    tables = root.findall('.//ns:table', namespace) or root.findall('.//table')
+    for table in tables:
+        codigo_postal = ''.join(filter(str.isdigit, _get_element_text_anterior(table, 'd_codigo')))
+        if not codigo_postal:
+            continue
+        codigo_postal = codigo_postal.zfill(5)
+        asentamiento = {
+            'nombre': _get_element_text_anterior(table, 'd_asenta'),
+            'tipo': _get_element_text_anterior(table, 'd_tipo_asenta'),
+            'zona': _get_element_text_anterior(table, 'd_zona'),
+            'codigo_tipo': _get_element_text_anterior(table, 'c_tipo_asenta'),
+            'id_asentamiento': _get_element_text_anterior(table, 'id_asenta_cpcons')
+        }
+        if codigo_postal not in cp_dict:
+            cp_dict[codigo_postal] = {
+                'codigo_postal': codigo_postal,
+                'municipio': _get_element_text_anterior(table, 'D_mnpio'),
+                'estado': _get_element_text_anterior(table, 'd_estado'),
+                'ciudad': _get_element_text_anterior(table, 'd_ciudad'),
+                'cp_oficina': _get_element_text_anterior(table, 'd_CP'),
+                'codigo_estado': _get_element_text_anterior(table, 'c_estado'),
+                'codigo_oficina': _get_element_text_anterior(table, 'c_oficina'),
+                'codigo_cp': _get_element_text_anterior(table, 'c_CP'),
+                'codigo_municipio': _get_element_text_anterior(table, 'c_mnpio'),
+                'codigo_ciudad': _get_element_text_anterior(table, 'c_cve_ciudad'),
+                'asentamientos': []
+            }
+        asentamientos_existentes = [a['nombre'] for a in cp_dict[codigo_postal]['asentamientos']]
+        if asentamiento['nombre'] not in asentamientos_existentes:
+            cp_dict[codigo_postal]['asentamientos'].append(asentamiento)
+    return list(cp_dict.values())
+
+
+def parser_decodificador(xml_file_path: str):
+    """Decodificador de una pasada sobre el árbol completo (aísla el costo de find())"""
+    root = ET.parse(xml_file_path).getroot()
+    prefijo = resolver_prefijo(root.tag)
+    filas = (decodificar_fila(table, prefijo) for table in root.iter(prefijo + 'table'))
+    return agrupar_ubicaciones(filas)
+
+
+def parser_streaming(xml_file_path: str):
+    return agrupar_ubicaciones(iter_xml_filas(xml_file_path))
+
+
+def medir(nombre: str, parser, xml_file_path: str, rows: int):
+    inicio = time.perf_counter()
+    ubicaciones = parser(xml_file_path)
+    duracion = time.perf_counter() - inicio
+    print(f"{nombre:<28} {duracion:8.2f} s  {rows / duracion:12,.0f} filas/s  ({len(ubicaciones)} CPs)")
+    return ubicaciones, duracion
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--rows", type=int, default=150_000, help="Número de registros <table> a generar")
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        xml_file_path = os.path.join(tmp, "CPdescarga.xml")
+        generar_xml_sintetico(xml_file_path, args.rows)
+        print(f"Archivo sintético: {args.rows} filas, {os.path.getsize(xml_file_path) / 1e6:.1f} MB\n")
+
+        anterior, t_anterior = medir("anterior", parser_anterior, xml_file_path, args.rows)
+        decodificado, t_decodificado = medir("decodificador", parser_decodificador, xml_file_path, args.rows)
+        streaming, t_streaming = medir("streaming", parser_streaming, xml_file_path, args.rows)
+
+        txt_file_path = os.path.join(tmp, "CPdescarga.txt")
+        generar_txt_sintetico(xml_file_path, txt_file_path)
+        print("\nFuentes (streaming):")
+        fuentes = []
+        for path in (
+            xml_file_path,
+            comprimir(xml_file_path, "gz"),
+            txt_file_path,
+            comprimir(txt_file_path, "gz"),
+            comprimir(txt_file_path, "zip"),
+        ):
+            nombre = f"{os.path.basename(path)} ({os.path.getsize(path) / 1e6:.1f} MB)"
+            fuentes.append(medir(nombre, lambda p: agrupar_ubicaciones(iter_filas(p)), path, args.rows))
+
+        if not anterior == decodificado == streaming or any(resultado != anterior for resultado, _ in fuentes):
+            print("\n✗ Los resultados de los parsers no coinciden")
+            sys.exit(1)
+
+        print("\n✓ Resultados idénticos")
+        print(f"  decodificador vs anterior: x{t_anterior / t_decodificado:.2f}")
+        print(f"  streaming vs anterior:     x{t_anterior / t_streaming:.2f} (memoria constante)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Exportar o restaurar el artefacto precompilado del catálogo de CPs.
+
+El artefacto (documentos BSON en un flujo gzip, ver
+services/ubicaciones_artefacto.py) permite levantar un ambiente nuevo o
+recuperar el catálogo sin parsear el XML de SEPOMEX.
+
+Uso (desde BackendFastAPI/):
+    # Desde el catálogo publicado en MongoDB
+    python tools/catalogo_artefacto.py exportar --salida catalogo.bson.gz
+    # Desde el archivo de SEPOMEX, sin MongoDB
+    python tools/catalogo_artefacto.py exportar --fuente CPdescarga.txt --salida catalogo.bson.gz
+    # Restaurar en la base configurada en MONGO_URI
+    python tools/catalogo_artefacto.py importar --artefacto catalogo.bson.gz
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from services.database import DatabaseService  # noqa: E402
+from services.ubicaciones_artefacto import (  # noqa: E402
+    ARTEFACTO_PATH,
+    cargar_artefacto,
+    escribir_artefacto,
+    exportar_artefacto,
+    leer_encabezado,
+)
+from services.ubicaciones_fuentes import parsear_fuente  # noqa: E402
+from services.ubicaciones_writer import checksum_archivo  # noqa: E402
+
+
+def _conectar():
+    load_dotenv()
+    DatabaseService.connect(os.getenv("MONGO_URI", "mongodb://localhost:27017"), "lacs")
+    return DatabaseService.get_db()
+
+
+async def exportar(args):
+    inicio = time.perf_counter()
+    if args.fuente:
+        documentos = parsear_fuente(args.fuente)
+        total = escribir_artefacto(args.salida, documentos, {
+            "archivo_fuente": os.path.abspath(args.fuente),
+            "checksum_fuente": checksum_archivo(args.fuente),
+        })
+    else:
+        encabezado = await exportar_artefacto(_conectar(), args.salida)
+        if encabezado is None:
+            print("✗ No hay catálogo publicado para exportar")
+            sys.exit(1)
+        total = encabezado["total_codigos_postales"]
+    print(f"✓ {total} CPs en {args.salida} ({os.path.getsize(args.salida) / 1e6:.1f} MB, "
+          f"{time.perf_counter() - inicio:.2f} s)")
+
+
+async def importar(args):
+    encabezado = leer_encabezado(args.artefacto)
+    print(f"Artefacto: {encabezado['total_codigos_postales']} CPs, creado {encabezado['creado']}")
+    inicio = time.perf_counter()
+    db = _conectar()
+    resultado = await cargar_artefacto(db, DatabaseService.get_bulk_db(), args.artefacto)
+    print(f"✓ Publicada la versión {resultado['version']}: {resultado['total_codigos_postales']} CPs, "
+          f"{resultado['total_rechazados']} rechazados ({time.perf_counter() - inicio:.2f} s)")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    comandos = arg_parser.add_subparsers(dest="comando", required=True)
+
+    exportar_parser = comandos.add_parser("exportar", help="Escribir el artefacto")
+    exportar_parser.add_argument("--fuente", help="Archivo de SEPOMEX (XML, TXT, .gz o .zip); sin él se lee MongoDB")
+    exportar_parser.add_argument("--salida", default=ARTEFACTO_PATH, help="Ruta del artefacto")
+
+    importar_parser = comandos.add_parser("importar", help="Restaurar el catálogo desde el artefacto")
+    importar_parser.add_argument("--artefacto", default=ARTEFACTO_PATH, help="Ruta del artefacto")
+
+    args = arg_parser.parse_args()
+    asyncio.run(exportar(args) if args.comando == "exportar" else importar(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""
+Worker de cargas del catálogo de ubicaciones.
+
+Toma los jobs que encola POST /api/ubicaciones/load y los ejecuta fuera del
+proceso de uvicorn. Uso (desde BackendFastAPI/):
+    python worker.py
+"""
+import asyncio
+import os
+import socket
+from dotenv import load_dotenv
+from services.database import DatabaseService
+from services.ubicaciones_jobs import asegurar_indices, ejecutar_job, reclamar_job
+
+# Segundos entre consultas cuando no hay jobs pendientes
+POLL_INTERVAL = float(os.getenv("UBICACIONES_WORKER_POLL_SECONDS", "5"))
+
+
+async def main():
+    load_dotenv()
+    mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+    DatabaseService.connect(mongo_uri, "lacs")
+    db = DatabaseService.get_db()
+
+    await asegurar_indices(db)
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    print(f"Worker de ubicaciones {worker_id} esperando jobs...")
+
+    while True:
+        job = await reclamar_job(db, worker_id)
+        if job is None:
+            await asyncio.sleep(POLL_INTERVAL)
+            continue
+
+        await ejecutar_job(db, DatabaseService.get_bulk_db(), job)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())